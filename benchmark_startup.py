@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+# Each of these is run in a fresh interpreter, the way it would be when
+# running visual_diff.py or generate_report.py from the command line.
+_COMMANDS = {
+    "python itself": ["-c", "pass"],
+    "import visual_diff": ["-c", "import visual_diff"],
+    "import generate_report": ["-c", "import generate_report"],
+    "import tokenizer + code_tokenize": [
+        "-c", "import tokenizer, code_tokenize"],
+    "visual_diff.py --help": ["visual_diff.py", "--help"],
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Measure how long it takes to start up")
+    parser.add_argument("--runs", "-r", type=int, default=10,
+                        help="Number of times to run each command")
+    return parser.parse_args()
+
+
+def time_command(arguments: list[str], runs: int) -> list[float]:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *arguments], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main() -> None:
+    args = parse_args()
+    print(f"{'command':<36}{'median':>10}{'min':>10}  (milliseconds)")
+    for name, arguments in _COMMANDS.items():
+        durations = [1000 * d for d in time_command(arguments, args.runs)]
+        print(f"{name:<36}{statistics.median(durations):>10.1f}"
+              f"{min(durations):>10.1f}")
+    print("For details on individual modules, run "
+          "`python3 -X importtime visual_diff.py --help`.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import collections
+import hashlib
+import os
+import re
+from typing import Iterable, Iterator, Optional, Self
+
+
+# Files are read this many bytes at a time when hashing them.
+_CHUNK_SIZE = 1 << 20
+
+
+class IgnoreRules:
+    """
+    A list of patterns in the format of a .gitignore file, which decide which
+    files and directories to leave out. Patterns are matched against paths
+    relative to the directory the rules came from (base). As in git, a pattern
+    with a slash anywhere but at the end only matches from the base, one
+    without can match in any directory below it, one ending in a slash only
+    matches directories, and one starting with ! includes things that earlier
+    patterns left out. The last pattern that matches wins.
+    """
+    def __init__(self, patterns: Iterable[str], base: str=".") -> None:
+        self.base = base
+        self._rules: list[tuple[re.Pattern[str], bool, bool]] = []
+        for pattern in patterns:
+            pattern = pattern.rstrip("\n").rstrip(" ")
+            if not pattern or pattern.startswith("#"):
+                continue
+            is_negated = pattern.startswith("!")
+            if is_negated:
+                pattern = pattern[1:]
+            elif pattern.startswith("\\"):
+                pattern = pattern[1:]  # Escapes a leading ! or #
+            is_directory_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if not pattern:
+                continue
+            regex = _translate(pattern.lstrip("/"))
+            if "/" not in pattern:
+                regex = f"(?:.*/)?{regex}"
+            self._rules.append(
+                (re.compile(regex, re.DOTALL), is_negated, is_directory_only))
+
+    @classmethod
+    def from_file(cls, filename: str) -> Self:
+        with open(filename, errors="replace") as f:
+            return cls(f, os.path.dirname(filename) or ".")
+
+    def match(self, path: str, is_directory: bool) -> Optional[bool]:
+        """
+        We return whether the path (relative to the current directory, not the
+        base) is ignored, or None if no pattern says either way.
+        """
+        relative = os.path.relpath(path, self.base).replace(os.sep, "/")
+        result = None
+        for regex, is_negated, is_directory_only in self._rules:
+            if is_directory_only and not is_directory:
+                continue
+            if regex.fullmatch(relative):
+                result = not is_negated
+        return result
+
+    def is_ignored(self, path: str) -> bool:
+        """
+        We return whether the file at the path is ignored, either itself or
+        because a directory it's in is. Directories above the base aren't
+        checked.
+        """
+        relative = os.path.relpath(path, self.base)
+        parts = relative.split(os.sep)
+        above_base = 0
+        while parts[above_base] == os.pardir:
+            above_base += 1
+        for count in range(above_base + 1, len(parts) + 1):
+            is_directory = count < len(parts)
+            if self.match(os.path.join(self.base, *parts[:count]),
+                          is_directory):
+                return True
+        return False
+
+
+def _translate(pattern: str) -> str:
+    """
+    We return a regular expression matching the same paths as the glob
+    pattern, where wildcards don't match slashes, except for **.
+    """
+    result = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            result.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            result.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            result.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            result.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            contents = pattern[i + 1:end].replace("\\", "\\\\")
+            if contents.startswith("!"):
+                contents = "^" + contents[1:]
+            result.append(f"[{contents}]")
+            i = end + 1
+        else:
+            result.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(result)
+
+
+def _is_ignored(
+    rules: list[IgnoreRules], path: str, is_directory: bool
+) -> bool:
+    # The rules are in order from the outermost directory to the innermost,
+    # and the innermost ones that say anything win.
+    for rule in reversed(rules):
+        result = rule.match(path, is_directory)
+        if result is not None:
+            return result
+    return False
+
+
+def walk(
+    top: str,
+    rules: Optional[list[IgnoreRules]]=None,
+    use_gitignore: bool=True,
+) -> Iterator[os.DirEntry[str]]:
+    """
+    We return every file in the directory top and its subdirectories, except
+    ones that the rules (or, if use_gitignore is set, .gitignore files in the
+    directories we walk through) ignore. Directories are walked in order of
+    name, and symbolic links to directories and .git directories are skipped.
+    """
+    if rules is None:
+        rules = []
+    # Each directory still to walk, and the rules that apply inside it
+    stack = [(top, rules)]
+    while stack:
+        directory, directory_rules = stack.pop()
+        gitignore = os.path.join(directory, ".gitignore")
+        if use_gitignore and os.path.isfile(gitignore):
+            directory_rules = [*directory_rules,
+                               IgnoreRules.from_file(gitignore)]
+        with os.scandir(directory) as iterator:
+            entries = sorted(iterator, key=lambda entry: entry.name)
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if (entry.name != ".git" and
+                        not _is_ignored(directory_rules, entry.path, True)):
+                    subdirectories.append((entry.path, directory_rules))
+            elif (entry.is_file() and
+                    not _is_ignored(directory_rules, entry.path, False)):
+                yield entry
+        # The stack gives us the last directory first, so reverse them.
+        stack.extend(reversed(subdirectories))
+
+
+def get_file_hash(filename: str) -> str:
+    hasher = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def group_identical_files(filenames: list[str]) -> list[list[str]]:
+    """
+    We return the filenames grouped together by their contents, so that all
+    the files in each group are byte-for-byte identical. The groups are in
+    order of their first file, and the files in each group keep their order
+    too, though a filename given more than once is only included once. We only
+    read files that are the same size as some other file.
+    """
+    filenames = list(dict.fromkeys(filenames))
+    by_size = collections.defaultdict(list)
+    for filename in filenames:
+        by_size[os.path.getsize(filename)].append(filename)
+
+    # Map each file to the first one with the same contents.
+    first_copy = {}
+    for same_size in by_size.values():
+        if len(same_size) == 1:
+            first_copy[same_size[0]] = same_size[0]
+            continue
+        by_hash: dict[str, str] = {}
+        for filename in same_size:
+            first_copy[filename] = by_hash.setdefault(
+                get_file_hash(filename), filename)
+
+    groups: dict[str, list[str]] = {}
+    for filename in filenames:
+        groups.setdefault(first_copy[filename], []).append(filename)
+    return list(groups.values())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+
+import file_walker
+
+
+class TestIgnoreRules(unittest.TestCase):
+    def test_patterns(self):
+        rules = file_walker.IgnoreRules([
+            "# A comment",
+            "",
+            "*.min.js",
+            "!keep.min.js",
+            "vendor/",
+            "/build",
+            "docs/**/generated",
+            "file[0-9].py",
+            ])
+        cases = [
+            ("app.min.js", False, True),
+            ("src/lib/app.min.js", False, True),
+            ("src/keep.min.js", False, False),
+            ("vendor", True, True),
+            ("src/vendor", True, True),
+            ("src/vendor", False, None),  # Only matches directories
+            ("build", True, True),
+            ("src/build", True, None),  # Only matches at the top
+            ("docs/generated", True, True),
+            ("docs/a/b/generated", False, True),
+            ("file1.py", False, True),
+            ("fileA.py", False, None),
+            ("app.js", False, None),
+            ]
+        for path, is_directory, expected in cases:
+            with self.subTest(path=path, is_directory=is_directory):
+                self.assertEqual(expected, rules.match(path, is_directory))
+
+    def test_base(self):
+        rules = file_walker.IgnoreRules(["/build", "*.pyc"], "project")
+        self.assertTrue(rules.match("project/build", True))
+        self.assertIsNone(rules.match("build", True))
+        self.assertTrue(rules.is_ignored("project/build/out.py"))
+        self.assertTrue(rules.is_ignored("project/src/main.pyc"))
+        self.assertFalse(rules.is_ignored("project/src/main.py"))
+
+
+class TestWalk(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+        for filename, contents in [
+                ("b.py", "x = 1\n"),
+                ("a.py", "x = 1\n"),
+                (".gitignore", "generated/\n*.log\n"),
+                ("debug.log", ""),
+                ("generated/out.py", ""),
+                ("src/.gitignore", "!debug.log\n"),
+                ("src/debug.log", ""),
+                ("src/main.go", "package main\n"),
+                ("vendor/lib.go", "package lib\n"),
+                (".git/config", ""),
+                ]:
+            path = os.path.join(self.root, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(contents)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def walk(self, *args, **kwargs):
+        return [os.path.relpath(entry.path, self.root) for entry in
+                file_walker.walk(self.root, *args, **kwargs)]
+
+    def test_gitignore(self):
+        expected = [".gitignore", "a.py", "b.py", "src/.gitignore",
+                    "src/debug.log", "src/main.go", "vendor/lib.go"]
+        self.assertEqual(expected, self.walk())
+
+    def test_rules(self):
+        rules = [file_walker.IgnoreRules(["vendor/", ".*"], self.root)]
+        expected = ["a.py", "b.py", "src/debug.log", "src/main.go"]
+        self.assertEqual(expected, self.walk(rules))
+
+    def test_without_gitignore(self):
+        expected = [".gitignore", "a.py", "b.py", "debug.log",
+                    "generated/out.py", "src/.gitignore", "src/debug.log",
+                    "src/main.go", "vendor/lib.go"]
+        self.assertEqual(expected, self.walk(use_gitignore=False))
+
+    def test_identical_files(self):
+        filenames = [os.path.join(self.root, filename) for filename in
+                     ("b.py", "src/main.go", "a.py", "vendor/lib.go",
+                      "b.py", "debug.log", "src/debug.log")]
+        expected = [[filenames[0], filenames[2]], [filenames[1]],
+                    [filenames[3]], [filenames[5], filenames[6]]]
+        self.assertEqual(expected,
+                         file_walker.group_identical_files(filenames))
+
+
+if __name__ == "__main__":
+    unittest.main()
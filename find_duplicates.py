@@ -167,7 +167,14 @@ def get_lengths(
     from the original matrix is. If is_single_file is set, the main diagonal
     will be all 1's, because a file shouldn't count as a duplicate of itself.
     """
-    pixel_to_segment = _get_pixel_to_segment(matrix, is_single_file)
+    return _lengths_from_segments(
+        matrix, _get_pixel_to_segment(matrix, is_single_file))
+
+
+def _lengths_from_segments(
+    matrix: numpy.typing.NDArray[numpy.uint8],
+    pixel_to_segment: dict[_Coordinates, _SegmentUnionFind],
+) -> numpy.typing.NDArray[numpy.uint32]:
     # For every pixel not involved in a segment, its score is 0 if it was not
     # set in the original, and 1 if it was (it's either a lone pixel or it's on
     # the main diagonal of a file compared to itself).
@@ -185,10 +192,29 @@ def get_segments(
     the matrix. If is_single_file is set, the main diagonal cannot be joined
     into a segment, because a file shouldn't count as a duplicate of itself.
     """
-    pixel_to_segment = _get_pixel_to_segment(matrix, is_single_file)
+    return _unique_segments(_get_pixel_to_segment(matrix, is_single_file))
+
+
+def _unique_segments(
+    pixel_to_segment: dict[_Coordinates, _SegmentUnionFind]
+) -> set[_SegmentUnionFind]:
     # Collect all the segments and remove duplicates.
-    segments = set(segment.get_root() for segment in pixel_to_segment.values())
-    return segments
+    return set(segment.get_root() for segment in pixel_to_segment.values())
+
+
+def segments_to_array(
+    segments: Iterable[_SegmentUnionFind]
+) -> numpy.typing.NDArray[numpy.int64]:
+    """
+    We return an array with one row per segment, containing its size and the
+    row and column of its top-left and bottom-right ends. The largest segments
+    come first, and ties are broken by position.
+    """
+    rows = sorted((-segment.size(), *segment.top, *segment.bottom)
+                  for segment in segments)
+    array = numpy.array(rows, dtype=numpy.int64).reshape(-1, 5)
+    array[:, 0] *= -1
+    return array
 
 
 def _find_mergeable_segment(
@@ -252,10 +278,28 @@ def _find_mergeable_segment(
 
 def get_hues(
     matrix: numpy.typing.NDArray[numpy.uint8], is_single_file: bool
+) -> numpy.typing.NDArray[numpy.uint8]:
+    return _hues_from_lengths(get_lengths(matrix, is_single_file))
+
+
+def get_hues_and_segments(
+    matrix: numpy.typing.NDArray[numpy.uint8], is_single_file: bool
+) -> tuple[numpy.typing.NDArray[numpy.uint8], set[_SegmentUnionFind]]:
+    """
+    Equivalent to calling both get_hues and get_segments, but only finds the
+    segments once.
+    """
+    pixel_to_segment = _get_pixel_to_segment(matrix, is_single_file)
+    hues = _hues_from_lengths(_lengths_from_segments(matrix, pixel_to_segment))
+    return hues, _unique_segments(pixel_to_segment)
+
+
+def _hues_from_lengths(
+    lengths: numpy.typing.NDArray[numpy.uint32]
 ) -> numpy.typing.NDArray[numpy.uint8]:
     # Scores are going to start out as uint32's, but get turned into floats.
     scores: numpy.typing.NDArray
-    scores = get_lengths(matrix, is_single_file)
+    scores = lengths
     # Cut everything off at the max, then divide by the max to put all values
     # between 0 and 1.
     scores = numpy.minimum(_MAX_TOKEN_CHAIN, scores.astype(numpy.float32))
@@ -266,3 +310,226 @@ def get_hues(
     scores *= 170
     scores = scores.astype(numpy.uint8)
     return scores
+
+
+class _SparseSegments:
+    """
+    The same union-find as _SegmentUnionFind, but for every segment at once,
+    stored in arrays indexed by segment number, so that it takes a few dozen
+    bytes per segment rather than a Python object with tuples in it.
+    """
+    def __init__(
+        self,
+        tops: numpy.typing.NDArray[numpy.int64],
+        sizes: numpy.typing.NDArray[numpy.int64],
+    ) -> None:
+        """
+        tops has the row and column of the top-left pixel of each segment, and
+        sizes has the number of pixels on a straight diagonal line from there
+        to its end, like the arguments to _SegmentUnionFind.
+        """
+        self.roots = numpy.arange(len(sizes), dtype=numpy.int64)
+        self.sizes = sizes.astype(numpy.int64)
+        self.tops = tops.astype(numpy.int64)
+        self.bottoms = self.tops + self.sizes[:, numpy.newaxis] - 1
+
+    def get_root(self, segment: int) -> int:
+        root = segment
+        while self.roots[root] != root:
+            root = int(self.roots[root])
+        # Compress the path, so next time we get there in one step.
+        while segment != root:
+            self.roots[segment], segment = root, int(self.roots[segment])
+        return root
+
+    def get_all_roots(self) -> numpy.typing.NDArray[numpy.int64]:
+        """
+        We return the root of every segment, without compressing paths.
+        """
+        roots = self.roots
+        while True:
+            parents = roots[roots]
+            if (parents == roots).all():
+                return roots
+            roots = parents
+
+    def merge(self, segment: int, other: int) -> None:
+        root, other_root = self.get_root(segment), self.get_root(other)
+        if self.sizes[root] > self.sizes[other_root]:
+            large_root, small_root = root, other_root
+        else:
+            large_root, small_root = other_root, root
+
+        self.sizes[large_root] += self.sizes[small_root]
+        self.roots[small_root] = large_root
+
+        # As in _SegmentUnionFind, keep whichever top is further towards the
+        # top-left corner, and whichever bottom is further towards the
+        # bottom-right one.
+        if self.tops[small_root].sum() < self.tops[large_root].sum():
+            self.tops[large_root] = self.tops[small_root]
+        if self.bottoms[small_root].sum() > self.bottoms[large_root].sum():
+            self.bottoms[large_root] = self.bottoms[small_root]
+
+
+def _initialize_sparse_segments(
+    rows: numpy.typing.NDArray[numpy.int64],
+    cols: numpy.typing.NDArray[numpy.int64],
+    is_single_file: bool,
+) -> tuple[_SparseSegments, numpy.typing.NDArray[numpy.int64]]:
+    """
+    Like _initialize_segments, but for a matrix given as the coordinates of
+    its set pixels. We return the segments, and which one each pixel is in, or
+    -1 if it isn't in one.
+    """
+    # Find the runs of pixels along each diagonal.
+    diagonals = cols - rows
+    order = numpy.lexsort((rows, diagonals))
+    is_run_start = numpy.ones(len(rows), dtype=numpy.bool_)
+    is_run_start[1:] = ((diagonals[order[1:]] != diagonals[order[:-1]]) |
+                        (rows[order[1:]] != rows[order[:-1]] + 1))
+    run_of_pixel = numpy.empty(len(rows), dtype=numpy.int64)
+    run_of_pixel[order] = numpy.cumsum(is_run_start) - 1
+    run_starts = order[is_run_start]
+    run_sizes = numpy.bincount(run_of_pixel, minlength=len(run_starts))
+    # Lone pixels can never grow, and when comparing a file to itself, the
+    # main diagonal isn't duplicated code.
+    is_segment = run_sizes > 1
+    if is_single_file:
+        is_segment &= diagonals[run_starts] != 0
+    segment_of_run = numpy.cumsum(is_segment) - 1
+    segment_of_run[~is_segment] = -1
+    segments = _SparseSegments(
+        numpy.stack([rows[run_starts[is_segment]],
+                     cols[run_starts[is_segment]]], axis=1),
+        run_sizes[is_segment])
+    return segments, segment_of_run[run_of_pixel]
+
+
+def _get_sparse_pixel_to_segment(
+    rows: numpy.typing.NDArray[numpy.int64],
+    cols: numpy.typing.NDArray[numpy.int64],
+    shape: tuple[int, int],
+    is_single_file: bool,
+) -> tuple[_SparseSegments, numpy.typing.NDArray[numpy.int64]]:
+    """
+    Like _get_pixel_to_segment, but for a matrix given as the coordinates of
+    its set pixels, sorted by row and then by column (as returned by
+    utils.get_matches). We return the segments, and which one each pixel is
+    in, or -1 if it isn't in one.
+    """
+    nr, nc = shape
+    segments, segment_of_pixel = _initialize_sparse_segments(
+        rows, cols, is_single_file)
+
+    # To find the pixels near a given one, we look up ranges of these, which
+    # are in the same order as the pixels.
+    positions = rows * nc + cols
+
+    def find_mergeable_segment(current: int, max_distance: int) -> int:
+        """
+        Like _find_mergeable_segment, but returns -1 instead of None.
+        """
+        r, c = (int(value) for value in segments.bottoms[current])
+        offsets = numpy.arange(min(max_distance, nr - r - 1))
+        last_cols = numpy.minimum(c + max_distance - offsets, nc - 1)
+        starts = numpy.searchsorted(positions, (r + 1 + offsets) * nc + c + 1)
+        ends = numpy.searchsorted(
+            positions, (r + 1 + offsets) * nc + last_cols, side="right")
+        best_candidate = -1
+        best_candidate_size = -1
+        # We look at the pixels in the same order as _find_mergeable_segment,
+        # so that ties are broken the same way.
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            for pixel in range(start, end):
+                candidate = int(segment_of_pixel[pixel])
+                if candidate == -1:
+                    continue
+                candidate = segments.get_root(candidate)
+                candidate_size = int(segments.sizes[candidate])
+                cand_end_r, cand_end_c = segments.tops[candidate]
+                dist = abs(r + 1 - cand_end_r) + abs(c + 1 - cand_end_c)
+                if (dist <= candidate_size and
+                        candidate_size > best_candidate_size):
+                    best_candidate = candidate
+                    best_candidate_size = candidate_size
+        return best_candidate
+
+    # Everything from here on works the same way as _get_pixel_to_segment.
+    current_segments = numpy.arange(len(segments.sizes))
+    while len(current_segments) > 0:
+        tops = segments.tops[current_segments]
+        bottoms = segments.bottoms[current_segments]
+        sizes = segments.sizes[current_segments]
+        current_segments = current_segments[numpy.lexsort((
+            bottoms[:, 1], bottoms[:, 0], tops[:, 1], tops[:, 0],
+            tops.sum(axis=1), -sizes))]
+        max_distance = int(sizes.min())
+        larger_segments = []
+        for current in current_segments.tolist():
+            current = segments.get_root(current)
+            to_merge = find_mergeable_segment(current, max_distance)
+            if to_merge != -1:
+                segments.merge(current, to_merge)
+            if segments.sizes[segments.get_root(current)] > max_distance:
+                larger_segments.append(current)
+        current_segments = numpy.unique(
+            [segments.get_root(segment) for segment in larger_segments])
+    return segments, segment_of_pixel
+
+
+def _sparse_segments_to_array(
+    segments: _SparseSegments, roots: numpy.typing.NDArray[numpy.int64]
+) -> numpy.typing.NDArray[numpy.int64]:
+    """
+    Like segments_to_array, given the root of every segment.
+    """
+    unique_roots = numpy.unique(roots)
+    array = numpy.concatenate([
+        segments.sizes[unique_roots, numpy.newaxis],
+        segments.tops[unique_roots], segments.bottoms[unique_roots]], axis=1)
+    order = numpy.lexsort((array[:, 4], array[:, 3], array[:, 2],
+                           array[:, 1], -array[:, 0]))
+    return array[order].reshape(-1, 5)
+
+
+def get_sparse_segments(
+    rows: numpy.typing.NDArray[numpy.int64],
+    cols: numpy.typing.NDArray[numpy.int64],
+    shape: tuple[int, int],
+    is_single_file: bool,
+) -> numpy.typing.NDArray[numpy.int64]:
+    """
+    We find the same segments as get_segments, in a matrix of the given shape
+    whose set pixels are at rows and cols (sorted like utils.get_matches
+    returns them), without ever building the matrix, and return them in the
+    format of segments_to_array. The memory used is proportional to the
+    number of set pixels rather than the size of the matrix. Set pixels with
+    nothing immediately diagonal from them can't be part of a segment, so they
+    can be left out (see utils.get_diagonal_matches).
+    """
+    segments, _ = _get_sparse_pixel_to_segment(
+        rows, cols, shape, is_single_file)
+    return _sparse_segments_to_array(segments, segments.get_all_roots())
+
+
+def get_sparse_hues_and_segments(
+    rows: numpy.typing.NDArray[numpy.int64],
+    cols: numpy.typing.NDArray[numpy.int64],
+    shape: tuple[int, int],
+    is_single_file: bool,
+) -> tuple[numpy.typing.NDArray[numpy.uint8],
+           numpy.typing.NDArray[numpy.int64]]:
+    """
+    Like get_sparse_segments, but also returns the hue that get_hues would
+    give each of the set pixels. Here, every set pixel must be included.
+    """
+    segments, segment_of_pixel = _get_sparse_pixel_to_segment(
+        rows, cols, shape, is_single_file)
+    roots = segments.get_all_roots()
+    # As in _lengths_from_segments, pixels not in a segment have length 1.
+    lengths = numpy.ones(len(rows), dtype=numpy.uint32)
+    in_segment = segment_of_pixel != -1
+    lengths[in_segment] = segments.sizes[roots[segment_of_pixel[in_segment]]]
+    return (_hues_from_lengths(lengths),
+            _sparse_segments_to_array(segments, roots))
@@ -78,5 +78,84 @@ class TestGetLengths(unittest.TestCase):
         self.assertTrue((expected - actual == 0).all())
 
 
+class TestHuesAndSegments(unittest.TestCase):
+    def setUp(self):
+        contents = 'print(hello(1, 2)) and print(hello("hi", 2))'
+        data = tokenizer.get_tokens(contents, "python", "test.py")
+        self.matrix = utils.make_matrix(data.tokens, data.tokens)
+
+    def test_matches_separate_calls(self):
+        for is_single_file in (True, False):
+            hues, segments = find_duplicates.get_hues_and_segments(
+                self.matrix, is_single_file)
+            expected_segments = find_duplicates.get_segments(
+                self.matrix, is_single_file)
+            self.assertTrue((find_duplicates.get_hues(
+                self.matrix, is_single_file) == hues).all())
+            self.assertEqual(
+                find_duplicates.segments_to_array(expected_segments).tolist(),
+                find_duplicates.segments_to_array(segments).tolist())
+
+    def test_segments_to_array(self):
+        segments = find_duplicates.get_segments(self.matrix, True)
+        array = find_duplicates.segments_to_array(segments)
+        self.assertEqual((len(segments), 5), array.shape)
+        # The biggest is the two print(hello(...)) calls, which match
+        # everywhere except for their first arguments.
+        self.assertEqual([8, 0, 10, 8, 18], array[0].tolist())
+        # Sizes never increase.
+        self.assertTrue((array[:-1, 0] >= array[1:, 0]).all())
+
+
+class TestSparseSegments(unittest.TestCase):
+    def setUp(self):
+        generator = numpy.random.default_rng(3)
+        self.token_pairs = []
+        for vocabulary_size in (2, 4, 8):
+            tokens_a = generator.integers(0, vocabulary_size, 80).astype(str)
+            tokens_b = generator.integers(0, vocabulary_size, 60).astype(str)
+            self.token_pairs.extend([(tokens_a, tokens_b, False),
+                                     (tokens_a, tokens_a, True)])
+        data = tokenizer.get_file_tokens("examples/pointsprite.py")
+        self.token_pairs.append((data.tokens, data.tokens, True))
+
+    def test_diagonal_matches(self):
+        for tokens_a, tokens_b, _ in self.token_pairs:
+            matrix = utils.make_matrix(tokens_a, tokens_b)
+            # Pixels with a set pixel just above-left or below-right of them
+            diagonal = numpy.zeros_like(matrix)
+            diagonal[1:, 1:] = matrix[1:, 1:] & matrix[:-1, :-1]
+            diagonal[:-1, :-1] |= diagonal[1:, 1:]
+            expected_rows, expected_cols = numpy.nonzero(diagonal)
+            rows, cols = utils.get_diagonal_matches(tokens_a, tokens_b)
+            self.assertEqual(expected_rows.tolist(), rows.tolist())
+            self.assertEqual(expected_cols.tolist(), cols.tolist())
+
+    def test_matches_dense(self):
+        for tokens_a, tokens_b, is_single_file in self.token_pairs:
+            matrix = utils.make_matrix(tokens_a, tokens_b)
+            expected_hues, segments = find_duplicates.get_hues_and_segments(
+                matrix, is_single_file)
+            expected = find_duplicates.segments_to_array(segments).tolist()
+
+            rows, cols = utils.get_matches(tokens_a, tokens_b)
+            hues, actual = find_duplicates.get_sparse_hues_and_segments(
+                rows, cols, matrix.shape, is_single_file)
+            self.assertEqual(expected_hues[rows, cols].tolist(), hues.tolist())
+            self.assertEqual(expected, actual.tolist())
+
+            rows, cols = utils.get_diagonal_matches(tokens_a, tokens_b)
+            actual = find_duplicates.get_sparse_segments(
+                rows, cols, matrix.shape, is_single_file)
+            self.assertEqual(expected, actual.tolist())
+
+    def test_no_matches(self):
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        hues, segments = find_duplicates.get_sparse_hues_and_segments(
+            empty, empty, (10, 0), False)
+        self.assertEqual(0, len(hues))
+        self.assertEqual((0, 5), segments.shape)
+
+
 if __name__ == '__main__':
     unittest.main()
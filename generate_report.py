@@ -1,101 +1,295 @@
 #!/usr/bin/env python3
 import argparse
-import collections
+import contextlib
+import functools
 import glob
-from typing import Iterator
+import numpy
+import numpy.typing
+import os
+import sys
+import time
+from typing import Callable, Iterator, Optional, Sequence, TYPE_CHECKING
 
+import file_walker
 import find_duplicates
+import git_diff
+import minhash
+import pair_scheduler
+import report_cache
+import report_writers
+import suffix_array
 import tokenizer
 import utils
+import winnowing
+
+if TYPE_CHECKING:
+    import multiprocessing.shared_memory
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("file_glob", nargs="*",
-                        help="Glob pattern of files to analyze")
+                        help="Glob pattern of files to analyze. Directories "
+                             "are searched for files in known languages.")
+    parser.add_argument("--exclude", "-x", action="append", default=[],
+                        metavar="PATTERN",
+                        help="Leave out files and directories matching this "
+                             "pattern, in the format of a .gitignore file. "
+                             "Can be given more than once.")
+    parser.add_argument("--no_gitignore", "-ng", action="store_true",
+                        help="Don't leave out files that .gitignore files "
+                             "in the searched directories ignore")
+    parser.add_argument("--max_file_size", "-mfs", type=int, metavar="KB",
+                        help="Leave out files bigger than this many "
+                             "kilobytes")
+    parser.add_argument("--keep_identical", "-ki", action="store_true",
+                        help="Compare files that are identical to each other "
+                             "like any others, rather than reporting them as "
+                             "copies and only comparing one of them")
     parser.add_argument("--min_length", "-ml", type=int, default=300,
                         help="Minimum number of duplicated tokens to report")
     parser.add_argument("--big_files", "-bf", action="store_true",
-                        help="Don't skip images over 50 megapixels")
-    return parser.parse_args()
+                        help="Build the whole matrix even for pairs of files "
+                             "over 50 megapixels, rather than searching them "
+                             "in a way that uses less memory")
+    parser.add_argument("--workers", "-w", type=int,
+                        default=os.cpu_count() or 1,
+                        help="Number of processes to compare files with")
+    search = parser.add_mutually_exclusive_group()
+    search.add_argument("--prefilter", "-p", action="store_true",
+                        help="Only compare pairs of files that look likely "
+                             "to contain duplicated code, which is much "
+                             "faster on big projects but can miss some")
+    search.add_argument("--fingerprint", "-f", action="store_true",
+                        help="Find duplicated code in all files at once "
+                             "using an index of their fingerprints, which is "
+                             "much faster on big projects but can miss code "
+                             "that has been heavily edited")
+    search.add_argument("--suffix_array", "-sa", action="store_true",
+                        help="Like --fingerprint, but use a suffix array of "
+                             "all files, which misses less")
+    search.add_argument("--changed", "-ch", metavar="REVISIONS",
+                        help="Only report duplication involving lines "
+                             "changed in these git revisions (anything `git "
+                             "diff` accepts, e.g. main...HEAD)")
+    parser.add_argument("--band_size", "-bs", type=int,
+                        default=minhash.DEFAULT_BAND_SIZE,
+                        help="With --prefilter, use a smaller value to miss "
+                             "fewer duplicates, or a bigger one to compare "
+                             "fewer pairs of files")
+    parser.add_argument("--cache", "-c",
+                        help="Reuse results from previous runs saved in this "
+                             "file, and save the new ones to it. Only results "
+                             "used by this run are kept.")
+    parser.add_argument("--memory_limit", "-mem", type=int, metavar="MB",
+                        help="Keep the memory used to compare files, across "
+                             "all workers, under this many megabytes. Pairs "
+                             "of files too big to compare within it are "
+                             "searched without building their whole matrix "
+                             "if that fits, and with --fingerprint if not.")
+    parser.add_argument("--format", "-fmt", default="text",
+                        choices=sorted(report_writers.FORMATS),
+                        help="Write the report as text, JSON Lines (one "
+                             "object per pair of files), or SARIF")
+    parser.add_argument("--output", "-o",
+                        help="File to write the report to, instead of stdout")
+    args = parser.parse_args()
+    is_corpus_search = (
+        args.fingerprint or args.suffix_array or args.changed)
+    if args.cache is not None and is_corpus_search:
+        parser.error("--cache can't be used with --fingerprint, "
+                     "--suffix_array, or --changed")
+    if args.memory_limit is not None and is_corpus_search:
+        parser.error("--memory_limit can't be used with --fingerprint, "
+                     "--suffix_array, or --changed")
+    if not 1 <= args.band_size <= minhash.SIGNATURE_LENGTH:
+        parser.error(f"--band_size must be between 1 and "
+                     f"{minhash.SIGNATURE_LENGTH}")
+    return args
 
 
-def find_all_files(glob_patterns: str) -> dict[str, list[str]]:
+def find_all_files(
+    glob_patterns: str,
+    writer: Optional[report_writers.ReportWriter]=None,
+    exclude: Sequence[str]=(),
+    max_file_size: Optional[int]=None,
+    use_gitignore: bool=True,
+) -> dict[str, list[str]]:
     """
     We return a dict mapping language names to lists of filenames in the glob
     whose extension matches the language (e.g., `{"cpp": ["example.hpp",
-    "example.cpp"]}`).
+    "example.cpp"]}`). Directories in the glob are searched for files in any
+    language we know, leaving out what .gitignore files in them ignore (if
+    use_gitignore is set). Files and directories matching the exclude
+    patterns, and files bigger than max_file_size bytes, are left out too.
+    Files we skip are mentioned in the writer's report, or printed if there
+    isn't one.
     """
-    results = collections.defaultdict(list)
+    def report(message: str) -> None:
+        if writer is None:
+            print(message)
+        else:
+            writer.write_message(message)
+
+    rules = [file_walker.IgnoreRules(exclude)]
+    results: dict[str, dict[str, None]] = {}  # Dicts are ordered sets
+    # Directories are full of files that aren't code, so rather than mention
+    # each one we skip, we count them.
+    unknown_count = 0
+    too_big_count = 0
     for glob_pattern in glob_patterns:
-        for filename in glob.iglob(glob_pattern, recursive=True):
+        for path in glob.iglob(glob_pattern, recursive=True):
+            if os.path.isdir(path):
+                for entry in file_walker.walk(path, rules, use_gitignore):
+                    if (max_file_size is not None and
+                            entry.stat().st_size > max_file_size):
+                        too_big_count += 1
+                        continue
+                    try:
+                        language = utils.guess_language(entry.name)
+                    except ValueError:
+                        unknown_count += 1
+                        continue
+                    results.setdefault(language, {})[entry.path] = None
+                continue
+            if rules[0].is_ignored(path):
+                continue
+            if (max_file_size is not None and
+                    os.path.getsize(path) > max_file_size):
+                report(f"Skipping file '{path}' bigger than {max_file_size} "
+                       "bytes")
+                continue
             try:
-                language = utils.guess_language(filename)
+                language = utils.guess_language(path)
             except ValueError:
-                print(f"Skipping file '{filename}' in unknown format")
+                report(f"Skipping file '{path}' in unknown format")
                 continue
-            results[language].append(filename)
-    return results
+            results.setdefault(language, {})[path] = None
+    if unknown_count > 0:
+        report(f"Skipping {unknown_count} files in unknown formats")
+    if too_big_count > 0:
+        report(f"Skipping {too_big_count} files bigger than {max_file_size} "
+               "bytes")
+    return {language: list(files) for language, files in results.items()}
 
 
-def compare_files(
+def _get_segments(
+    tokens_a: numpy.typing.NDArray[numpy.str_],
+    tokens_b: numpy.typing.NDArray[numpy.str_],
+    is_single_file: bool,
+    use_sparse_matrix: bool,
+    first_row: int=0,
+) -> list[tuple[int, int, int, int, int]]:
+    """
+    We return every segment in the matrix comparing tokens_a to tokens_b, as
+    (size, top_a, top_b, bottom_a, bottom_b). If is_single_file is set,
+    tokens_a are the tokens of tokens_b starting at first_row, and the pixels
+    comparing tokens to themselves aren't part of any segment. If
+    use_sparse_matrix is set, we don't build the matrix, and the memory used
+    is proportional to the number of matching pairs of consecutive tokens
+    rather than the number of pixels.
+    """
+    if use_sparse_matrix:
+        rows, cols = utils.get_diagonal_matches(tokens_a, tokens_b)
+        if is_single_file:
+            is_duplicate = cols != rows + first_row
+            rows, cols = rows[is_duplicate], cols[is_duplicate]
+        segment_array = find_duplicates.get_sparse_segments(
+            rows, cols, (len(tokens_a), len(tokens_b)), False)
+        return [(size, top_a, top_b, bottom_a, bottom_b)
+                for size, top_a, top_b, bottom_a, bottom_b
+                in segment_array.tolist()]
+
+    matrix = utils.make_matrix(tokens_a, tokens_b)
+    if is_single_file:
+        # Remove the main diagonal, which get_segments would normally do for
+        # us if tokens_a were the whole file.
+        rows = numpy.arange(len(tokens_a))
+        matrix[rows, rows + first_row] = 0
+    return [(segment.size(), *segment.top, *segment.bottom)
+            for segment in find_duplicates.get_segments(matrix, False)]
+
+
+def _find_large_segments(
     data_a: tokenizer.FileInfo,
     data_b: tokenizer.FileInfo,
     min_segment_size: int,
-    include_big_files: bool=False,
-) -> Iterator[str]:
+    include_big_files: bool,
+    use_sparse_matrix: bool=False,
+) -> report_cache.Segments:
     """
-    Returns a list of strings that should be shown in a report about
-    duplication within these files.
+    We return the segments of at least min_segment_size tokens. Unless
+    include_big_files is set, pairs of files with a matrix over
+    utils.PIXELS_IN_BIG_FILE are searched without building it, which finds
+    the same segments. use_sparse_matrix does that for any pair.
     """
-    filename_a = data_a.filename
-    filename_b = data_b.filename
-
+    is_single_file = data_a.filename == data_b.filename
     pixel_count = len(data_a.tokens) * len(data_b.tokens)
     if pixel_count > utils.PIXELS_IN_BIG_FILE and not include_big_files:
-        yield ("skipping analysis of too-big image "
-                f"for '{filename_a}' and '{filename_b}'")
-        return
-    matrix = utils.make_matrix(data_a.tokens, data_b.tokens)
-    segments = find_duplicates.get_segments(matrix, (filename_a == filename_b))
-    # We'll keep a tuple of (negative_size, start_line_a, end_line_a,
-    # start_line_b, end_line_b) for each large segment we find. We store the
-    # negative of the size so that, when sorted, the largest segments come
-    # first.
+        use_sparse_matrix = True
+    # We'll keep a tuple of (size, top_a, top_b, bottom_a, bottom_b) for each
+    # large segment we find.
     large_segments = set()
-    for segment in segments:
-        if segment.size() < min_segment_size:
+    for segment in _get_segments(data_a.tokens, data_b.tokens, is_single_file,
+                                 use_sparse_matrix):
+        size, top_a, top_b, _, _ = segment
+        if size < min_segment_size:
             continue
         # When comparing a file to itself, don't consider the segment from X to
         # Y as distinct from the segment from Y to X.
-        if filename_a == filename_b and segment.top[0] > segment.top[1]:
-                continue
-        large_segments.add((segment.size(),
-                            data_a.boundaries[segment.top[0]][0][0],
-                            data_a.boundaries[segment.bottom[0]][1][0],
-                            data_b.boundaries[segment.top[1]][0][0],
-                            data_b.boundaries[segment.bottom[1]][1][0],
-                            ))
-
-    if not large_segments:
-        return  # No major duplication!
-    # Otherwise...
-    yield f"Found duplicated code between {filename_a} and {filename_b}:"
-
-    def sorting_key(
-        data: tuple[int, int, int, int, int]
-    ) -> tuple[int, int, int]:
-        # Sort by the starting line in file A, then starting line in file B,
-        # then by length (largest to smallest).
-        return (data[1], data[3], -data[0])
-    sorted_large_segments = sorted(large_segments, key=sorting_key)
-    for size, start_a, end_a, start_b, end_b in sorted_large_segments:
-        yield (f"    {size} tokens on lines "
-               f"{start_a}-{end_a} and lines {start_b}-{end_b}")
+        if is_single_file and top_a > top_b:
+            continue
+        large_segments.add(segment)
+    return large_segments
 
 
-def compare_all_files(
-    file_data: list[tokenizer.FileInfo],
+def _find_large_segments_in_low_memory(
+    data_a: tokenizer.FileInfo,
+    data_b: tokenizer.FileInfo,
+    min_segment_size: int,
+    max_pixels: int,
+) -> report_cache.Segments:
+    """
+    Like _find_large_segments, but never builds more than max_pixels of the
+    matrix at once, by only searching around the runs of identical tokens that
+    winnowing finds. It can miss segments with no long runs of identical
+    tokens.
+    """
+    if data_a.filename == data_b.filename:
+        return winnowing.get_segments(
+            [data_a.tokens], min_segment_size, max_pixels).get((0, 0), set())
+    return winnowing.get_segments(
+        [data_a.tokens, data_b.tokens], min_segment_size, max_pixels,
+        pairs={(0, 1)}).get((0, 1), set())
+
+
+def _time_large_segments(
+    data_a: tokenizer.FileInfo,
+    data_b: tokenizer.FileInfo,
+    min_segment_size: int,
+    include_big_files: bool,
+    low_memory_pixels: Optional[int]=None,
+    use_sparse_matrix: bool=False,
+) -> tuple[report_cache.Segments, float]:
+    """
+    We return the large segments, and how many seconds it took to find them.
+    If low_memory_pixels is given, we find them without building more than
+    that many pixels of the matrix at once.
+    """
+    start = time.perf_counter()
+    if low_memory_pixels is None:
+        segments = _find_large_segments(
+            data_a, data_b, min_segment_size, include_big_files,
+            use_sparse_matrix)
+    else:
+        segments = _find_large_segments_in_low_memory(
+            data_a, data_b, min_segment_size, low_memory_pixels)
+    return segments, time.perf_counter() - start
+
+
+def compare_files(
+    data_a: tokenizer.FileInfo,
+    data_b: tokenizer.FileInfo,
     min_segment_size: int,
     include_big_files: bool=False,
 ) -> Iterator[str]:
@@ -103,12 +297,495 @@ def compare_all_files(
     Returns a list of strings that should be shown in a report about
     duplication within these files.
     """
+    yield from report_writers.format_text(report_writers.PairResult(
+        data_a, data_b, _find_large_segments(
+            data_a, data_b, min_segment_size, include_big_files), None))
+
+
+def _format_results(
+    results: Iterator[report_writers.PairResult],
+) -> Iterator[str]:
+    for result in results:
+        yield from report_writers.format_text(result)
+
+
+def _get_pairs(file_count: int) -> Iterator[tuple[int, int]]:
     # Compare all pairs of files. After comparing A with B, don't also compare
     # B with A, but do remember to compare A with A.
-    for i, data_a in enumerate(file_data):
-        for data_b in file_data[i:]:
-            yield from compare_files(
-                    data_a, data_b, min_segment_size, include_big_files)
+    for i in range(file_count):
+        for j in range(i, file_count):
+            yield i, j
+
+
+# When comparing files in parallel, every worker process gets one copy of the
+# tokens of all the files, in shared memory, rather than having them pickled
+# and sent along with every pair it's asked to compare. The tokens are replaced
+# by integer IDs, which take up less space and are faster to compare than the
+# strings themselves. The workers only find the positions of the segments, so
+# they don't need to know where the tokens are in the files. These are set in
+# each worker by _init_worker.
+_shared_memory: list["multiprocessing.shared_memory.SharedMemory"] = []
+_shared_tokens: numpy.typing.NDArray  # Token IDs stand in for the strings
+_shared_offsets: list[int] = []  # Where each file starts in the array above
+_shared_filenames: list[str] = []
+_shared_min_segment_size = 0
+_shared_include_big_files = False
+
+
+def _init_worker(
+    tokens_name: str,
+    offsets: list[int],
+    filenames: list[str],
+    min_segment_size: int,
+    include_big_files: bool,
+) -> None:
+    import multiprocessing.shared_memory
+    global _shared_tokens, _shared_offsets
+    global _shared_filenames, _shared_min_segment_size
+    global _shared_include_big_files
+    token_count = offsets[-1]
+    _shared_memory[:] = [multiprocessing.shared_memory.SharedMemory(
+        tokens_name)]
+    _shared_tokens = numpy.ndarray([token_count], dtype=numpy.int32,
+                                   buffer=_shared_memory[0].buf)
+    _shared_offsets = offsets
+    _shared_filenames = filenames
+    _shared_min_segment_size = min_segment_size
+    _shared_include_big_files = include_big_files
+
+
+# Consecutive pairs usually share their first file, so it's worth remembering
+# the last few files we've unpacked.
+@functools.lru_cache(maxsize=64)
+def _get_shared_file(index: int) -> tokenizer.FileInfo:
+    start, end = _shared_offsets[index], _shared_offsets[index + 1]
+    # _find_large_segments only needs the tokens and filename.
+    return tokenizer.FileInfo(_shared_tokens[start:end], [], [],
+                              _shared_filenames[index])
+
+
+# Each pair of files to compare is given by their indices, the number of pixels
+# to limit the low-memory search to (or None to search the whole matrix), and
+# whether to search the matrix without building it.
+_PairTask = tuple[int, int, Optional[int], bool]
+
+
+def _compare_shared_files(
+    task: _PairTask,
+) -> tuple[report_cache.Segments, float]:
+    i, j, low_memory_pixels, use_sparse_matrix = task
+    return _time_large_segments(
+        _get_shared_file(i), _get_shared_file(j),
+        _shared_min_segment_size, _shared_include_big_files, low_memory_pixels,
+        use_sparse_matrix)
+
+
+def _compare_all_files_in_parallel(
+    file_data: list[tokenizer.FileInfo],
+    tasks: list[_PairTask],
+    min_segment_size: int,
+    include_big_files: bool,
+    worker_count: int,
+    estimates: Optional[list[int]]=None,
+    memory_limit: Optional[int]=None,
+) -> Iterator[tuple[report_cache.Segments, float]]:
+    """
+    Compares the pairs of files in worker_count processes at once, and returns
+    the large segments in each pair, and how long they took to find, in
+    order. If there's a memory limit, we never run pairs at the same time if
+    the sum of their estimated memory use would go over it.
+    """
+    import multiprocessing
+    import multiprocessing.shared_memory
+
+    token_ids, offsets = utils.get_token_ids(
+        [data.tokens for data in file_data])
+
+    memory = []
+    try:
+        # Shared memory can't be empty, even if there are no tokens.
+        shared = multiprocessing.shared_memory.SharedMemory(
+            create=True, size=max(1, token_ids.nbytes))
+        memory.append(shared)
+        numpy.ndarray(token_ids.shape, dtype=token_ids.dtype,
+                      buffer=shared.buf)[...] = token_ids
+        initargs = (memory[0].name, offsets,
+                    [data.filename for data in file_data], min_segment_size,
+                    include_big_files)
+        with multiprocessing.Pool(
+                worker_count, _init_worker, initargs) as pool:
+            if estimates is not None and memory_limit is not None:
+                yield from pair_scheduler.run_within_budget(
+                    pool, _compare_shared_files, tasks, estimates,
+                    memory_limit, worker_count)
+                return
+            # imap hands out the pairs as workers become free, but gives us
+            # the results in the original order, as soon as they're ready.
+            yield from pool.imap(_compare_shared_files, tasks)
+    finally:
+        for shared in memory:
+            shared.close()
+            shared.unlink()
+
+
+def compare_all_files(
+    file_data: list[tokenizer.FileInfo],
+    min_segment_size: int,
+    include_big_files: bool=False,
+    worker_count: int=1,
+    band_size: Optional[int]=None,
+    cache: Optional[report_cache.ReportCache]=None,
+    memory_limit: Optional[int]=None,
+) -> Iterator[str]:
+    """
+    Returns a list of strings that should be shown in a report about
+    duplication within these files. The arguments are the same as for
+    get_all_results.
+    """
+    yield from _format_results(get_all_results(
+        file_data, min_segment_size, include_big_files, worker_count,
+        band_size, cache, memory_limit))
+
+
+def get_all_results(
+    file_data: list[tokenizer.FileInfo],
+    min_segment_size: int,
+    include_big_files: bool=False,
+    worker_count: int=1,
+    band_size: Optional[int]=None,
+    cache: Optional[report_cache.ReportCache]=None,
+    memory_limit: Optional[int]=None,
+) -> Iterator[report_writers.PairResult]:
+    """
+    Returns the results of comparing every pair of files, as each one is
+    ready. If worker_count is more than 1, pairs of files are compared in that
+    many processes at once, but the results come out in the same order either
+    way. If band_size is given, we skip pairs of files that minhash thinks are
+    unlikely to have anything in common. If there's a cache, we reuse the
+    results for pairs of files found in it, and add the rest.
+
+    If there's a memory limit (in bytes), we estimate how much memory each
+    pair will take, and only compare as many pairs at once as fit within it.
+    Pairs that won't fit on their own, or that are too big and
+    include_big_files isn't set, are searched without building their whole
+    matrix if that fits, and with the low-memory method from
+    compare_all_files_by_fingerprint if not.
+    """
+    if band_size is None:
+        pairs = list(_get_pairs(len(file_data)))
+    else:
+        pairs = sorted(minhash.get_candidate_pairs(
+            [data.tokens for data in file_data], min_segment_size, band_size))
+
+    tasks: list[_PairTask] = [(i, j, None, False) for i, j in pairs]
+    estimates = [0] * len(pairs)
+    if memory_limit is not None:
+        estimator = pair_scheduler.MemoryEstimator(*utils.get_token_ids(
+            [data.tokens for data in file_data]))
+        # The low-memory search builds a byte for each pixel, and a bit more
+        # for the segments in it.
+        low_memory_pixels = memory_limit // 2
+        if not include_big_files:
+            low_memory_pixels = min(low_memory_pixels,
+                                    utils.PIXELS_IN_BIG_FILE)
+        for index, (i, j) in enumerate(pairs):
+            estimates[index] = estimator.estimate(i, j)
+            pixel_count = len(file_data[i].tokens) * len(file_data[j].tokens)
+            if (estimates[index] <= memory_limit and
+                    (pixel_count <= utils.PIXELS_IN_BIG_FILE or
+                     include_big_files)):
+                continue
+            # Pairs too big to build the matrix for are searched without it
+            # if that fits, which finds the same segments, and with the
+            # low-memory search if not.
+            sparse_estimate = estimator.estimate_sparse(i, j)
+            if sparse_estimate <= memory_limit:
+                tasks[index] = (i, j, None, True)
+                estimates[index] = sparse_estimate
+            else:
+                tasks[index] = (i, j, low_memory_pixels, False)
+                estimates[index] = memory_limit
+
+    keys: list[str] = []
+    is_cached = [False] * len(pairs)
+    if cache is not None:
+        hashes = [cache.get_file_hash(data) for data in file_data]
+        keys = [cache.get_key(
+                    hashes[i], hashes[j],
+                    file_data[i].filename == file_data[j].filename,
+                    min_segment_size, include_big_files, low_memory_pixels)
+                for i, j, low_memory_pixels, _ in tasks]
+        is_cached = [key in cache for key in keys]
+    uncached = [index for index, hit in enumerate(is_cached) if not hit]
+    uncached_tasks = [tasks[index] for index in uncached]
+
+    computed: Iterator[tuple[report_cache.Segments, float]]
+    if worker_count > 1 and len(uncached_tasks) > 1:
+        computed = _compare_all_files_in_parallel(
+            file_data, uncached_tasks, min_segment_size, include_big_files,
+            worker_count, [estimates[index] for index in uncached],
+            memory_limit)
+    else:
+        computed = (_time_large_segments(file_data[i], file_data[j],
+                                         min_segment_size, include_big_files,
+                                         low_memory_pixels, use_sparse_matrix)
+                    for i, j, low_memory_pixels, use_sparse_matrix
+                    in uncached_tasks)
+
+    for index, (i, j) in enumerate(pairs):
+        seconds: Optional[float] = None
+        if cache is not None and is_cached[index]:
+            segments = cache[keys[index]]
+        else:
+            segments, seconds = next(computed)
+            if cache is not None:
+                cache[keys[index]] = segments
+        yield report_writers.PairResult(
+            file_data[i], file_data[j], segments, seconds)
+
+
+def compare_all_files_by_fingerprint(
+    file_data: list[tokenizer.FileInfo],
+    min_segment_size: int,
+    include_big_files: bool=False,
+) -> Iterator[str]:
+    """
+    Returns the same report as compare_all_files, but finds the duplicated
+    code using an index of the fingerprints of all the files, which takes time
+    proportional to the amount of code rather than the number of pairs of
+    files. It can miss segments with no long runs of identical tokens.
+    """
+    yield from _format_results(get_results_by_fingerprint(
+        file_data, min_segment_size, include_big_files))
+
+
+def get_results_by_fingerprint(
+    file_data: list[tokenizer.FileInfo],
+    min_segment_size: int,
+    include_big_files: bool=False,
+) -> Iterator[report_writers.PairResult]:
+    """
+    Returns the results that compare_all_files_by_fingerprint reports on. Only
+    pairs of files with something in common are included, and they all come
+    from one search, so there's no time for each pair.
+    """
+    return _get_corpus_results(winnowing.get_segments, file_data,
+                               min_segment_size, include_big_files)
+
+
+def compare_all_files_by_suffix_array(
+    file_data: list[tokenizer.FileInfo],
+    min_segment_size: int,
+    include_big_files: bool=False,
+) -> Iterator[str]:
+    """
+    Like compare_all_files_by_fingerprint, but finds the runs of identical
+    tokens to search around with a suffix array of all the files. This takes
+    time proportional to the amount of code times its log, and only misses
+    segments where no suffix_array.MIN_PIECE_LENGTH tokens in a row match.
+    """
+    yield from _format_results(get_results_by_suffix_array(
+        file_data, min_segment_size, include_big_files))
+
+
+def get_results_by_suffix_array(
+    file_data: list[tokenizer.FileInfo],
+    min_segment_size: int,
+    include_big_files: bool=False,
+) -> Iterator[report_writers.PairResult]:
+    """
+    Returns the results that compare_all_files_by_suffix_array reports on, in
+    the same way as get_results_by_fingerprint.
+    """
+    return _get_corpus_results(suffix_array.get_segments, file_data,
+                               min_segment_size, include_big_files)
+
+
+def _get_corpus_results(
+    get_segments: Callable[..., dict[tuple[int, int], report_cache.Segments]],
+    file_data: list[tokenizer.FileInfo],
+    min_segment_size: int,
+    include_big_files: bool,
+) -> Iterator[report_writers.PairResult]:
+    """
+    Searches all the files at once with get_segments (from winnowing or
+    suffix_array), and returns the results for each pair of files.
+    """
+    duplicates = get_segments(
+        [data.tokens for data in file_data], min_segment_size,
+        None if include_big_files else utils.PIXELS_IN_BIG_FILE)
+    for (i, j), segments in sorted(duplicates.items()):
+        yield report_writers.PairResult(
+            file_data[i], file_data[j], segments, None)
+
+
+def _get_changed_tokens(
+    data: tokenizer.FileInfo, line_ranges: list[git_diff.LineRange]
+) -> numpy.typing.NDArray[numpy.bool_]:
+    """
+    We return whether each token in the file is on any of the lines.
+    """
+    boundaries = numpy.array(data.boundaries, dtype=numpy.int64).reshape(
+        -1, 2, 2)
+    start_lines, end_lines = boundaries[:, 0, 0], boundaries[:, 1, 0]
+    changed = numpy.zeros(len(boundaries), dtype=bool)
+    for first, last in line_ranges:
+        changed |= (start_lines <= last) & (end_lines >= first)
+    return changed
+
+
+def _get_row_ranges(
+    changed: numpy.typing.NDArray[numpy.bool_], margin: int
+) -> list[tuple[int, int]]:
+    """
+    We return ranges of rows (with exclusive ends) that include every changed
+    one, plus margin more on each side.
+    """
+    rows = numpy.flatnonzero(changed)
+    if len(rows) == 0:
+        return []
+    # Changes closer together than this have overlapping margins.
+    breaks = numpy.flatnonzero(numpy.diff(rows) > 2 * margin)
+    firsts = rows[numpy.concatenate([[0], breaks + 1])]
+    lasts = rows[numpy.concatenate([breaks, [len(rows) - 1]])]
+    return [(max(0, int(first) - margin),
+             min(len(changed), int(last) + 1 + margin))
+            for first, last in zip(firsts, lasts)]
+
+
+def _find_changed_segments(
+    data_a: tokenizer.FileInfo,
+    changed_a: numpy.typing.NDArray[numpy.bool_],
+    data_b: tokenizer.FileInfo,
+    min_segment_size: int,
+    include_big_files: bool,
+) -> set[tuple[int, int, int, int, int]]:
+    """
+    Like _find_large_segments, except that we only search the rows of the
+    matrix near the changed tokens in data_a (plus wherever the segments there
+    lead), and only return segments that include some of them.
+    """
+    is_single_file = data_a.filename == data_b.filename
+    # The number of changed tokens before each one
+    changed_before = numpy.concatenate([[0], numpy.cumsum(changed_a)])
+    row_count = len(changed_a)
+    large_segments = set()
+    for start, end in _get_row_ranges(changed_a, min_segment_size):
+        while True:
+            pixel_count = (end - start) * len(data_b.tokens)
+            use_sparse_matrix = (pixel_count > utils.PIXELS_IN_BIG_FILE and
+                                 not include_big_files)
+            # Only segments that include some changes matter.
+            segments = [
+                (size, top_a + start, top_b, bottom_a + start, bottom_b)
+                for size, top_a, top_b, bottom_a, bottom_b in _get_segments(
+                    data_a.tokens[start:end], data_b.tokens, is_single_file,
+                    use_sparse_matrix, start)
+                if changed_before[bottom_a + start + 1] !=
+                changed_before[top_a + start]]
+            # Those segments might continue past the rows we searched, or
+            # merge with ones past them. find_duplicates merges segments
+            # across gaps as big as they are, so if any are closer to the
+            # first or last row than their own size, search more rows in that
+            # direction and try again. If one reaches the edge, we don't know
+            # how far it goes, so search twice as many rows; otherwise, search
+            # far enough past it that it's twice its size from the edge.
+            new_start, new_end = start, end
+            for size, top_a, _, bottom_a, _ in segments:
+                if top_a == start:
+                    new_start = min(new_start, start - (end - start))
+                elif top_a - start < size:
+                    new_start = min(new_start, top_a - 2 * size)
+                if bottom_a == end - 1:
+                    new_end = max(new_end, end + (end - start))
+                elif end - 1 - bottom_a < size:
+                    new_end = max(new_end, bottom_a + 1 + 2 * size)
+            new_start, new_end = max(0, new_start), min(row_count, new_end)
+            if (new_start, new_end) == (start, end):
+                break
+            start, end = new_start, new_end
+            if 2 * (end - start) > row_count:
+                # Most of the file, so we might as well search all of it at
+                # once rather than growing again.
+                start, end = 0, row_count
+
+        for size, top_a, top_b, bottom_a, bottom_b in segments:
+            if size < min_segment_size:
+                continue
+            # When comparing a file to itself, don't consider the segment from
+            # X to Y as distinct from the segment from Y to X.
+            if is_single_file and top_a > top_b:
+                top_a, top_b, bottom_a, bottom_b = (
+                    top_b, top_a, bottom_b, bottom_a)
+            large_segments.add((size, top_a, top_b, bottom_a, bottom_b))
+    return large_segments
+
+
+def compare_changed_files(
+    file_data: list[tokenizer.FileInfo],
+    changed_lines: dict[str, list[git_diff.LineRange]],
+    min_segment_size: int,
+    include_big_files: bool=False,
+) -> Iterator[str]:
+    """
+    Returns the parts of the report from compare_all_files that involve the
+    changed lines, which map filenames to ranges of lines in them. Only the
+    parts of the files near those lines are searched.
+    """
+    yield from _format_results(get_changed_results(
+        file_data, changed_lines, min_segment_size, include_big_files))
+
+
+def get_changed_results(
+    file_data: list[tokenizer.FileInfo],
+    changed_lines: dict[str, list[git_diff.LineRange]],
+    min_segment_size: int,
+    include_big_files: bool=False,
+) -> Iterator[report_writers.PairResult]:
+    """
+    Returns the results that compare_changed_files reports on, for every pair
+    of files including at least one changed file.
+    """
+    changed_tokens = {}
+    for i, data in enumerate(file_data):
+        line_ranges = changed_lines.get(os.path.relpath(data.filename))
+        if line_ranges is not None:
+            changed_tokens[i] = _get_changed_tokens(data, line_ranges)
+
+    for i, j in _get_pairs(len(file_data)):
+        start = time.perf_counter()
+        segments: set[tuple[int, int, int, int, int]] = set()
+        # Look for segments including changes to either file, and report them
+        # all in the same order as compare_all_files would.
+        for a, b in {(i, j), (j, i)}:
+            if a not in changed_tokens:
+                continue
+            found = _find_changed_segments(
+                file_data[a], changed_tokens[a], file_data[b],
+                min_segment_size, include_big_files)
+            if a == i:
+                segments.update(found)
+            else:
+                segments.update((size, top_a, top_b, bottom_a, bottom_b)
+                                for size, top_b, top_a, bottom_b, bottom_a
+                                in found)
+        if i in changed_tokens or j in changed_tokens:
+            yield report_writers.PairResult(
+                file_data[i], file_data[j], segments,
+                time.perf_counter() - start)
+
+
+def _get_identical_result(
+    data: tokenizer.FileInfo, filename: str
+) -> report_writers.PairResult:
+    """
+    We return the result of comparing the file to an identical copy of it,
+    without comparing them: the whole of each one is one big segment.
+    """
+    last = len(data.tokens) - 1
+    return report_writers.PairResult(
+        data, data._replace(filename=filename),
+        {(len(data.tokens), 0, 0, last, last)}, None)
 
 
 def process_all_files_in_language(
@@ -116,26 +793,100 @@ def process_all_files_in_language(
     file_list: list[str],
     min_length: int,
     include_big_files: bool,
+    worker_count: int=1,
+    band_size: Optional[int]=None,
+    use_fingerprints: bool=False,
+    cache: Optional[report_cache.ReportCache]=None,
+    changed_lines: Optional[dict[str, list[git_diff.LineRange]]]=None,
+    writer: Optional[report_writers.ReportWriter]=None,
+    memory_limit: Optional[int]=None,
+    skip_identical_files: bool=False,
+    use_suffix_array: bool=False,
 ) -> None:
     """
     Given a language and a list of files containing code in that language,
-    tokenize each file and look for duplicated code between them all. Print out
-    anything you find.
+    tokenize each file and look for duplicated code between them all. Write
+    anything you find to the writer, or print it out if there isn't one. If
+    changed_lines is given, only look for duplicated code involving those
+    lines. If skip_identical_files is set, files that are identical to an
+    earlier one are reported as copies of it, and not compared to anything.
     """
+    if writer is None:
+        writer = report_writers.TextWriter(sys.stdout)
+    if changed_lines is not None and not any(
+            os.path.relpath(filename) in changed_lines
+            for filename in file_list):
+        return  # Nothing has changed
+
+    copies: dict[str, list[str]] = {}
+    if skip_identical_files:
+        groups = file_walker.group_identical_files(file_list)
+        file_list = [group[0] for group in groups]
+        copies = {group[0]: group[1:] for group in groups}
+
     data = []
     for filename in file_list:
         try:
             data.append(tokenizer.get_file_tokens(filename, language))
         except SyntaxError:
-            print(f"Cannot parse {filename}")
+            writer.write_message(f"Cannot parse {filename}")
+    for file_data in data:
+        if len(file_data.tokens) == 0 or len(file_data.tokens) < min_length:
+            # Like any other duplicated code, copies too small to be
+            # interesting aren't reported.
+            continue
+        for filename in copies.get(file_data.filename, []):
+            writer.write_result(_get_identical_result(file_data, filename))
 
-    for line in compare_all_files(data, min_length, include_big_files):
-        print(line)
+    if changed_lines is not None:
+        results = get_changed_results(data, changed_lines, min_length,
+                                      include_big_files)
+    elif use_fingerprints:
+        results = get_results_by_fingerprint(data, min_length,
+                                             include_big_files)
+    elif use_suffix_array:
+        results = get_results_by_suffix_array(data, min_length,
+                                              include_big_files)
+    else:
+        results = get_all_results(data, min_length, include_big_files,
+                                  worker_count, band_size, cache,
+                                  memory_limit)
+    for result in results:
+        writer.write_result(result)
 
 
-if __name__ == "__main__":
+def main() -> None:
     args = parse_args()
-    languages_to_file_lists = find_all_files(args.file_glob)
-    for language, file_list in languages_to_file_lists.items():
-        process_all_files_in_language(
-                language, file_list, args.min_length, args.big_files)
+    changed_lines = None
+    if args.changed is not None:
+        changed_lines = git_diff.get_changed_lines(args.changed)
+    memory_limit = None
+    if args.memory_limit is not None:
+        memory_limit = args.memory_limit * 1000 * 1000
+    with contextlib.ExitStack() as stack:
+        stream = sys.stdout
+        if args.output is not None:
+            stream = stack.enter_context(open(args.output, "w"))
+        writer = stack.enter_context(
+            report_writers.FORMATS[args.format](stream))
+        max_file_size = None
+        if args.max_file_size is not None:
+            max_file_size = args.max_file_size * 1000
+        languages_to_file_lists = find_all_files(
+            args.file_glob, writer, args.exclude, max_file_size,
+            not args.no_gitignore)
+        cache = None
+        if args.cache is not None:
+            cache = stack.enter_context(report_cache.ReportCache(args.cache))
+        for language, file_list in languages_to_file_lists.items():
+            process_all_files_in_language(
+                    language, file_list, args.min_length, args.big_files,
+                    args.workers, args.band_size if args.prefilter else None,
+                    args.fingerprint, cache, changed_lines, writer,
+                    memory_limit,
+                    not args.keep_identical and changed_lines is None,
+                    args.suffix_array)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
+import io
+import os
+import shutil
+import tempfile
 import unittest
+import unittest.mock
 
 import generate_report
+import report_writers
 import tokenizer
+import utils
 
 
 class TestGenerateReports(unittest.TestCase):
@@ -42,6 +49,151 @@ class TestGenerateReports(unittest.TestCase):
             ]
         self.assertEqual(expected, actual)
 
+    def test_parallel_matches_serial(self):
+        data = [tokenizer.get_file_tokens(filename) for filename in
+                ("examples/gpsnmea.go", "examples/gpsrtk.go",
+                 "examples/gpsnmea.go")]
+        expected = list(generate_report.compare_all_files(data, 100))
+        actual = list(generate_report.compare_all_files(data, 100,
+                                                        worker_count=3))
+        self.assertEqual(expected, actual)
+
+    def test_prefilter(self):
+        data = [tokenizer.get_file_tokens(filename) for filename in
+                ("examples/gpsnmea.go", "examples/gpsrtk.go",
+                 "examples/server.go")]
+        expected = list(generate_report.compare_all_files(data, 100))
+        actual = list(generate_report.compare_all_files(data, 100,
+                                                        band_size=4))
+        self.assertEqual(expected, actual)
+
+    def test_fingerprint(self):
+        data = [tokenizer.get_file_tokens(filename) for filename in
+                ("examples/gpsnmea.go", "examples/gpsrtk.go",
+                 "examples/pointsprite.py")]
+        expected = list(generate_report.compare_all_files(data, 100))
+        actual = list(generate_report.compare_all_files_by_fingerprint(
+            data, 100))
+        self.assertEqual(expected, actual)
+
+    def test_suffix_array(self):
+        data = [tokenizer.get_file_tokens(filename) for filename in
+                ("examples/gpsnmea.go", "examples/gpsrtk.go",
+                 "examples/pointsprite.py")]
+        expected = list(generate_report.compare_all_files(data, 100))
+        actual = list(generate_report.compare_all_files_by_suffix_array(
+            data, 100))
+        self.assertEqual(expected, actual)
+
+    def test_memory_limit(self):
+        data = [tokenizer.get_file_tokens(filename) for filename in
+                ("examples/gpsnmea.go", "examples/gpsrtk.go")]
+        expected = list(generate_report.compare_all_files(data, 100))
+        # Comparing gpsrtk.go to itself takes more memory than this, so it's
+        # done without building the matrix instead, and finds the same
+        # segments.
+        for worker_count in (1, 2):
+            actual = list(generate_report.compare_all_files(
+                data, 100, worker_count=worker_count,
+                memory_limit=20 * 1000 * 1000))
+            self.assertEqual(expected, actual)
+
+    def test_big_files(self):
+        data = [tokenizer.get_file_tokens(filename) for filename in
+                ("examples/gpsnmea.go", "examples/gpsrtk.go")]
+        everything = {"examples/gpsnmea.go": [(1, 1000)],
+                      "examples/gpsrtk.go": [(1, 1000)]}
+        expected = list(generate_report.compare_all_files(data, 100))
+        # When every pair is too big to build the matrix for, it's searched
+        # without it, which finds the same segments.
+        with unittest.mock.patch.object(utils, "PIXELS_IN_BIG_FILE", 1000):
+            self.assertEqual(
+                expected, list(generate_report.compare_all_files(data, 100)))
+            self.assertEqual(expected, list(
+                generate_report.compare_changed_files(data, everything, 100)))
+
+    def test_changed_files(self):
+        data = [tokenizer.get_file_tokens(filename) for filename in
+                ("examples/gpsnmea.go", "examples/gpsrtk.go")]
+        # Changing every line should give the whole report.
+        everything = {"examples/gpsnmea.go": [(1, 1000)],
+                      "examples/gpsrtk.go": [(1, 1000)]}
+        expected = list(generate_report.compare_all_files(data, 100))
+        actual = list(generate_report.compare_changed_files(
+            data, everything, 100))
+        self.assertEqual(expected, actual)
+
+        # Line 598 of gpsrtk.go is in only some of its duplicated segments.
+        changed_lines = {"examples/gpsrtk.go": [(598, 598)]}
+        with unittest.mock.patch.object(
+                generate_report, "_get_segments",
+                wraps=generate_report._get_segments) as get_segments:
+            actual = list(generate_report.compare_changed_files(
+                data, changed_lines, 100))
+        # Only the rows near the segments including the change are searched,
+        # which altogether is still less than searching the whole file once.
+        self.assertLess(sum(len(call.args[0])
+                            for call in get_segments.call_args_list),
+                        len(data[1].tokens))
+        expected = [
+            "Found duplicated code between examples/gpsrtk.go and examples/gpsrtk.go:",
+            "    362 tokens on lines 559-618 and lines 567-626",
+            "    305 tokens on lines 559-610 and lines 575-626",
+            "    251 tokens on lines 559-602 and lines 583-626",
+            "    212 tokens on lines 559-594 and lines 591-626",
+            ]
+        self.assertEqual(expected, actual)
+
+        # A change to one line of a segment finds all of it, from either side.
+        changed_lines = {"examples/gpsnmea.go": [(100, 100)]}
+        actual = list(generate_report.compare_changed_files(
+            data, changed_lines, 100))
+        expected = [
+            "Found duplicated code between examples/gpsnmea.go and examples/gpsrtk.go:",
+            "    451 tokens on lines 69-131 and lines 85-152",
+            ]
+        self.assertEqual(expected, actual)
+        changed_lines = {"examples/gpsrtk.go": [(109, 109)]}
+        actual = list(generate_report.compare_changed_files(
+            data, changed_lines, 100))
+        self.assertEqual(expected + [
+            "Found duplicated code between examples/gpsrtk.go and examples/gpsrtk.go:",
+            "    100 tokens on lines 96-124 and lines 106-127",
+            ], actual)
+
+    def test_changed_fragments(self):
+        # With a smaller minimum length, the searches near a change find
+        # pieces of long segments first, which only merge into the whole
+        # segment from rows farther away than the minimum length.
+        data = [tokenizer.get_file_tokens(filename) for filename in
+                ("examples/gpsnmea.go", "examples/gpsrtk.go")]
+        all_results = list(generate_report.get_all_results(data, 50))
+        for index, first, last in [(1, 85, 87), (1, 92, 94), (0, 112, 114)]:
+            filename = data[index].filename
+            with self.subTest(filename=filename, first=first):
+                changed = generate_report._get_changed_tokens(
+                    data[index], [(first, last)])
+
+                def is_changed(file_data, top, bottom,
+                               filename=filename, changed=changed):
+                    return (file_data.filename == filename and
+                            changed[top:bottom + 1].any())
+                # The whole report, without the segments not on those lines
+                # or the pairs of files that don't include the changed one
+                expected = [
+                    {(size, top_a, top_b, bottom_a, bottom_b)
+                     for size, top_a, top_b, bottom_a, bottom_b
+                     in result.segments
+                     if is_changed(result.data_a, top_a, bottom_a) or
+                     is_changed(result.data_b, top_b, bottom_b)}
+                    for result in all_results
+                    if filename in (result.data_a.filename,
+                                    result.data_b.filename)]
+                actual = [result.segments for result in
+                          generate_report.get_changed_results(
+                              data, {filename: [(first, last)]}, 50)]
+                self.assertEqual(expected, actual)
+
     def test_file_globbing(self):
         actual = generate_report.find_all_files(
             ["examples/*.py", "examples/*.?pp"])
@@ -56,5 +208,77 @@ class TestGenerateReports(unittest.TestCase):
         self.assertEqual(expected, actual_sorted)
 
 
+class TestDirectories(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+        for filename, copy in [("gpsnmea.go", "a.go"),
+                               ("gpsnmea.go", "lib/b.go"),
+                               ("server.go", "vendor/server.go"),
+                               ("pointsprite.py", "generated/p.py"),
+                               ("lsbattle_entity_wireframe.py", "c.py")]:
+            path = os.path.join(self.root, copy)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copy(os.path.join("examples", filename), path)
+        with open(os.path.join(self.root, ".gitignore"), "w") as f:
+            f.write("generated/\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_find_files(self):
+        stream = io.StringIO()
+        writer = report_writers.TextWriter(stream)
+        actual = generate_report.find_all_files(
+            [self.root], writer, exclude=["vendor/"], max_file_size=5000)
+        self.assertEqual({"python": [os.path.join(self.root, "c.py")]},
+                         actual)
+        self.assertEqual(["Skipping 1 files in unknown formats",
+                          "Skipping 2 files bigger than 5000 bytes"],
+                         stream.getvalue().splitlines())
+
+        actual = generate_report.find_all_files(
+            [self.root, os.path.join(self.root, "*.go")], writer,
+            use_gitignore=False)
+        expected = {
+            "go": [os.path.join(self.root, "a.go"),
+                   os.path.join(self.root, "lib/b.go"),
+                   os.path.join(self.root, "vendor/server.go")],
+            "python": [os.path.join(self.root, "c.py"),
+                       os.path.join(self.root, "generated/p.py")],
+        }
+        self.assertEqual(expected, actual)
+
+    def test_identical_files(self):
+        filenames = [os.path.join(self.root, filename) for filename in
+                     ("a.go", "vendor/server.go", "lib/b.go")]
+        stream = io.StringIO()
+        generate_report.process_all_files_in_language(
+            "go", filenames, 100, False,
+            writer=report_writers.TextWriter(stream),
+            skip_identical_files=True)
+        # The copy is reported as one big duplicate, and not compared to
+        # anything else.
+        expected = [
+            f"Found duplicated code between {filenames[0]} and {filenames[2]}:",
+            "    588 tokens on lines 2-162 and lines 2-162",
+            ] + list(generate_report.compare_all_files(
+                [tokenizer.get_file_tokens(filename)
+                 for filename in filenames[:2]], 100))
+        self.assertEqual(expected, stream.getvalue().splitlines())
+
+    def test_small_identical_files(self):
+        filenames = [os.path.join(self.root, filename) for filename in
+                     ("__init__.py", "lib/__init__.py")]
+        for filename in filenames:
+            with open(filename, "w") as f:
+                f.write("from . import c\n")
+        stream = io.StringIO()
+        generate_report.process_all_files_in_language(
+            "python", filenames, 100, False,
+            writer=report_writers.TextWriter(stream),
+            skip_identical_files=True)
+        self.assertEqual("", stream.getvalue())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,61 @@
+import os
+import re
+import subprocess
+
+
+# A range of line numbers, counting from 1, including both ends
+LineRange = tuple[int, int]
+
+_FILE_HEADER = re.compile(r"^\+\+\+ (?:b/)?(.*)$")
+_HUNK_HEADER = re.compile(r"^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def parse_changed_lines(diff: str) -> dict[str, list[LineRange]]:
+    """
+    Given the output of `git diff --unified=0`, we return a dict mapping the
+    name of every file with lines added or changed to the ranges of those lines
+    in the new version of the file. Files that were deleted, and hunks that
+    only delete lines, are left out.
+    """
+    results: dict[str, list[LineRange]] = {}
+    filename = None
+    lines_left_in_hunk = 0
+    for line in diff.splitlines():
+        if line.startswith("\\"):
+            continue  # "\ No newline at end of file" isn't part of the hunk
+        # Lines of code can look like headers, so skip over them.
+        if lines_left_in_hunk > 0:
+            lines_left_in_hunk -= 1
+            continue
+        file_match = _FILE_HEADER.match(line)
+        if file_match is not None:
+            filename = file_match.group(1)
+            if filename == "/dev/null":
+                filename = None
+            continue
+        hunk_match = _HUNK_HEADER.match(line)
+        if hunk_match is None:
+            continue
+        removed = int(hunk_match.group(1) or 1)
+        start = int(hunk_match.group(2))
+        added = int(hunk_match.group(3) or 1)
+        lines_left_in_hunk = removed + added
+        if added == 0 or filename is None:
+            continue  # Only removes lines
+        results.setdefault(os.path.normpath(filename), []).append(
+            (start, start + added - 1))
+    return results
+
+
+def get_changed_lines(revisions: str) -> dict[str, list[LineRange]]:
+    """
+    We return the lines added or changed in the revisions (anything `git diff`
+    accepts, such as `main...HEAD`, or a single commit to compare the working
+    tree to), in the same format as parse_changed_lines. Filenames are relative
+    to the current directory.
+    """
+    diff = subprocess.run(
+        ["git", "diff", "--unified=0", "--no-color", "--no-ext-diff",
+         "--relative", revisions],
+        check=True, capture_output=True, text=True).stdout
+    return parse_changed_lines(diff)
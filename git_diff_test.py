@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import unittest
+
+import git_diff
+
+
+class TestParseChangedLines(unittest.TestCase):
+    def test_hunks(self):
+        diff_lines = [
+            "diff --git a/src/a.py b/src/a.py",
+            "index 1234567..89abcde 100644",
+            "--- a/src/a.py",
+            "+++ b/src/a.py",
+            "@@ -3 +3 @@ def f():",
+            "-    return 1",
+            "+    return 2",
+            "@@ -10,0 +11,3 @@ def g():",
+            "+x = 1",
+            "+y = 2",
+            "+z = 3",
+            "@@ -20,2 +23,0 @@",
+            "-a = 1",
+            "-b = 2",
+            "diff --git a/b.go b/b.go",
+            "--- a/b.go",
+            "+++ b/b.go",
+            "@@ -1,2 +1,2 @@",
+            "-package b",
+            "-",
+            "+package c",
+            "+",
+            ]
+        expected = {
+            "src/a.py": [(3, 3), (11, 13)],
+            "b.go": [(1, 2)],
+            }
+        self.assertEqual(expected, git_diff.parse_changed_lines(
+            "\n".join(diff_lines)))
+
+    def test_new_and_deleted_files(self):
+        diff_lines = [
+            "diff --git a/new.py b/new.py",
+            "new file mode 100644",
+            "--- /dev/null",
+            "+++ b/new.py",
+            "@@ -0,0 +1,2 @@",
+            "+import os",
+            "+print(os.getcwd())",
+            "diff --git a/old.py b/old.py",
+            "deleted file mode 100644",
+            "--- a/old.py",
+            "+++ /dev/null",
+            "@@ -1 +0,0 @@",
+            "-import sys",
+            ]
+        expected = {"new.py": [(1, 2)]}
+        self.assertEqual(expected, git_diff.parse_changed_lines(
+            "\n".join(diff_lines)))
+
+    def test_lines_that_look_like_headers(self):
+        # A removed line starting with "-- " and an added one starting with
+        # "++ " look like file headers, and there's no newline at the end.
+        diff_lines = [
+            "--- a/query.sql",
+            "+++ b/query.sql",
+            "@@ -4,2 +4,2 @@",
+            "--- a/comment",
+            "-SELECT 1",
+            "\\ No newline at end of file",
+            "+++ b/comment",
+            "+SELECT 2",
+            "\\ No newline at end of file",
+            ]
+        expected = {"query.sql": [(4, 5)]}
+        self.assertEqual(expected, git_diff.parse_changed_lines(
+            "\n".join(diff_lines)))
+
+
+if __name__ == "__main__":
+    unittest.main()
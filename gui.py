@@ -1,11 +1,15 @@
 import darkdetect
+import functools
 from math import ceil
+import multiprocessing.pool
 import numpy
 import numpy.typing
 import tkinter as tk
 import tkinter.font as tkfont
 from typing import Optional
 
+from image_pyramid import ImagePyramid
+from latency import LatencyLog
 from tokenizer import FileInfo
 from zoom_map import ZoomMap
 
@@ -22,6 +26,8 @@ class _Context(tk.Text):
     # do, alignment will be off.
     LINE_NUMBER_WIDTH: int = 5  # Maximum number of digits in the line number
     PRELUDE_WIDTH: int = LINE_NUMBER_WIDTH + 2  # Line number, colon, space
+    # Number of formatted lines of code to keep around for reuse
+    LINE_CACHE_SIZE: int = 4096
 
     def __init__(
         self,
@@ -29,6 +35,7 @@ class _Context(tk.Text):
         data: FileInfo,
         text_width: int,
         zoom_map: ZoomMap,
+        latency: LatencyLog,
     ) -> None:
         height = 2 * self.CONTEXT_COUNT + 1
         # NOTE: Lines longer than text_width get truncated, and any tokens off
@@ -56,9 +63,22 @@ class _Context(tk.Text):
 
         self._text_width = text_width
         self._lines = data.lines
+        self._token_count = len(data.boundaries)
         self._boundaries = data.boundaries
+        # Formatting a line (and trimming it to fit) is done at most once per
+        # line, the first time it's displayed. The cache is bounded so that
+        # exploring an enormous file doesn't use unbounded memory.
+        self._format_line = functools.lru_cache(maxsize=self.LINE_CACHE_SIZE)(
+            self._format_line_uncached)
         self._zoom_map = zoom_map
-        self._highlight_color = "grey" if darkdetect.isDark() else "yellow"
+        self._latency = latency
+        self.tag_config("token", background="grey" if darkdetect.isDark()
+                                  else "yellow")
+        # What we're currently showing, so we can skip redundant updates: the
+        # line in the middle of the display, and the first and last tokens
+        # highlighted.
+        self._displayed_line: Optional[int] = None
+        self._displayed_tokens: Optional[tuple[int, int]] = None
 
     def _snip_line(self, i: int) -> str:
         """
@@ -80,33 +100,60 @@ class _Context(tk.Text):
             print("PROBLEM: tabs at the end of the line!")
         return line_start
 
+    def _format_line_uncached(self, i: int) -> str:
+        if not (0 <= i < len(self._lines)):
+            return ""
+        return "{:>{}}: {}".format(i + 1, self.LINE_NUMBER_WIDTH,
+                                   self._snip_line(i))
+
     def display(self, pixel: int) -> None:
         # The zoom level is equivalent to the number of tokens described by the
         # current pixel in the map.
         zoom_level = self._zoom_map.zoom_level
         first_token_index = int(pixel * zoom_level)
         last_token_index = min(first_token_index + ceil(zoom_level),
-                               len(self._boundaries)) - 1
+                               self._token_count) - 1
 
-        if not (0 <= first_token_index < len(self._boundaries)):
+        if not (0 <= first_token_index < self._token_count):
             # TODO: Restrict panning so that we can't go outside the image.
             return  # We're out of range of the image. Skip it.
+        if (first_token_index, last_token_index) == self._displayed_tokens:
+            return  # Nothing has changed
+        self._displayed_tokens = (first_token_index, last_token_index)
+
         line_number = self._boundaries[first_token_index][0][0]
+        if line_number != self._displayed_line:
+            with self._latency.measure("context lines"):
+                self._display_lines(line_number)
+        with self._latency.measure("context highlight"):
+            self._highlight(first_token_index, last_token_index)
 
+    def _display_lines(self, line_number: int) -> None:
+        """
+        Displays the code around line_number, which goes in the middle.
+        """
+        self._displayed_line = line_number
         # Recall that line_number comes from the token module, which starts
         # counting at 1 instead of 0.
         start = line_number - self.CONTEXT_COUNT - 1
         end   = line_number + self.CONTEXT_COUNT
-        lines = ["{:>{}}: {}".format(i + 1, self.LINE_NUMBER_WIDTH,
-                                     self._snip_line(i))
-                 if 0 <= i < len(self._lines) else ""
-                 for i in range(start, end)]
-        text = "\n".join(lines)
+        text = "\n".join(self._format_line(i) for i in range(start, end))
 
         # Update the displayed code
         self.configure(state=tk.NORMAL)
         self.delete("1.0", tk.END)
         self.insert(tk.INSERT, text)
+        # Remember to disable editing again when we're done, so users can't
+        # modify the code we're displaying!
+        self.configure(state=tk.DISABLED)
+
+    def _highlight(self, first_token_index: int, last_token_index: int) -> None:
+        """
+        Highlights the tokens from first_token_index through last_token_index,
+        the first of which must be on the line in the middle of the display.
+        Tags can be changed even when editing is disabled.
+        """
+        self.tag_remove("token", "1.0", tk.END)
 
         # Highlight the tokens of interest...
         ar, ac = self._boundaries[first_token_index][0]
@@ -116,7 +163,6 @@ class _Context(tk.Text):
                                     ac + self.PRELUDE_WIDTH),
                      "{}.{}".format(self.CONTEXT_COUNT + 1 + br - ar,
                                     bc + self.PRELUDE_WIDTH))
-        self.tag_config("token", background=self._highlight_color)
 
         # ...but don't highlight the line numbers on multi-line tokens.
         for i in range(self.CONTEXT_COUNT):
@@ -125,48 +171,82 @@ class _Context(tk.Text):
                             "{}.{}".format(line, 0),
                             "{}.{}".format(line, self.PRELUDE_WIDTH))
 
-        # Remember to disable editing again when we're done, so users can't
-        # modify the code we're displaying!
-        self.configure(state=tk.DISABLED)
-
 
 class _Gui(tk.Frame):
     def __init__(
         self,
-        matrix: numpy.typing.NDArray[numpy.uint8],
-        hues: Optional[numpy.typing.NDArray[numpy.uint8]],
+        pyramid: ImagePyramid,
         data_a: FileInfo,
         data_b: FileInfo,
-        map_width: int,
         text_width: int,
         root: tk.Tk,
+        hue_levels: Optional[multiprocessing.pool.AsyncResult[
+            list[numpy.typing.NDArray[numpy.uint8]]]],
+        latency: LatencyLog,
     ) -> None:
         super().__init__(root)
         self.pack(fill=tk.BOTH, expand=True)
-        self._map = ZoomMap(self, matrix, hues, map_width)
+        self._latency = latency
+        self._map = ZoomMap(self, pyramid, latency)
+        if hue_levels is not None:
+            self._map.add_hues_when_ready(hue_levels)
 
-        self._contexts = [_Context(self, data, text_width, self._map)
+        self._contexts = [_Context(self, data, text_width, self._map, latency)
                           for data in (data_a, data_b)]
+        if latency.enabled:
+            # Show how long the most recent event took to handle and redraw.
+            self._latency_label = tk.Label(self, font="TkFixedFont",
+                                           anchor=tk.W)
+            self._latency_label.pack(fill=tk.X)
+            latency.listener = self._show_latency
+        # The most recent mouse movement we haven't handled yet
+        self._pending_motion: Optional[tk.Event] = None
         for event in ("<Motion>", "<Enter>"):
             self._map.bind(event, self._on_motion)
 
     def _on_motion(self, event: tk.Event) -> None:
-        # We're using (row, col) format, so the first one changes with Y.
-        self._contexts[0].display(self._map.canvasy(event.y))
-        self._contexts[1].display(self._map.canvasx(event.x))
+        # Motion events can arrive much faster than we can redraw (especially
+        # over a slow X connection). Rather than updating the contexts for
+        # every one, remember the latest and update once TK has caught up with
+        # everything else.
+        if self._pending_motion is None:
+            self.after_idle(self._update_contexts)
+        self._pending_motion = event
+
+    def _update_contexts(self) -> None:
+        event = self._pending_motion
+        self._pending_motion = None
+        if event is None:
+            return
+        with self._latency.measure("motion", self):
+            # We're using (row, col) format, so the first one changes with Y.
+            self._contexts[0].display(self._map.canvasy(event.y))
+            self._contexts[1].display(self._map.canvasx(event.x))
+
+    def _show_latency(self, name: str, seconds: float) -> None:
+        if name.endswith(" + redraw"):
+            self._latency_label.configure(
+                text=f"{name}: {seconds * 1000:.1f} ms")
 
 
 def launch(
-    matrix: numpy.typing.NDArray[numpy.uint8],
-    hues: Optional[numpy.typing.NDArray[numpy.uint8]],
+    pyramid: ImagePyramid,
     data_a: FileInfo,
     data_b: FileInfo,
-    map_width: int,
     text_width: int,
+    hue_levels: Optional[multiprocessing.pool.AsyncResult[
+        list[numpy.typing.NDArray[numpy.uint8]]]]=None,
+    show_latency: bool=False,
 ) -> None:
     """
-    Creates a new window for the GUI and runs the main program.
+    Creates a new window for the GUI and runs the main program. The map shows
+    the contents of the pyramid, and is as wide as its sidelength. If
+    hue_levels is given, the pyramid starts out black and white and gets
+    colored in with them once they've been computed. If show_latency is set,
+    we display how long each event takes to handle, and print a summary when
+    the window is closed.
     """
+    latency = LatencyLog(show_latency)
     root = tk.Tk()
 
     def _quit(event: tk.Event) -> None:
@@ -177,7 +257,7 @@ def launch(
     # We construct a _Gui object, but don't bother holding on to a reference to
     # it because we're never going to touch it again. It doesn't get garbage
     # collected because `root` holds a reference to it.
-    _Gui(matrix, hues, data_a, data_b, map_width, text_width, root)
+    _Gui(pyramid, data_a, data_b, text_width, root, hue_levels, latency)
     while True:
         try:
             root.mainloop()
@@ -190,3 +270,4 @@ def launch(
             # bug.
             print("Macs with old versions of TK installed don't scroll "
                   "properly. Try upgrading Python to version 3.7 or later.")
+    latency.dump()
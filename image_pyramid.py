@@ -1,6 +1,7 @@
+from functools import partial
 import numpy
 import numpy.typing
-from typing import Optional
+from typing import Optional, Self
 
 import utils
 
@@ -13,141 +14,357 @@ class ImagePyramid:
         matrix: numpy.typing.NDArray[numpy.uint8],
         hues: Optional[numpy.typing.NDArray[numpy.uint8]],
         sidelength: int,
+        worker_count: int=1,
     ) -> None:
         """
-        The sidelength is how large a sub-image we will return in get_submatrix
+        The sidelength is how large a sub-image we will return in get_submatrix.
+        Zooming out on large images is split across worker_count threads.
         """
-        self._pyramid = []  # A list of `matrix` at different zoom levels
-        self._pyramid.append(matrix)
+        self._build([matrix], None if hues is None else [hues], sidelength,
+                    worker_count)
+
+    @classmethod
+    def from_arrays(
+        cls, arrays: dict[str, numpy.typing.NDArray], sidelength: int
+    ) -> Self:
+        """
+        Recreates a pyramid from the output of to_arrays. The arrays can be
+        memory-mapped: we only read the parts of them that get displayed.
+        """
+        pyramid = cls.__new__(cls)
+        level_count = len([name for name in arrays
+                           if name.startswith("matrix_")])
+        levels = [arrays[f"matrix_{i}"] for i in range(level_count)]
+        hue_levels: Optional[list[numpy.typing.NDArray[numpy.uint8]]] = None
+        if "hues_0" in arrays:
+            hue_levels = [arrays[f"hues_{i}"] for i in range(level_count)]
+        pyramid._build(levels, hue_levels, sidelength)
+        return pyramid
+
+    def to_arrays(self) -> dict[str, numpy.typing.NDArray]:
+        """
+        Returns every level of the pyramid, in a form from_arrays can read.
+        """
+        arrays = {f"matrix_{i}": level for i, level in enumerate(self._pyramid)}
+        if self._hue_pyramid is not None:
+            arrays.update({f"hues_{i}": level
+                           for i, level in enumerate(self._hue_pyramid)})
+        return arrays
+
+    def _build(
+        self,
+        pyramid: list[numpy.typing.NDArray[numpy.uint8]],
+        hue_pyramid: Optional[list[numpy.typing.NDArray[numpy.uint8]]],
+        sidelength: int,
+        worker_count: int=1,
+    ) -> None:
+        """
+        pyramid and hue_pyramid contain the first few levels of the pyramid
+        (at least the full-resolution level). We add on smaller and smaller
+        levels until they fit within the sidelength.
+        """
+        self._pyramid = pyramid  # A list of `matrix` at different zoom levels
+        self._hue_pyramid = hue_pyramid
         self._sidelength = sidelength
 
-        self._hue_pyramid: Optional[list[numpy.typing.NDArray[numpy.uint8]]]
-        if hues is None:
-            self._hue_pyramid = None
-        else:
-            self._hue_pyramid = []
-            self._hue_pyramid.append(hues)
+        matrix = pyramid[-1]
 
         # Zoom out and make the matrix smaller and smaller
         while max(matrix.shape) >= sidelength:
-            # Combine 2x2 squares of pixels to make the next level.
-            nr, nc = [(value // 2) * 2 for value in matrix.shape]
-            quads = [matrix[row:nr:2, col:nc:2]
-                     for row in [0, 1] for col in [0, 1]]
-            # TODO: Is there a standard way of resizing a binary image that
-            # keeps lines crisp while removing salt-and-pepper noise?
-
-            # We want the following outcomes when combining a 2x2 square into a
-            # single pixel:
-            #   - If none of the 4 pixels is set, we should not be set.
-            #   - If 1 of the 4 pixels is set, we're set a quarter of the time.
-            #   - If 2 of the 4 pixels are set, we're set half the time.
-            #   - It's impossible to have 3 of the 4 pixels set.
-            #   - If all 4 pixels are set, this one should be set, too.
-            # To discuss the times when half the pixels are set:
-            #   - If the two that are set are on the main diagonal, we should be
-            #     set. It's good to make diagonals easy to see.
-            #   - If the two that are set are off the main diagonal, we should
-            #     not be set.
-            #   - If the two that are set are adjacent to each other, we should
-            #     be set half the time.
-            # To discuss times when 1 pixel is set:
-            #   - If the 1 pixel is off the diagonal, it might be part of a
-            #     large diagonal line shifted 1 pixel off of our diagonal. Half
-            #     of these should be set.
-            #   - If the 1 pixel is on the diagonal, we should not be set (so
-            #     that we're set a quarter of the time overall).
-            # To satisfy all these conditions, we should be set either if both
-            # pixels on the diagonal are set or if 1 pixel off the diagonal is
-            # set.
-            matrix = ((quads[0] & quads[3]) |
-                      (quads[1] & numpy.logical_not(quads[2])))
+            matrix = self._zoom_out_matrix(matrix, worker_count)
             self._pyramid.append(matrix)
 
-            if hues is not None:
-                # Do the same thing with the hues, except use the most extreme
-                # value. To get the hues to look right (most problematic is
-                # red), we inverted them so low hues indicate longer runs of
-                # duplicated code than high ones. So, use the minimum instead
-                # of the maximum.
-                hue_quads = [hues[row:nr:2, col:nc:2]
-                             for row in [0, 1] for col in [0, 1]]
-                hues = numpy.minimum(
-                    numpy.minimum(hue_quads[0], hue_quads[1]),
-                    numpy.minimum(hue_quads[2], hue_quads[3]))
-                # On this next line, mypy isn't smart enough to figure out that
-                # we'll only get here if self._hue_pyramid is a list.
-                self._hue_pyramid.append(hues)  # type: ignore
+        if hue_pyramid is not None:
+            self.build_hue_levels(hue_pyramid, sidelength, worker_count)
 
         # self._zoom_level is the index into self._pyramid to get the current
         # image.
         self._zoom_level = 0  # Start at 100%
         self._max_zoom_level = len(self._pyramid) - 1
 
+    @staticmethod
+    def build_hue_levels(
+        hue_pyramid: list[numpy.typing.NDArray[numpy.uint8]],
+        sidelength: int,
+        worker_count: int=1,
+    ) -> list[numpy.typing.NDArray[numpy.uint8]]:
+        """
+        Like the matrix levels built in _build, except for the hues: we add on
+        smaller and smaller levels to hue_pyramid until they fit within the
+        sidelength, and return it. This ends up with the same number of levels
+        as a matrix of the same shape, so the result can be passed to
+        set_hue_levels. It doesn't need a pyramid, so it can be done in another
+        process.
+        """
+        hues = hue_pyramid[-1]
+        while max(hues.shape) >= sidelength:
+            hues = ImagePyramid._zoom_out_hues(hues, worker_count)
+            hue_pyramid.append(hues)
+        return hue_pyramid
+
+    def set_hue_levels(
+        self, hue_pyramid: list[numpy.typing.NDArray[numpy.uint8]]
+    ) -> None:
+        """
+        Colors in a pyramid that was built without hues, using the output of
+        build_hue_levels. Other threads rendering from the pyramid at the same
+        time get either entirely black-and-white or entirely colored images.
+        """
+        if len(hue_pyramid) != len(self._pyramid):
+            raise ValueError(f"Expected {len(self._pyramid)} levels of hues, "
+                             f"got {len(hue_pyramid)}")
+        self._hue_pyramid = hue_pyramid
+
+    @staticmethod
+    def downscale(
+        matrix: numpy.typing.NDArray[numpy.uint8],
+        hues: Optional[numpy.typing.NDArray[numpy.uint8]],
+        zoom_level: int,
+    ) -> tuple[numpy.typing.NDArray[numpy.uint8],
+               Optional[numpy.typing.NDArray[numpy.uint8]]]:
+        """
+        Returns the matrix and hues as they'd be at the given (non-negative)
+        zoom level of a pyramid, which is 2 ** zoom_level times smaller. If the
+        matrix is part of a larger one and its top-left corner is at a
+        multiple of 2 ** zoom_level, the result is the corresponding part of
+        the larger one's zoomed-out image, so big images can be downscaled a
+        block at a time.
+        """
+        for _ in range(zoom_level):
+            matrix = ImagePyramid._zoom_out_matrix(matrix)
+            if hues is not None:
+                hues = ImagePyramid._zoom_out_hues(hues)
+        return matrix, hues
+
+    @staticmethod
+    def _zoom_out_matrix(
+        matrix: numpy.typing.NDArray[numpy.uint8],
+        worker_count: int=1,
+    ) -> numpy.typing.NDArray[numpy.uint8]:
+        # Combine 2x2 squares of pixels to make the next level.
+        nr, nc = [(value // 2) * 2 for value in matrix.shape]
+        quads = [matrix[row:nr:2, col:nc:2]
+                 for row in [0, 1] for col in [0, 1]]
+        # TODO: Is there a standard way of resizing a binary image that
+        # keeps lines crisp while removing salt-and-pepper noise?
+
+        # We want the following outcomes when combining a 2x2 square into a
+        # single pixel:
+        #   - If none of the 4 pixels is set, we should not be set.
+        #   - If 1 of the 4 pixels is set, we're set a quarter of the time.
+        #   - If 2 of the 4 pixels are set, we're set half the time.
+        #   - It's impossible to have 3 of the 4 pixels set.
+        #   - If all 4 pixels are set, this one should be set, too.
+        # To discuss the times when half the pixels are set:
+        #   - If the two that are set are on the main diagonal, we should be
+        #     set. It's good to make diagonals easy to see.
+        #   - If the two that are set are off the main diagonal, we should
+        #     not be set.
+        #   - If the two that are set are adjacent to each other, we should
+        #     be set half the time.
+        # To discuss times when 1 pixel is set:
+        #   - If the 1 pixel is off the diagonal, it might be part of a
+        #     large diagonal line shifted 1 pixel off of our diagonal. Half
+        #     of these should be set.
+        #   - If the 1 pixel is on the diagonal, we should not be set (so
+        #     that we're set a quarter of the time overall).
+        # To satisfy all these conditions, we should be set either if both
+        # pixels on the diagonal are set or if 1 pixel off the diagonal is
+        # set.
+        result = numpy.empty([nr // 2, nc // 2], dtype=numpy.uint8)
+        utils.in_row_bands(
+            partial(ImagePyramid._combine_quads, quads, result),
+            result.shape, worker_count)
+        return result
+
+    @staticmethod
+    def _zoom_out_hues(
+        hues: numpy.typing.NDArray[numpy.uint8],
+        worker_count: int=1,
+    ) -> numpy.typing.NDArray[numpy.uint8]:
+        # Do the same thing as _zoom_out_matrix, except use the most extreme
+        # value. To get the hues to look right (most problematic is red), we
+        # inverted them so low hues indicate longer runs of duplicated code than
+        # high ones. So, use the minimum instead of the maximum.
+        nr, nc = [(value // 2) * 2 for value in hues.shape]
+        hue_quads = [hues[row:nr:2, col:nc:2]
+                     for row in [0, 1] for col in [0, 1]]
+        result = numpy.empty([nr // 2, nc // 2], dtype=numpy.uint8)
+        utils.in_row_bands(
+            partial(ImagePyramid._combine_hue_quads, hue_quads, result),
+            result.shape, worker_count)
+        return result
+
+    @staticmethod
+    def _combine_quads(
+        quads: list[numpy.typing.NDArray[numpy.uint8]],
+        result: numpy.typing.NDArray[numpy.uint8],
+        start: int,
+        end: int,
+    ) -> None:
+        """
+        Fills in rows start through end of the next level of the pyramid from
+        the 4 quadrants of each 2x2 square in the current level.
+        """
+        q0, q1, q2, q3 = [quad[start:end] for quad in quads]
+        result[start:end] = (q0 & q3) | (q1 & numpy.logical_not(q2))
+
+    @staticmethod
+    def _combine_hue_quads(
+        quads: list[numpy.typing.NDArray[numpy.uint8]],
+        result: numpy.typing.NDArray[numpy.uint8],
+        start: int,
+        end: int,
+    ) -> None:
+        """
+        Like _combine_quads, but for the hues.
+        """
+        h0, h1, h2, h3 = [quad[start:end] for quad in quads]
+        band = result[start:end]
+        numpy.minimum(h0, h1, out=band)
+        numpy.minimum(band, h2, out=band)
+        numpy.minimum(band, h3, out=band)
+
     def get_submatrix(
-        self, top_left_x: int, top_left_y: int
+        self, top_left_x: int, top_left_y: int, zoom_level: Optional[int]=None
     ) -> tuple[numpy.typing.NDArray[numpy.uint8], int, int]:
         """
         We return a sidelength-by-sidelength-by-3 ndarray containing an HSV
         image of the relevant region, and the indices of the top-left corner.
 
-        The image returned is at the current zoom level, 3 times taller and
-        wider than the displayed window, so that the center of the window is
-        the center of the image.
+        The image returned is at the given zoom level (by default, the current
+        one), 3 times taller and wider than the displayed window, so that the
+        center of the window is the center of the image.
         """
-        zoom_level = self._zoom_level
+        return self.render_region(top_left_x -     self._sidelength,
+                                  top_left_y -     self._sidelength,
+                                  top_left_x + 2 * self._sidelength,
+                                  top_left_y + 2 * self._sidelength,
+                                  zoom_level)
+
+    def render_region(
+        self,
+        min_x: int,
+        min_y: int,
+        max_x: int,
+        max_y: int,
+        zoom_level: Optional[int]=None,
+    ) -> tuple[numpy.typing.NDArray[numpy.uint8], int, int]:
+        """
+        We return an HSV image of the region from (min_x, min_y) up to but not
+        including (max_x, max_y) at the given zoom level (by default, the
+        current one), trimmed to the parts that contain data, and the indices
+        of its top-left corner. This doesn't modify the pyramid, so it's safe
+        to call from other threads.
+        """
+        submatrix, subhues, min_x, min_y = self.get_region_data(
+            min_x, min_y, max_x, max_y, zoom_level)
+        return utils.to_hsv_matrix(submatrix, subhues), min_x, min_y
+
+    def get_region_data(
+        self,
+        min_x: int,
+        min_y: int,
+        max_x: int,
+        max_y: int,
+        zoom_level: Optional[int]=None,
+    ) -> tuple[numpy.typing.NDArray[numpy.uint8],
+               Optional[numpy.typing.NDArray[numpy.uint8]], int, int]:
+        """
+        Like render_region, but we return the matrix and hues (if we have them)
+        of the region instead of an HSV image of it, followed by the indices of
+        its top-left corner.
+        """
+        if zoom_level is None:
+            zoom_level = self._zoom_level
         scale = max(0, -zoom_level)
-        current_data = self._pyramid[max(0, zoom_level)]
-        nr, nc = current_data.shape
-        nr <<= scale
-        nc <<= scale
+        nr, nc = self.get_shape(zoom_level)
 
-        min_x = max(0,  top_left_x -     self._sidelength)
-        min_y = max(0,  top_left_y -     self._sidelength)
-        max_x = min(nc, top_left_x + 2 * self._sidelength)
-        max_y = min(nr, top_left_y + 2 * self._sidelength)
+        min_x = max(0,  min_x)
+        min_y = max(0,  min_y)
+        max_x = min(nc, max_x)
+        max_y = min(nr, max_y)
 
         if zoom_level >= 0:
             # No need to do anything special: just return the relevant data
-            submatrix = current_data[min_y:max_y, min_x:max_x]
-            if self._hue_pyramid is None:
-                subhues = None
-            else:
-                hues = self._hue_pyramid[zoom_level]
-                subhues = hues[min_y:max_y, min_x:max_x]
-            image = utils.to_hsv_matrix(submatrix, subhues)
-            return image, min_x, min_y
+            submatrix, subhues = self._get_region(
+                zoom_level, min_x, min_y, max_x, max_y)
+            return submatrix, subhues, min_x, min_y
 
         # Otherwise, we're zoomed in more than 100%. Grab the data we want,
         # then duplicate it a bunch.
 
-        # First, scale all the coordinates to the actual data size.
-        min_x >>= scale
-        min_y >>= scale
-        max_x >>= scale
-        max_y >>= scale
-        # To make roundoff errors harder to notice, make the truncated edges 1
-        # pixel wider before expanding. Better to be too big than too small.
-        max_x += 1
-        max_y += 1
-
-        submatrix = current_data[min_y:max_y, min_x:max_x]
+        # First, scale all the coordinates to the actual data size. Round the
+        # far edges up, so that the data we grab covers the entire region even
+        # when it starts or ends partway through a data pixel.
+        data_min_x = min_x >> scale
+        data_min_y = min_y >> scale
+        data_max_x = ((max_x - 1) >> scale) + 1
+        data_max_y = ((max_y - 1) >> scale) + 1
+
+        submatrix, subhues = self._get_region(
+            0, data_min_x, data_min_y, data_max_x, data_max_y)
+        submatrix = self._expand(
+            submatrix, scale, min_x, min_y, max_x, max_y)
+        if subhues is not None:
+            subhues = self._expand(
+                subhues, scale, min_x, min_y, max_x, max_y)
+        # Colorizing happens after this, once we've cut things down to the
+        # region, so we never make an HSV image any larger than it needs to be.
+        return submatrix, subhues, min_x, min_y
+
+    def _get_shape(self, level: int) -> tuple[int, int]:
+        """
+        Returns the number of rows and columns in the given pyramid level.
+        """
+        nr, nc = self._pyramid[level].shape
+        return nr, nc
+
+    def _get_region(
+        self, level: int, min_x: int, min_y: int, max_x: int, max_y: int
+    ) -> tuple[numpy.typing.NDArray[numpy.uint8],
+               Optional[numpy.typing.NDArray[numpy.uint8]]]:
+        """
+        Returns the matrix and hues (if we have them) within the given bounds
+        of the given pyramid level.
+        """
+        submatrix = self._pyramid[level][min_y:max_y, min_x:max_x]
         if self._hue_pyramid is None:
-            subhues = None
-        else:
-            subhues = self._hue_pyramid[0][min_y:max_y, min_x:max_x]
-        image = utils.to_hsv_matrix(submatrix, subhues)
-
-        # Now, duplicate the data until it's grown to the right size.
-        for _ in range(-zoom_level):
-            new_image = numpy.zeros(
-                [2 * image.shape[0], 2 * image.shape[1], 3], numpy.uint8)
-            for r in [0, 1]:
-                for c in [0, 1]:
-                    new_image[r::2, c::2, :] = image
-            image = new_image
-
-        return image, min_x << scale, min_y << scale
+            return submatrix, None
+        return submatrix, self._hue_pyramid[level][min_y:max_y, min_x:max_x]
+
+    @staticmethod
+    def _expand(
+        data: numpy.typing.NDArray[numpy.uint8],
+        scale: int,
+        min_x: int,
+        min_y: int,
+        max_x: int,
+        max_y: int,
+    ) -> numpy.typing.NDArray[numpy.uint8]:
+        """
+        The data is a single-channel 2D array whose top-left corner is at
+        (min_x >> scale, min_y >> scale). We return it grown by a factor of
+        2 ** scale in each direction (so each value becomes a square of
+        identical values), cropped to the region from (min_x, min_y) up to but
+        not including (max_x, max_y).
+        """
+        factor = 1 << scale
+        nr, nc = data.shape
+        # Broadcasting gives us a view in which each value is repeated without
+        # copying anything, so the reshape is the only time we allocate the
+        # enlarged image.
+        expanded = numpy.broadcast_to(
+            data[:, numpy.newaxis, :, numpy.newaxis],
+            (nr, factor, nc, factor)).reshape(nr * factor, nc * factor)
+
+        # The data started at a multiple of the factor, which might be a little
+        # before the region we want. Trim off the extra.
+        offset_x = min_x - ((min_x >> scale) << scale)
+        offset_y = min_y - ((min_y >> scale) << scale)
+        width = max(0, max_x - min_x)
+        height = max(0, max_y - min_y)
+        return expanded[offset_y:offset_y + height, offset_x:offset_x + width]
 
     def zoom(self, amount: int) -> bool:
         """
@@ -163,3 +380,233 @@ class ImagePyramid:
 
     def get_zoom_level(self) -> int:
         return self._zoom_level
+
+    def is_valid_zoom_level(self, zoom_level: int) -> bool:
+        return -self._ZOOMED_IN_LEVELS <= zoom_level <= self._max_zoom_level
+
+    def get_sidelength(self) -> int:
+        return self._sidelength
+
+    def get_max_zoom_level(self) -> int:
+        return self._max_zoom_level
+
+    def get_shape(self, zoom_level: int) -> tuple[int, int]:
+        """
+        Returns the number of rows and columns at the given zoom level.
+        """
+        scale = max(0, -zoom_level)
+        nr, nc = self._get_shape(max(0, zoom_level))
+        return nr << scale, nc << scale
+
+
+# The coordinates of the pixels in one level of a SparseImagePyramid, whether
+# each one is set, and optionally their hues.
+_SparseLevel = tuple[numpy.typing.NDArray[numpy.int64],
+                     numpy.typing.NDArray[numpy.int64],
+                     numpy.typing.NDArray[numpy.bool_],
+                     Optional[numpy.typing.NDArray[numpy.uint8]]]
+
+
+class SparseImagePyramid(ImagePyramid):
+    """
+    An ImagePyramid built from the coordinates of the set pixels rather than
+    from a dense matrix. Every level stores only the pixels that have at least
+    one match somewhere beneath them, so memory scales with the number of
+    matches instead of the number of pixels, and we only build dense arrays
+    for the regions that actually get displayed.
+    """
+    def __init__(
+        self,
+        rows: numpy.typing.NDArray[numpy.int64],
+        cols: numpy.typing.NDArray[numpy.int64],
+        hues: Optional[numpy.typing.NDArray[numpy.uint8]],
+        shape: tuple[int, int],
+        sidelength: int,
+        will_set_hues: bool=False,
+    ) -> None:
+        """
+        rows and cols are the coordinates of every set pixel, sorted by row and
+        then by column (as returned by utils.get_matches). hues is either None
+        or the hue of each of those pixels. shape is the size of the full
+        matrix these pixels came from. If will_set_hues is set, the pyramid
+        starts out black and white, but keeps track of the same pixels as a
+        colored one, so that it can be colored in later by set_hue_levels.
+        """
+        is_set = numpy.ones(len(rows), dtype=numpy.bool_)
+        self._build_levels([(rows, cols, is_set, hues)], [shape], sidelength,
+                           will_set_hues)
+
+    @staticmethod
+    def build_sparse_hue_levels(
+        rows: numpy.typing.NDArray[numpy.int64],
+        cols: numpy.typing.NDArray[numpy.int64],
+        hues: numpy.typing.NDArray[numpy.uint8],
+        shape: tuple[int, int],
+        sidelength: int,
+    ) -> list[numpy.typing.NDArray[numpy.uint8]]:
+        """
+        Like ImagePyramid.build_hue_levels, but for the pixels at rows and cols
+        (with the same arguments as the constructor): we return the hues of
+        every level of the pyramid, which can be passed to the set_hue_levels
+        of one built with will_set_hues. It doesn't need a pyramid, so it can
+        be done in another process.
+        """
+        level: _SparseLevel = (
+            rows, cols, numpy.ones(len(rows), dtype=numpy.bool_), hues)
+        hue_levels = [hues]
+        while max(shape) >= sidelength:
+            level = SparseImagePyramid._zoom_out(*level, shape)
+            shape = (shape[0] // 2, shape[1] // 2)
+            # mypy can't tell that the hues are still there.
+            hue_levels.append(level[3])  # type: ignore
+        return hue_levels
+
+    @classmethod
+    def from_arrays(
+        cls, arrays: dict[str, numpy.typing.NDArray], sidelength: int
+    ) -> Self:
+        pyramid = cls.__new__(cls)
+        shapes = [(int(nr), int(nc)) for nr, nc in arrays["shapes"]]
+        levels = [(arrays[f"rows_{i}"], arrays[f"cols_{i}"],
+                   arrays[f"is_set_{i}"], arrays.get(f"hues_{i}"))
+                  for i in range(len(shapes))]
+        pyramid._build_levels(levels, shapes, sidelength)
+        return pyramid
+
+    def to_arrays(self) -> dict[str, numpy.typing.NDArray]:
+        arrays: dict[str, numpy.typing.NDArray] = {
+            "shapes": numpy.array(self._shapes, dtype=numpy.int64)}
+        for i, (rows, cols, is_set, hues) in enumerate(self._levels):
+            arrays[f"rows_{i}"] = rows
+            arrays[f"cols_{i}"] = cols
+            arrays[f"is_set_{i}"] = is_set
+            if hues is not None:
+                arrays[f"hues_{i}"] = hues
+        return arrays
+
+    def _build_levels(
+        self,
+        levels: list[_SparseLevel],
+        shapes: list[tuple[int, int]],
+        sidelength: int,
+        will_set_hues: bool=False,
+    ) -> None:
+        """
+        levels and shapes describe the first few levels of the pyramid (at
+        least the full-resolution level). We add on smaller and smaller levels
+        until they fit within the sidelength.
+        """
+        self._sidelength = sidelength
+        self._will_set_hues = will_set_hues
+        # Each level is a tuple of (rows, cols, is_set, hues) describing the
+        # pixels with at least one match beneath them, sorted in row-major
+        # order. Pixels with no matches beneath them are never set.
+        self._levels = levels
+        self._shapes = shapes
+        rows, cols, is_set, hues = levels[-1]
+        shape = shapes[-1]
+
+        while max(shape) >= sidelength:
+            rows, cols, is_set, hues = self._zoom_out(
+                rows, cols, is_set, hues, shape, will_set_hues)
+            shape = (shape[0] // 2, shape[1] // 2)
+            self._shapes.append(shape)
+            self._levels.append((rows, cols, is_set, hues))
+
+        self._zoom_level = 0  # Start at 100%
+        self._max_zoom_level = len(self._levels) - 1
+
+    def set_hue_levels(
+        self, hue_pyramid: list[numpy.typing.NDArray[numpy.uint8]]
+    ) -> None:
+        if not self._will_set_hues:
+            raise ValueError("The pyramid wasn't built to be colored in later")
+        if len(hue_pyramid) != len(self._levels):
+            raise ValueError(f"Expected {len(self._levels)} levels of hues, "
+                             f"got {len(hue_pyramid)}")
+        # Replace all the levels at once, so other threads rendering from the
+        # pyramid see either all the hues or none of them.
+        levels: list[_SparseLevel] = [
+            (rows, cols, is_set, hues)
+            for (rows, cols, is_set, _), hues in zip(self._levels, hue_pyramid)]
+        self._levels = levels
+
+    @staticmethod
+    def _zoom_out(
+        rows: numpy.typing.NDArray[numpy.int64],
+        cols: numpy.typing.NDArray[numpy.int64],
+        is_set: numpy.typing.NDArray[numpy.bool_],
+        hues: Optional[numpy.typing.NDArray[numpy.uint8]],
+        shape: tuple[int, int],
+        keep_unset: bool=False,
+    ) -> _SparseLevel:
+        """
+        Combines 2x2 squares of pixels to make the next level, using the same
+        rules as ImagePyramid: a pixel is set if both pixels on the diagonal
+        are set or if the top-right one is set and the bottom-left is not, and
+        its hue is the minimum hue of the pixels beneath it. Pixels that
+        aren't set are only kept if there are hues, or if keep_unset is set.
+        """
+        # Like the dense version, drop the last row/column if there is an odd
+        # number of them.
+        nr, nc = [(value // 2) * 2 for value in shape]
+        in_bounds = (rows < nr) & (cols < nc)
+        if hues is None and not keep_unset:
+            # Without hues to keep track of, there's no reason to hold on to
+            # pixels that aren't set.
+            in_bounds &= is_set
+        rows = rows[in_bounds]
+        cols = cols[in_bounds]
+        is_set = is_set[in_bounds]
+
+        # Number the 4 pixels of each square the same way ImagePyramid does:
+        # 0 is top-left, 1 is top-right, 2 is bottom-left, 3 is bottom-right.
+        # Then make a bitmask of which of them are set.
+        quadrant = ((rows & 1) << 1) | (cols & 1)
+        bits = numpy.where(is_set, 1 << quadrant, 0).astype(numpy.uint8)
+
+        # The input is in row-major order, but two rows of it get interleaved
+        # into one row of the output, so we need to re-sort it.
+        keys = (rows >> 1) * (nc // 2) + (cols >> 1)
+        order = numpy.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = numpy.flatnonzero(numpy.diff(keys, prepend=-1))
+
+        bits = numpy.bitwise_or.reduceat(bits[order], starts)
+        new_is_set = (((bits & 0b1001) == 0b1001) |
+                      ((bits & 0b0110) == 0b0010))
+        if hues is not None:
+            hues = numpy.minimum.reduceat(hues[in_bounds][order], starts)
+
+        keys = keys[starts]
+        new_rows = keys // (nc // 2)
+        new_cols = keys % (nc // 2)
+        return new_rows, new_cols, new_is_set, hues
+
+    def _get_shape(self, level: int) -> tuple[int, int]:
+        return self._shapes[level]
+
+    def _get_region(
+        self, level: int, min_x: int, min_y: int, max_x: int, max_y: int
+    ) -> tuple[numpy.typing.NDArray[numpy.uint8],
+               Optional[numpy.typing.NDArray[numpy.uint8]]]:
+        rows, cols, is_set, hues = self._levels[level]
+        height = max(0, max_y - min_y)
+        width = max(0, max_x - min_x)
+
+        # The rows are sorted, so we can find the relevant ones quickly, and
+        # then filter by column within them.
+        start, end = numpy.searchsorted(rows, [min_y, max_y])
+        region_rows = rows[start:end]
+        region_cols = cols[start:end]
+        visible = (min_x <= region_cols) & (region_cols < max_x)
+        region_rows = region_rows[visible] - min_y
+        region_cols = region_cols[visible] - min_x
+
+        submatrix = numpy.zeros([height, width], dtype=numpy.uint8)
+        submatrix[region_rows, region_cols] = is_set[start:end][visible]
+        if hues is None:
+            return submatrix, None
+        subhues = numpy.zeros([height, width], dtype=numpy.uint8)
+        subhues[region_rows, region_cols] = hues[start:end][visible]
+        return submatrix, subhues
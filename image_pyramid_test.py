@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import numpy
+import unittest
+
+from image_pyramid import ImagePyramid, SparseImagePyramid
+import utils
+
+
+class TestGetSubmatrix(unittest.TestCase):
+    def setUp(self):
+        generator = numpy.random.default_rng(0)
+        self.matrix = generator.integers(0, 2, [37, 53], dtype=numpy.uint8)
+        self.hues = generator.integers(0, 171, [37, 53], dtype=numpy.uint8)
+        self.sidelength = 16
+
+    def expected_zoomed_in(self, zoom_level, top_left_x, top_left_y):
+        # Build the fully-expanded image the slow, obvious way, then cut out the
+        # region get_submatrix should return.
+        factor = 2 ** -zoom_level
+        image = utils.to_hsv_matrix(self.matrix, self.hues)
+        image = image.repeat(factor, axis=0).repeat(factor, axis=1)
+        min_x = max(0, top_left_x - self.sidelength)
+        min_y = max(0, top_left_y - self.sidelength)
+        max_x = top_left_x + 2 * self.sidelength
+        max_y = top_left_y + 2 * self.sidelength
+        return image[min_y:max_y, min_x:max_x], min_x, min_y
+
+    def test_zoomed_in(self):
+        pyramid = ImagePyramid(self.matrix, self.hues, self.sidelength)
+        for zoom_level in (-1, -2, -3):
+            pyramid.zoom(zoom_level - pyramid.get_zoom_level())
+            for top_left_x, top_left_y in ((0, 0), (5, 11), (37, 3),
+                                           (100, 250)):
+                expected, expected_x, expected_y = self.expected_zoomed_in(
+                    zoom_level, top_left_x, top_left_y)
+                actual, actual_x, actual_y = pyramid.get_submatrix(
+                    top_left_x, top_left_y)
+                self.assertEqual((expected_x, expected_y), (actual_x, actual_y))
+                self.assertEqual(expected.shape, actual.shape)
+                self.assertTrue((expected == actual).all())
+
+    def test_zoomed_in_black_and_white(self):
+        pyramid = ImagePyramid(self.matrix, None, self.sidelength)
+        pyramid.zoom(-2)
+        actual, min_x, min_y = pyramid.get_submatrix(20, 30)
+        expected = utils.to_hsv_matrix(
+            self.matrix.repeat(4, axis=0).repeat(4, axis=1), None)
+        self.assertEqual((4, 14), (min_x, min_y))
+        self.assertTrue((expected[14:62, 4:52] == actual).all())
+
+
+class TestWorkers(unittest.TestCase):
+    def test_same_output(self):
+        # The image needs to be big enough to be worth splitting into bands.
+        generator = numpy.random.default_rng(2)
+        matrix = generator.integers(0, 2, [3001, 2003], dtype=numpy.uint8)
+        hues = generator.integers(0, 171, matrix.shape, dtype=numpy.uint8)
+        serial = ImagePyramid(matrix, hues, 100)
+        parallel = ImagePyramid(matrix, hues, 100, worker_count=4)
+        for expected, actual in zip(serial.to_arrays().values(),
+                                    parallel.to_arrays().values()):
+            self.assertTrue((expected == actual).all())
+        self.assertTrue((utils.to_hsv_matrix(matrix, hues) ==
+                         utils.to_hsv_matrix(matrix, hues, 4)).all())
+
+
+class TestHueLevels(unittest.TestCase):
+    def test_add_hues_later(self):
+        generator = numpy.random.default_rng(4)
+        matrix = generator.integers(0, 2, [301, 117], dtype=numpy.uint8)
+        hues = generator.integers(0, 171, matrix.shape, dtype=numpy.uint8)
+        expected = ImagePyramid(matrix, hues, 20)
+        actual = ImagePyramid(matrix, None, 20)
+        actual.set_hue_levels(ImagePyramid.build_hue_levels([hues], 20))
+        self.assertEqual(expected.to_arrays().keys(), actual.to_arrays().keys())
+        for name, array in expected.to_arrays().items():
+            self.assertTrue((array == actual.to_arrays()[name]).all())
+
+    def test_wrong_level_count(self):
+        matrix = numpy.zeros([100, 100], dtype=numpy.uint8)
+        pyramid = ImagePyramid(matrix, None, 20)
+        with self.assertRaises(ValueError):
+            pyramid.set_hue_levels(ImagePyramid.build_hue_levels([matrix], 50))
+
+
+class TestDownscale(unittest.TestCase):
+    def test_matches_pyramid(self):
+        generator = numpy.random.default_rng(7)
+        matrix = generator.integers(0, 2, [203, 98], dtype=numpy.uint8)
+        hues = generator.integers(0, 171, matrix.shape, dtype=numpy.uint8)
+        arrays = ImagePyramid(matrix, hues, 10).to_arrays()
+        for zoom_level in range(5):
+            actual_matrix, actual_hues = ImagePyramid.downscale(
+                matrix, hues, zoom_level)
+            self.assertTrue(
+                (arrays[f"matrix_{zoom_level}"] == actual_matrix).all())
+            self.assertTrue((arrays[f"hues_{zoom_level}"] == actual_hues).all())
+        self.assertIsNone(ImagePyramid.downscale(matrix, None, 2)[1])
+
+
+class TestSparseImagePyramid(unittest.TestCase):
+    def setUp(self):
+        generator = numpy.random.default_rng(1)
+        tokens_a = generator.integers(0, 5, 150).astype(str)
+        tokens_b = generator.integers(0, 5, 230).astype(str)
+        self.matrix = utils.make_matrix(tokens_a, tokens_b)
+        self.rows, self.cols = utils.get_matches(tokens_a, tokens_b)
+        # Unmatched pixels get the bluest hue, as in find_duplicates.get_hues.
+        self.hues = generator.integers(0, 171, self.matrix.shape,
+                                       dtype=numpy.uint8)
+        self.hues[self.matrix == 0] = 170
+
+    def test_get_matches(self):
+        expected_rows, expected_cols = numpy.nonzero(self.matrix)
+        self.assertTrue((expected_rows == self.rows).all())
+        self.assertTrue((expected_cols == self.cols).all())
+
+    def assertPyramidsMatch(self, dense, sparse):
+        self.assertEqual(dense._max_zoom_level, sparse._max_zoom_level)
+        for zoom_level in range(-3, dense._max_zoom_level + 1):
+            dense.zoom(zoom_level - dense.get_zoom_level())
+            sparse.zoom(zoom_level - sparse.get_zoom_level())
+            for top_left in ((0, 0), (17, 40), (200, 3), (500, 500)):
+                expected, expected_x, expected_y = dense.get_submatrix(
+                    *top_left)
+                actual, actual_x, actual_y = sparse.get_submatrix(*top_left)
+                self.assertEqual((expected_x, expected_y), (actual_x, actual_y))
+                self.assertEqual(expected.shape, actual.shape)
+                # Pixels that aren't set are black no matter what their hue
+                # and saturation are, so only compare the ones that are set.
+                is_set = expected[:, :, 2] != 0
+                self.assertTrue((is_set == (actual[:, :, 2] != 0)).all())
+                self.assertTrue((expected[is_set] == actual[is_set]).all())
+
+    def test_black_and_white(self):
+        dense = ImagePyramid(self.matrix, None, 16)
+        sparse = SparseImagePyramid(
+            self.rows, self.cols, None, self.matrix.shape, 16)
+        self.assertPyramidsMatch(dense, sparse)
+
+    def test_colored(self):
+        dense = ImagePyramid(self.matrix, self.hues, 16)
+        sparse = SparseImagePyramid(self.rows, self.cols,
+                                    self.hues[self.rows, self.cols],
+                                    self.matrix.shape, 16)
+        self.assertPyramidsMatch(dense, sparse)
+
+    def test_set_hue_levels(self):
+        dense = ImagePyramid(self.matrix, self.hues, 16)
+        sparse = SparseImagePyramid(self.rows, self.cols, None,
+                                    self.matrix.shape, 16, will_set_hues=True)
+        self.assertPyramidsMatch(ImagePyramid(self.matrix, None, 16), sparse)
+        sparse.set_hue_levels(SparseImagePyramid.build_sparse_hue_levels(
+            self.rows, self.cols, self.hues[self.rows, self.cols],
+            self.matrix.shape, 16))
+        self.assertPyramidsMatch(dense, sparse)
+
+        black_and_white = SparseImagePyramid(
+            self.rows, self.cols, None, self.matrix.shape, 16)
+        with self.assertRaises(ValueError):
+            black_and_white.set_hue_levels([])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 from parameterized import parameterized
+import os
 import PIL.Image
 import PIL.ImageChops
+import tempfile
 import unittest
 
 import find_duplicates
 import tokenizer
 import utils
+import visual_diff
 
 
 class TestGetLengths(unittest.TestCase):
@@ -50,6 +53,17 @@ class TestGetLengths(unittest.TestCase):
         actual_image = self.generate_image(filename_a, filename_b)
         self.assertImagesMatch(image_filename, actual_image)
 
+    def test_save_png(self):
+        data = tokenizer.get_file_tokens("examples/server.go")
+        hues = find_duplicates.get_hues(
+            utils.make_matrix(data.tokens, data.tokens), True)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "server.png")
+            visual_diff.save_image(filename, data.tokens, data.tokens, hues, 0,
+                                   1)
+            with PIL.Image.open(filename) as actual_image:
+                self.assertImagesMatch("server.png", actual_image)
+
 
 if __name__ == '__main__':
     unittest.main()
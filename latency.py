@@ -0,0 +1,94 @@
+import collections
+import contextlib
+import numpy
+import sys
+import time
+import tkinter as tk
+from typing import Callable, Iterator, Optional, TextIO
+
+
+class LatencyLog:
+    """
+    Records how long the GUI takes to handle each kind of event, so that we can
+    tell which parts are slow. When disabled (the default), measuring things
+    costs almost nothing and records nothing.
+    """
+    PERCENTILES: tuple[int, ...] = (50, 90, 99)
+
+    def __init__(self, enabled: bool=False) -> None:
+        self.enabled = enabled
+        self._samples: collections.defaultdict[str, list[float]] = (
+            collections.defaultdict(list))
+        # Called with the name and duration (in seconds) of everything
+        # recorded, so the GUI can display it as it happens.
+        self.listener: Optional[Callable[[str, float], None]] = None
+
+    def record(self, name: str, seconds: float) -> None:
+        self._samples[name].append(seconds)
+        if self.listener is not None:
+            self.listener(name, seconds)
+
+    @contextlib.contextmanager
+    def measure(
+        self, name: str, widget: Optional[tk.Misc]=None
+    ) -> Iterator[None]:
+        """
+        Records how long the body of the `with` block takes. If a widget is
+        given, we also record how long it takes until Tk is idle again
+        afterwards, which includes redrawing anything the block changed. That's
+        recorded as the name followed by " + redraw".
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+            if widget is not None:
+                # Tk redraws widgets in idle callbacks scheduled while the
+                # block ran, which come before this one.
+                widget.after_idle(lambda: self.record(
+                    f"{name} + redraw", time.perf_counter() - start))
+
+    @contextlib.contextmanager
+    def measure_into(
+        self, timings: list[tuple[str, float]], name: str
+    ) -> Iterator[None]:
+        """
+        Like measure, but for work on other threads: rather than recording how
+        long the block takes, we append the name and duration to timings, for
+        the GUI's thread to record later. The listener updates the GUI, so it
+        mustn't be called from anywhere else.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings.append((name, time.perf_counter() - start))
+
+    def summary(self) -> str:
+        """
+        Returns a table of the percentiles of every kind of event, in
+        milliseconds.
+        """
+        header = "".join(f"{f'p{p}':>9}" for p in self.PERCENTILES)
+        lines = [f"{'event':<28}{'count':>7}{header}{'max':>9}"]
+        for name, samples in sorted(self._samples.items()):
+            milliseconds = numpy.array(samples) * 1000
+            values = [*numpy.percentile(milliseconds, self.PERCENTILES),
+                      milliseconds.max()]
+            lines.append(f"{name:<28}{len(samples):>7}" +
+                         "".join(f"{value:>9.2f}" for value in values))
+        return "\n".join(lines)
+
+    def dump(self, stream: TextIO=sys.stderr) -> None:
+        if self.enabled and self._samples:
+            print("Latency in milliseconds:", file=stream)
+            print(self.summary(), file=stream)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import io
+import unittest
+
+from latency import LatencyLog
+
+
+class TestLatencyLog(unittest.TestCase):
+    def test_disabled(self):
+        log = LatencyLog()
+        with log.measure("zoom"):
+            pass
+        stream = io.StringIO()
+        log.dump(stream)
+        self.assertEqual("", stream.getvalue())
+
+    def test_measure(self):
+        log = LatencyLog(True)
+        heard = []
+        log.listener = lambda name, seconds: heard.append(name)
+        for _ in range(3):
+            with log.measure("zoom"):
+                pass
+        with self.assertRaises(KeyError):
+            with log.measure("drag"):
+                raise KeyError("Still recorded")
+        self.assertEqual(["zoom", "zoom", "zoom", "drag"], heard)
+
+    def test_measure_into(self):
+        log = LatencyLog(True)
+        heard = []
+        log.listener = lambda name, seconds: heard.append(name)
+        timings = []
+        with log.measure_into(timings, "render"):
+            pass
+        # Nothing is recorded until we say so.
+        self.assertEqual([], heard)
+        self.assertEqual(["render"], [name for name, _ in timings])
+        timings = []
+        with LatencyLog().measure_into(timings, "render"):
+            pass
+        self.assertEqual([], timings)
+
+    def test_summary(self):
+        log = LatencyLog(True)
+        for milliseconds in range(1, 101):
+            log.record("zoom", milliseconds / 1000)
+        log.record("drag", 0.002)
+        lines = log.summary().split("\n")
+        self.assertEqual(["event", "count", "p50", "p90", "p99", "max"],
+                         lines[0].split())
+        self.assertEqual(["drag", "1", "2.00", "2.00", "2.00", "2.00"],
+                         lines[1].split())
+        self.assertEqual(["zoom", "100", "50.50", "90.10", "99.01", "100.00"],
+                         lines[2].split())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import numpy
+import numpy.typing
+
+import utils
+
+
+# Comparing every pair of files in a big corpus takes a long time, even though
+# most pairs have nothing in common. To find the pairs worth comparing, we cut
+# each file into overlapping windows of tokens and estimate how similar the
+# windows are to each other using MinHash: each window's signature is the
+# smallest value of each of SIGNATURE_LENGTH hash functions over all the
+# shingles (runs of SHINGLE_LENGTH consecutive tokens) in it. Two windows agree
+# on any one of these with probability equal to the Jaccard similarity of
+# their sets of shingles. Then we use locality-sensitive hashing: split the
+# signatures into bands of a few values each, and only compare files that have
+# a pair of windows whose signatures agree on all of some band.
+#
+# The windows are sized so that any duplicated segment of at least the minimum
+# length covers a whole window in one file, and at least 3/4 of a window in the
+# other. The windows containing it then have a Jaccard similarity of around
+# 0.6. With the default of 4 values per band, such pairs of windows are found
+# about 99% of the time. Using fewer values per band finds more of them, at the
+# cost of comparing more pairs of files that turn out to have nothing in
+# common.
+SIGNATURE_LENGTH = 128
+SHINGLE_LENGTH = 5
+DEFAULT_BAND_SIZE = 4
+# Hashing a shingle for every one of the hash functions takes a lot of memory
+# for big files, so we do this many shingles at a time.
+_SHINGLES_PER_CHUNK = 1 << 14
+_SEEDS = numpy.random.default_rng(0).integers(
+    0, numpy.iinfo(numpy.uint64).max, SIGNATURE_LENGTH, dtype=numpy.uint64,
+    endpoint=True)
+
+
+def _mix(values: numpy.typing.NDArray[numpy.uint64]) -> None:
+    """
+    Scrambles the bits of the values in place (this is the finalizer from
+    SplitMix64), so that similar values end up with unrelated hashes.
+    """
+    values ^= values >> numpy.uint64(30)
+    values *= numpy.uint64(0xbf58476d1ce4e5b9)
+    values ^= values >> numpy.uint64(27)
+    values *= numpy.uint64(0x94d049bb133111eb)
+    values ^= values >> numpy.uint64(31)
+
+
+def hash_shingles(
+    token_ids: numpy.typing.NDArray[numpy.int32],
+    shingle_length: int=SHINGLE_LENGTH,
+) -> numpy.typing.NDArray[numpy.uint64]:
+    """
+    We return a hash of every run of shingle_length tokens in the file, in
+    order.
+    """
+    shingle_count = len(token_ids) - shingle_length + 1
+    hashes = numpy.zeros(max(0, shingle_count), dtype=numpy.uint64)
+    if shingle_count <= 0:
+        return hashes
+    for i in range(shingle_length):
+        _mix(hashes)
+        hashes ^= token_ids[i:i + shingle_count].astype(numpy.uint64)
+    _mix(hashes)
+    return hashes
+
+
+def get_window_signatures(
+    token_ids: numpy.typing.NDArray[numpy.int32], stride: int
+) -> numpy.typing.NDArray[numpy.uint64]:
+    """
+    We return the MinHash signatures of windows of 2 * stride tokens, starting
+    every stride tokens, with one row per window. The last window may be
+    shorter. Files with fewer tokens than a shingle have no windows.
+    """
+    shingles = hash_shingles(token_ids)
+    block_count = -(-len(shingles) // stride)
+    # First find the signature of each block of stride shingles, then combine
+    # neighboring blocks into windows.
+    blocks = numpy.zeros([block_count, SIGNATURE_LENGTH], dtype=numpy.uint64)
+    chunk_size = stride * max(1, _SHINGLES_PER_CHUNK // stride)
+    for start in range(0, len(shingles), chunk_size):
+        chunk = shingles[start:start + chunk_size]
+        hashes = chunk[numpy.newaxis, :] ^ _SEEDS[:, numpy.newaxis]
+        _mix(hashes)
+        blocks[start // stride:(start + len(chunk) - 1) // stride + 1] = (
+            numpy.minimum.reduceat(hashes, numpy.arange(0, len(chunk), stride),
+                                   axis=1).T)
+    if block_count <= 1:
+        return blocks
+    return numpy.minimum(blocks[:-1], blocks[1:])
+
+
+def _get_band_keys(
+    signatures: numpy.typing.NDArray[numpy.uint64], band_size: int
+) -> numpy.typing.NDArray[numpy.uint64]:
+    """
+    We return an array with one row per window and one column per band, where
+    each value is a hash of that window's signature within that band. The band
+    number is mixed in too, so that keys from different bands never collide.
+    """
+    band_count = SIGNATURE_LENGTH // band_size
+    bands = signatures[:, :band_count * band_size].reshape(
+        len(signatures), band_count, band_size)
+    keys = numpy.zeros([len(signatures), band_count], dtype=numpy.uint64)
+    keys += numpy.arange(band_count, dtype=numpy.uint64)
+    for i in range(band_size):
+        _mix(keys)
+        keys ^= bands[:, :, i]
+    _mix(keys)
+    return keys
+
+
+def get_candidate_pairs(
+    token_arrays: list[numpy.typing.NDArray[numpy.str_]],
+    min_length: int,
+    band_size: int=DEFAULT_BAND_SIZE,
+) -> set[tuple[int, int]]:
+    """
+    We return the indices (i, j) of the pairs of token arrays that probably
+    contain a duplicated segment of at least min_length tokens, with i <= j.
+    Pairs that aren't returned might still contain one, but are unlikely to.
+    Smaller band sizes return more pairs and miss fewer duplicates.
+    """
+    token_ids, offsets = utils.get_token_ids(token_arrays)
+    # Windows are 2/3 of the minimum length, starting every 1/3 of it.
+    stride = max(1, min_length // 3)
+
+    # We keep the file and window number of every band of every window, next
+    # to the key of that band.
+    all_keys = []
+    all_files = []
+    all_windows = []
+    for i, (start, end) in enumerate(zip(offsets, offsets[1:])):
+        if end - start < min_length:
+            continue  # Too short to contain a long enough duplicate
+        keys = _get_band_keys(
+            get_window_signatures(token_ids[start:end], stride), band_size)
+        all_keys.append(keys.ravel())
+        all_files.append(numpy.full(keys.size, i))
+        all_windows.append(numpy.repeat(numpy.arange(len(keys)),
+                                        keys.shape[1]))
+    if not all_keys:
+        return set()
+    keys = numpy.concatenate(all_keys)
+    files = numpy.concatenate(all_files)
+    windows = numpy.concatenate(all_windows)
+
+    # Sort the keys, so that windows whose bands match are next to each other.
+    order = numpy.argsort(keys, kind="stable")
+    keys, files, windows = keys[order], files[order], windows[order]
+    # Nearly all keys are unique, so drop those before looking at the groups
+    # one at a time.
+    is_same_as_next = keys[:-1] == keys[1:]
+    is_shared = numpy.zeros(len(keys), dtype=bool)
+    is_shared[:-1] |= is_same_as_next
+    is_shared[1:] |= is_same_as_next
+    keys, files, windows = keys[is_shared], files[is_shared], windows[is_shared]
+    group_starts = numpy.flatnonzero(numpy.diff(keys)) + 1
+
+    pairs: set[tuple[int, int]] = set()
+    for group_files, group_windows in zip(
+            numpy.split(files, group_starts),
+            numpy.split(windows, group_starts)):
+        if len(group_files) == 0:
+            continue  # Happens when no keys are shared
+        unique_files = numpy.unique(group_files).tolist()
+        for k, file_a in enumerate(unique_files):
+            pairs.update((file_a, file_b) for file_b in unique_files[k + 1:])
+            # Within one file, neighboring windows overlap, so they'll often
+            # match. That doesn't mean anything is duplicated.
+            file_windows = group_windows[group_files == file_a]
+            if file_windows.max() - file_windows.min() >= 2:
+                pairs.add((file_a, file_a))
+    return pairs
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import numpy
+import unittest
+
+import minhash
+
+
+class TestCandidatePairs(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(1)
+        vocabulary = numpy.array([f"token{i}" for i in range(50)])
+        self.files = [vocabulary[rng.integers(0, len(vocabulary), 2000)]
+                      for _ in range(3)]
+
+    def test_unrelated_files(self):
+        self.assertEqual(set(), minhash.get_candidate_pairs(self.files, 300))
+
+    def test_duplicate_between_files(self):
+        self.files[2][700:1000] = self.files[0][100:400]
+        self.assertEqual({(0, 2)},
+                         minhash.get_candidate_pairs(self.files, 300))
+
+    def test_duplicate_within_file(self):
+        self.files[1][100:400] = self.files[1][1200:1500]
+        self.assertEqual({(1, 1)},
+                         minhash.get_candidate_pairs(self.files, 300))
+
+    def test_short_files(self):
+        # Files shorter than the minimum length can't contain a long enough
+        # duplicate, even when they're identical.
+        self.assertEqual(set(), minhash.get_candidate_pairs(
+            [self.files[0][:200], self.files[0][:200]], 300))
+        self.assertEqual(set(), minhash.get_candidate_pairs(
+            [numpy.array([]), self.files[0]], 300))
+
+
+class TestWindowSignatures(unittest.TestCase):
+    def test_shape(self):
+        token_ids = numpy.arange(100, dtype=numpy.int32)
+        signatures = minhash.get_window_signatures(token_ids, 10)
+        # 96 shingles make 10 blocks, so 9 windows of 2 blocks each.
+        self.assertEqual((9, minhash.SIGNATURE_LENGTH), signatures.shape)
+
+    def test_identical_windows(self):
+        rng = numpy.random.default_rng(1)
+        token_ids = rng.integers(0, 1000, 100, dtype=numpy.int32)
+        token_ids[60:85] = token_ids[0:25]
+        signatures = minhash.get_window_signatures(token_ids, 10)
+        # The windows starting at tokens 0 and 60 contain the same shingles.
+        self.assertTrue((signatures[0] == signatures[6]).all())
+        self.assertFalse((signatures[0] == signatures[5]).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import bisect
+import numpy
+import numpy.typing
+import queue
+from typing import Any, Callable, Iterator, TYPE_CHECKING, TypeVar
+
+if TYPE_CHECKING:
+    import multiprocessing.pool
+
+
+# Comparing two files takes one byte for every pixel of the matrix, plus the
+# segments that find_duplicates builds out of it. Those take a few hundred
+# bytes for every pixel that's part of a diagonal line, and there are about 1.5
+# such pixels for every pair of matching bigrams (i.e., every place where two
+# consecutive tokens in one file match two consecutive tokens in the other).
+# This is how many bytes we expect per matching bigram, rounded up a bit.
+BYTES_PER_MATCHING_BIGRAM = 600
+# Searching for segments without building the matrix (see
+# find_duplicates.get_sparse_segments) only takes memory for the pixels that
+# are part of diagonal lines, which is about this many bytes per matching
+# bigram, rounded up.
+SPARSE_BYTES_PER_MATCHING_BIGRAM = 250
+
+_Task = TypeVar("_Task")
+_Result = TypeVar("_Result")
+
+
+class MemoryEstimator:
+    """
+    Estimates the peak memory used to compare pairs of files, from the number
+    of tokens in them and how many of their bigrams match, without building
+    the matrix.
+    """
+    def __init__(
+        self,
+        token_ids: numpy.typing.NDArray[numpy.int32],
+        offsets: list[int],
+    ) -> None:
+        """
+        The arguments are the token IDs of all the files and where each file
+        starts, like utils.get_token_ids returns.
+        """
+        self._lengths = numpy.diff(offsets).tolist()
+        # For each file, we keep its distinct bigrams, in sorted order, and how
+        # many times each one appears. Each bigram is stored as one integer.
+        id_count = int(token_ids.max(initial=0)) + 1
+        self._bigrams = []
+        for start, end in zip(offsets, offsets[1:]):
+            ids = token_ids[start:end].astype(numpy.int64)
+            self._bigrams.append(numpy.unique(ids[:-1] * id_count + ids[1:],
+                                              return_counts=True))
+
+    def get_matching_bigrams(self, i: int, j: int) -> int:
+        bigrams_a, counts_a = self._bigrams[i]
+        bigrams_b, counts_b = self._bigrams[j]
+        _, indices_a, indices_b = numpy.intersect1d(
+            bigrams_a, bigrams_b, assume_unique=True, return_indices=True)
+        return int(numpy.dot(counts_a[indices_a].astype(numpy.int64),
+                             counts_b[indices_b]))
+
+    def estimate(self, i: int, j: int) -> int:
+        """
+        We return roughly how many bytes it takes to compare files i and j.
+        """
+        pixel_count = self._lengths[i] * self._lengths[j]
+        return (pixel_count +
+                BYTES_PER_MATCHING_BIGRAM * self.get_matching_bigrams(i, j))
+
+    def estimate_sparse(self, i: int, j: int) -> int:
+        """
+        We return roughly how many bytes it takes to compare files i and j
+        without building the matrix.
+        """
+        return (SPARSE_BYTES_PER_MATCHING_BIGRAM *
+                self.get_matching_bigrams(i, j))
+
+
+def run_within_budget(
+    pool: "multiprocessing.pool.Pool",
+    function: Callable[[_Task], _Result],
+    tasks: list[_Task],
+    estimates: list[int],
+    budget: int,
+    slots: int,
+) -> Iterator[_Result]:
+    """
+    Runs function on each task in the pool, with at most slots tasks running at
+    once, and without letting the sum of the estimates of the running tasks go
+    over the budget. We return the results in the same order as the tasks, as
+    soon as they're ready.
+
+    To pack as much work as possible into the budget, we start the biggest
+    tasks first, and fill in any room left over with smaller ones. A task
+    whose estimate is bigger than the whole budget runs on its own.
+    """
+    finished: queue.Queue[int] = queue.Queue()
+    # The tasks from smallest to biggest, and among tasks of the same size,
+    # from last to first, so that the biggest task that fits in the room left
+    # over is at the last position whose estimate is at most that room.
+    order = sorted(range(len(tasks)), key=lambda k: (estimates[k], -k))
+    sizes = [estimates[k] for k in order]
+    # Position p (counting from 1) holds order[p - 1]. Following closest from p
+    # leads to the nearest position at or before p whose task hasn't started,
+    # or to position 0 if there are none, so each pick takes O(log n).
+    closest = list(range(len(tasks) + 1))
+
+    def find_pending(position: int) -> int:
+        while closest[position] != position:
+            closest[position] = closest[closest[position]]
+            position = closest[position]
+        return position
+
+    pending = len(tasks)
+    running: dict[int, multiprocessing.pool.AsyncResult[Any]] = {}
+    results: dict[int, _Result] = {}
+    used = 0
+    next_result = 0
+    while next_result < len(tasks):
+        while pending and len(running) < slots:
+            position = find_pending(bisect.bisect_right(sizes, budget - used))
+            if position == 0:
+                if running:
+                    break  # Wait for something to finish to make room.
+                position = find_pending(len(tasks))
+            closest[position] = position - 1
+            pending -= 1
+            index = order[position - 1]
+            used += estimates[index]
+
+            def on_finish(_: Any, index: int=index) -> None:
+                finished.put(index)
+            running[index] = pool.apply_async(
+                function, (tasks[index],), callback=on_finish,
+                error_callback=on_finish)
+
+        index = finished.get()
+        used -= estimates[index]
+        results[index] = running.pop(index).get()  # Re-raises any exception
+        while next_result in results:
+            yield results.pop(next_result)
+            next_result += 1
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import multiprocessing.pool
+import numpy
+import threading
+import time
+import unittest
+
+import pair_scheduler
+
+
+class TestMemoryEstimator(unittest.TestCase):
+    def test_matching_bigrams(self):
+        token_ids = numpy.array([0, 1, 2, 0, 1,  0, 1, 0, 1,  2, 2],
+                                dtype=numpy.int32)
+        estimator = pair_scheduler.MemoryEstimator(token_ids, [0, 5, 9, 11])
+        # Both of the first two files have the bigram (0, 1) twice.
+        self.assertEqual(4, estimator.get_matching_bigrams(0, 1))
+        self.assertEqual(4, estimator.get_matching_bigrams(1, 0))
+        # Within the second file, (0, 1) matches itself twice, and so does
+        # (1, 0).
+        self.assertEqual(5, estimator.get_matching_bigrams(1, 1))
+        self.assertEqual(0, estimator.get_matching_bigrams(0, 2))
+        self.assertEqual(
+            20 + 4 * pair_scheduler.BYTES_PER_MATCHING_BIGRAM,
+            estimator.estimate(0, 1))
+        self.assertEqual(
+            4 * pair_scheduler.SPARSE_BYTES_PER_MATCHING_BIGRAM,
+            estimator.estimate_sparse(0, 1))
+
+    def test_empty_files(self):
+        token_ids = numpy.array([3], dtype=numpy.int32)
+        estimator = pair_scheduler.MemoryEstimator(token_ids, [0, 0, 1])
+        self.assertEqual(0, estimator.estimate(0, 1))
+        self.assertEqual(1, estimator.estimate(1, 1))
+
+
+class TestRunWithinBudget(unittest.TestCase):
+    def test_budget(self):
+        estimates = [5, 3, 3, 2, 8, 1, 1]
+        lock = threading.Lock()
+        running = []
+        used = []
+
+        def run(task):
+            with lock:
+                running.append(task)
+                used.append(sorted(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(task)
+            return task * 10
+
+        # Threads share our variables, unlike processes, but have the same
+        # interface.
+        with multiprocessing.pool.ThreadPool(4) as pool:
+            results = list(pair_scheduler.run_within_budget(
+                pool, run, list(range(len(estimates))), estimates, 6, 3))
+        self.assertEqual([0, 10, 20, 30, 40, 50, 60], results)
+        # Task 4 is over budget, so it should have run on its own, and all
+        # the others should have stayed within it, 3 at a time at most.
+        self.assertIn([4], used)
+        for tasks in used:
+            if tasks != [4]:
+                self.assertLessEqual(sum(estimates[k] for k in tasks), 6)
+                self.assertLessEqual(len(tasks), 3)
+        # The biggest task that fits starts first.
+        self.assertEqual([0], used[0])
+
+    def test_order(self):
+        rng = numpy.random.default_rng(1)
+        estimates = [int(e) for e in rng.integers(0, 100, 5000)]
+        started = []
+
+        def run(task):
+            started.append(task)
+            return task
+
+        with multiprocessing.pool.ThreadPool(1) as pool:
+            results = list(pair_scheduler.run_within_budget(
+                pool, run, list(range(len(estimates))), estimates, 90, 1))
+        self.assertEqual(list(range(len(estimates))), results)
+        # With one task at a time, each one starts with the whole budget free,
+        # so the ones that fit go from biggest to smallest, and then the ones
+        # over budget go on their own, also from biggest to smallest. Tasks of
+        # the same size go in order.
+        fits = sorted((k for k, e in enumerate(estimates) if e <= 90),
+                      key=lambda k: -estimates[k])
+        too_big = sorted((k for k, e in enumerate(estimates) if e > 90),
+                         key=lambda k: -estimates[k])
+        self.assertEqual(fits + too_big, started)
+
+    def test_exception(self):
+        def run(task):
+            if task == 1:
+                raise ValueError("oops")
+            return task
+
+        with multiprocessing.pool.ThreadPool(2) as pool:
+            results = pair_scheduler.run_within_budget(
+                pool, run, [0, 1, 2], [1, 1, 1], 10, 2)
+            with self.assertRaises(ValueError):
+                list(results)
+
+
+if __name__ == "__main__":
+    unittest.main()
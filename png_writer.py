@@ -0,0 +1,66 @@
+import numpy
+import numpy.typing
+import struct
+from typing import BinaryIO, Iterable
+import zlib
+
+
+# PNG files are a signature followed by a sequence of chunks. The image data is
+# a single zlib stream, which may be split across any number of IDAT chunks, so
+# we can compress and write out each strip of the image as soon as we get it,
+# without ever holding the whole image in memory. PIL can't do this: it needs
+# the entire image before it starts encoding.
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_COLOR_TYPES = {1: 0, 3: 2}  # Number of channels to PNG color type
+_COMPRESSION_LEVEL = 6  # The same default zlib and PIL use
+
+
+def _write_chunk(f: BinaryIO, chunk_type: bytes, data: bytes) -> None:
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+
+def write(
+    filename: str,
+    width: int,
+    height: int,
+    channels: int,
+    strips: Iterable[numpy.typing.NDArray[numpy.uint8]],
+) -> None:
+    """
+    Saves a width-by-height 8-bit PNG image, built up from horizontal strips.
+    If there is 1 channel, it's a grayscale image and each strip is a 2D array.
+    If there are 3, it's RGB and each strip is a 3D array. The strips must
+    have width columns, and together must have height rows.
+    """
+    if channels not in _COLOR_TYPES:
+        raise ValueError(f"PNGs must have 1 or 3 channels, not {channels}")
+
+    with open(filename, "wb") as f:
+        f.write(_SIGNATURE)
+        _write_chunk(f, b"IHDR", struct.pack(
+            ">IIBBBBB", width, height, 8, _COLOR_TYPES[channels], 0, 0, 0))
+
+        compressor = zlib.compressobj(_COMPRESSION_LEVEL)
+        rows_written = 0
+        for strip in strips:
+            strip_height = strip.shape[0]
+            rows = numpy.asarray(strip, dtype=numpy.uint8).reshape(
+                strip_height, width * channels)
+            # Each row starts with the type of filter applied to it. We don't
+            # use one (type 0): the images are mostly long runs of black, which
+            # compress well already.
+            filtered = numpy.zeros([strip_height, width * channels + 1],
+                                   dtype=numpy.uint8)
+            filtered[:, 1:] = rows
+            data = compressor.compress(filtered.tobytes())
+            if data:
+                _write_chunk(f, b"IDAT", data)
+            rows_written += strip_height
+        if rows_written != height:
+            raise ValueError(f"Expected {height} rows, got {rows_written}")
+
+        _write_chunk(f, b"IDAT", compressor.flush())
+        _write_chunk(f, b"IEND", b"")
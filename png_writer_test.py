@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import numpy
+import os
+import PIL.Image
+import tempfile
+import unittest
+
+import png_writer
+
+
+class TestWrite(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "image.png")
+
+    def assertRoundTrips(self, image):
+        # Split the image into uneven strips, including an empty one.
+        strips = [image[:1], image[1:1], image[1:40], image[40:]]
+        channels = 1 if image.ndim == 2 else 3
+        png_writer.write(self.filename, image.shape[1], image.shape[0],
+                         channels, strips)
+        with PIL.Image.open(self.filename) as actual:
+            self.assertEqual("L" if channels == 1 else "RGB", actual.mode)
+            self.assertTrue((numpy.asarray(actual) == image).all())
+
+    def test_grayscale(self):
+        generator = numpy.random.default_rng(5)
+        self.assertRoundTrips(
+            generator.integers(0, 2, [57, 31], dtype=numpy.uint8) * 255)
+
+    def test_rgb(self):
+        generator = numpy.random.default_rng(6)
+        self.assertRoundTrips(
+            generator.integers(0, 256, [43, 70, 3], dtype=numpy.uint8))
+
+    def test_wrong_height(self):
+        with self.assertRaises(ValueError):
+            png_writer.write(self.filename, 3, 5, 1,
+                             [numpy.zeros([4, 3], dtype=numpy.uint8)])
+
+
+if __name__ == '__main__':
+    unittest.main()
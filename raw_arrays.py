@@ -0,0 +1,97 @@
+import numpy
+import numpy.lib.format
+import numpy.typing
+import struct
+from typing import Any, NamedTuple, Optional
+import zipfile
+
+import session
+import tokenizer
+
+
+# Raw array files are uncompressed .npz files holding the match matrix, the
+# hues and a list of duplicated segments (when the image was colored), and
+# everything about the two files that the GUI needs. Other programs can read
+# them with numpy.load(). Every array inside is stored as an ordinary .npy
+# file, and because the .npz isn't compressed, we can memory-map them directly
+# rather than reading them into memory.
+EXTENSION = ".npz"
+_ZIP_LOCAL_HEADER_SIZE = 30  # Not counting the filename and extra fields
+
+
+class RawArrays(NamedTuple):
+    matrix: numpy.typing.NDArray[numpy.uint8]
+    hues: Optional[numpy.typing.NDArray[numpy.uint8]]
+    # One row per segment, as returned by find_duplicates.segments_to_array
+    segments: Optional[numpy.typing.NDArray[numpy.int64]]
+    data_a: tokenizer.FileInfo
+    data_b: tokenizer.FileInfo
+
+
+def is_raw_arrays(filename: str) -> bool:
+    return filename.lower().endswith(EXTENSION)
+
+
+def save(filename: str, raw_arrays: RawArrays) -> None:
+    # numpy.savez's annotations can't tell arrays apart from its own keyword
+    # arguments, so we can't be more specific here.
+    arrays: dict[str, Any] = {"matrix": raw_arrays.matrix}
+    if raw_arrays.hues is not None:
+        arrays["hues"] = raw_arrays.hues
+    if raw_arrays.segments is not None:
+        arrays["segments"] = raw_arrays.segments
+    for label, data in (("a", raw_arrays.data_a), ("b", raw_arrays.data_b)):
+        arrays.update({f"{label}_{name}": array for name, array
+                       in session.file_info_to_arrays(data).items()})
+        arrays[f"{label}_filename"] = numpy.array(data.filename)
+        arrays[f"{label}_has_lines"] = numpy.array(bool(data.lines))
+    numpy.savez(filename, **arrays)
+
+
+def _load_member(
+    filename: str, f: zipfile.ZipFile, info: zipfile.ZipInfo
+) -> numpy.typing.NDArray:
+    """
+    Returns the array stored in the .npz member described by info, memory-
+    mapped from the file if possible.
+    """
+    with f.open(info) as member:
+        version = numpy.lib.format.read_magic(member)
+        shape, fortran_order, dtype = (
+            numpy.lib.format.read_array_header_1_0(member)
+            if version == (1, 0) else
+            numpy.lib.format.read_array_header_2_0(member))
+        header_size = member.tell()
+    if (info.compress_type != zipfile.ZIP_STORED or dtype.hasobject or
+            len(shape) == 0 or 0 in shape):
+        # We can't memory-map this, but it's probably small anyway.
+        with f.open(info) as member:
+            return numpy.lib.format.read_array(member)
+
+    # The member's data starts after the zip file's local header for it, whose
+    # size we have to read from the header itself.
+    with open(filename, "rb") as raw:
+        raw.seek(info.header_offset)
+        local_header = raw.read(_ZIP_LOCAL_HEADER_SIZE)
+    name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+    offset = (info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_length +
+              extra_length + header_size)
+    return numpy.memmap(filename, dtype=dtype, mode="r", offset=offset,
+                        shape=shape, order="F" if fortran_order else "C")
+
+
+def load(filename: str) -> RawArrays:
+    with zipfile.ZipFile(filename) as f:
+        arrays = {info.filename.removesuffix(".npy"):
+                  _load_member(filename, f, info) for info in f.infolist()}
+
+    def get_file_info(label: str) -> tokenizer.FileInfo:
+        return session.file_info_from_arrays(
+            {name.removeprefix(f"{label}_"): array
+             for name, array in arrays.items()
+             if name.startswith(f"{label}_")},
+            str(arrays[f"{label}_filename"]),
+            bool(arrays[f"{label}_has_lines"]))
+    return RawArrays(arrays["matrix"], arrays.get("hues"),
+                     arrays.get("segments"), get_file_info("a"),
+                     get_file_info("b"))
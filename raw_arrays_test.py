@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import numpy
+import os
+import tempfile
+import unittest
+
+import find_duplicates
+import raw_arrays
+import tokenizer
+import utils
+
+
+class TestRawArrays(unittest.TestCase):
+    def setUp(self):
+        contents = 'if x:\n\tprint(hello(1, 2))\nprint(hello("hi", 2))\n'
+        self.data = tokenizer.get_tokens(contents, "python", "test.py")
+        self.matrix = utils.make_matrix(self.data.tokens, self.data.tokens)
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name,
+                                     f"test{raw_arrays.EXTENSION}")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertFileInfoEqual(self, expected, actual):
+        self.assertTrue((expected.tokens == actual.tokens).all())
+        self.assertEqual(expected.lines, actual.lines)
+        self.assertEqual(expected.boundaries, actual.boundaries)
+        self.assertEqual(expected.filename, actual.filename)
+
+    def test_round_trip(self):
+        hues, segments = find_duplicates.get_hues_and_segments(
+            self.matrix, True)
+        segment_array = find_duplicates.segments_to_array(segments)
+        raw_arrays.save(self.filename, raw_arrays.RawArrays(
+            self.matrix, hues, segment_array, self.data, self.data))
+        loaded = raw_arrays.load(self.filename)
+
+        self.assertTrue((self.matrix == loaded.matrix).all())
+        self.assertTrue((hues == loaded.hues).all())
+        self.assertTrue((segment_array == loaded.segments).all())
+        self.assertFileInfoEqual(self.data, loaded.data_a)
+        self.assertFileInfoEqual(self.data, loaded.data_b)
+        # The big arrays are read straight from the file, not into memory.
+        self.assertIsInstance(loaded.matrix, numpy.memmap)
+        self.assertIsInstance(loaded.hues, numpy.memmap)
+
+    def test_black_and_white(self):
+        raw_arrays.save(self.filename, raw_arrays.RawArrays(
+            self.matrix, None, None, self.data, self.data))
+        loaded = raw_arrays.load(self.filename)
+        self.assertTrue((self.matrix == loaded.matrix).all())
+        self.assertIsNone(loaded.hues)
+        self.assertIsNone(loaded.segments)
+
+    def test_without_lines(self):
+        # Big files don't keep their lines around.
+        data = self.data._replace(lines=[])
+        raw_arrays.save(self.filename, raw_arrays.RawArrays(
+            self.matrix, None, None, data, self.data))
+        loaded = raw_arrays.load(self.filename)
+        self.assertFileInfoEqual(data, loaded.data_a)
+        self.assertFileInfoEqual(self.data, loaded.data_b)
+
+    def test_readable_by_numpy(self):
+        raw_arrays.save(self.filename, raw_arrays.RawArrays(
+            self.matrix, None, None, self.data, self.data))
+        with numpy.load(self.filename) as arrays:
+            self.assertTrue((self.matrix == arrays["matrix"]).all())
+            self.assertEqual("test.py", str(arrays["a_filename"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
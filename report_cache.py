@@ -0,0 +1,115 @@
+import hashlib
+import json
+import numpy
+import sqlite3
+from types import TracebackType
+from typing import Optional, Self
+
+import tokenizer
+
+
+# The duplication found between two files, as a set of (size, top_a, top_b,
+# bottom_a, bottom_b) tuples, with the positions of the first and last tokens
+# of each segment in each file.
+Segments = set[tuple[int, int, int, int, int]]
+
+
+class ReportCache:
+    """
+    Remembers the duplication found between pairs of files from one run of
+    generate_report.py to the next, so that only pairs involving files that
+    have changed need to be compared again. Results are looked up by the
+    contents of the files, so renaming or moving a file doesn't invalidate
+    them.
+
+    The cache is an SQLite database, so we only read the results we need, and
+    only write the ones that are new. When it's closed, we delete the results
+    that weren't used, so that it doesn't keep growing as the code changes.
+    """
+    # Change this whenever a change to find_duplicates or generate_report
+    # could change the results, to stop using the old ones.
+    VERSION = 4
+
+    def __init__(self, filename: str) -> None:
+        self._connection = sqlite3.connect(filename)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pairs "
+            "(key TEXT PRIMARY KEY, segments TEXT)")
+        self._used: set[str] = set()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close(prune=exc_type is None)
+
+    @staticmethod
+    def get_file_hash(data: tokenizer.FileInfo) -> str:
+        """
+        We return a hash of everything about the file that can affect the
+        report: its tokens, and the lines they're on.
+        """
+        hasher = hashlib.sha256()
+        tokens = numpy.asarray(data.tokens, dtype=str)
+        hasher.update(f"{tokens.dtype.str}:{len(tokens)}:".encode())
+        hasher.update(tokens.tobytes())
+        hasher.update(numpy.array(data.boundaries, dtype=numpy.int64).tobytes())
+        return hasher.hexdigest()
+
+    def get_key(
+        self,
+        hash_a: str,
+        hash_b: str,
+        is_single_file: bool,
+        min_segment_size: int,
+        include_big_files: bool,
+        low_memory_pixels: Optional[int]=None,
+    ) -> str:
+        """
+        The low_memory_pixels are given when the pair is searched without
+        building the whole matrix, which can give different results.
+        """
+        return hashlib.sha256(
+            f"{self.VERSION}:{hash_a}:{hash_b}:{is_single_file}:"
+            f"{min_segment_size}:{include_big_files}:{low_memory_pixels}"
+            .encode()).hexdigest()
+
+    def __contains__(self, key: str) -> bool:
+        return self._connection.execute(
+            "SELECT 1 FROM pairs WHERE key = ?", (key,)).fetchone() is not None
+
+    def __getitem__(self, key: str) -> Segments:
+        row = self._connection.execute(
+            "SELECT segments FROM pairs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        self._used.add(key)
+        return {(size, top_a, top_b, bottom_a, bottom_b)
+                for size, top_a, top_b, bottom_a, bottom_b
+                in json.loads(row[0])}
+
+    def __setitem__(self, key: str, segments: Segments) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO pairs VALUES (?, ?)",
+            (key, json.dumps(sorted(segments))))
+        self._used.add(key)
+
+    def close(self, prune: bool=True) -> None:
+        """
+        Saves the new results. If prune is set, we also delete every result
+        that wasn't looked up or saved since the cache was opened.
+        """
+        if prune:
+            self._connection.execute(
+                "CREATE TEMPORARY TABLE used (key TEXT PRIMARY KEY)")
+            self._connection.executemany(
+                "INSERT INTO used VALUES (?)", ((key,) for key in self._used))
+            self._connection.execute(
+                "DELETE FROM pairs WHERE key NOT IN (SELECT key FROM used)")
+        self._connection.commit()
+        self._connection.close()
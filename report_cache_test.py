@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import generate_report
+import report_cache
+import tokenizer
+
+
+class TestReportCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "cache.db")
+        self.data = tokenizer.get_tokens(
+            "if x:\n    print(x)\n", "python", "test.py")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        segments = {(300, 1, 20, 40, 60), (301, 2, 21, 41, 61)}
+        with report_cache.ReportCache(self.filename) as cache:
+            self.assertNotIn("key", cache)
+            cache["key"] = segments
+            cache["empty"] = set()
+        with report_cache.ReportCache(self.filename) as cache:
+            self.assertIn("key", cache)
+            self.assertEqual(segments, cache["key"])
+            self.assertEqual(set(), cache["empty"])
+            with self.assertRaises(KeyError):
+                cache["missing"]
+
+    def test_prune_unused(self):
+        with report_cache.ReportCache(self.filename) as cache:
+            cache["used"] = set()
+            cache["unused"] = set()
+        with report_cache.ReportCache(self.filename) as cache:
+            cache["used"]
+        with report_cache.ReportCache(self.filename) as cache:
+            self.assertIn("used", cache)
+            self.assertNotIn("unused", cache)
+
+    def test_file_hash(self):
+        get_file_hash = report_cache.ReportCache.get_file_hash
+        renamed = self.data._replace(filename="other.py")
+        self.assertEqual(get_file_hash(self.data), get_file_hash(renamed))
+        # Moving code to different lines changes the report, even if the
+        # tokens are the same.
+        moved = tokenizer.get_tokens(
+            "\nif x:\n    print(x)\n", "python", "test.py")
+        self.assertNotEqual(get_file_hash(self.data), get_file_hash(moved))
+        changed = tokenizer.get_tokens(
+            "if x:\n    print(y)\n", "python", "test.py")
+        self.assertNotEqual(get_file_hash(self.data), get_file_hash(changed))
+
+
+class TestCachedReport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "cache.db")
+        self.data = [tokenizer.get_file_tokens(filename) for filename in
+                     ("examples/gpsnmea.go", "examples/gpsrtk.go")]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_report(self, data):
+        with (unittest.mock.patch.object(
+                  generate_report, "_find_large_segments",
+                  wraps=generate_report._find_large_segments) as compare,
+              report_cache.ReportCache(self.filename) as cache):
+            lines = list(generate_report.compare_all_files(
+                data, 100, cache=cache))
+        return lines, compare.call_count
+
+    def test_reuses_results(self):
+        expected = list(generate_report.compare_all_files(self.data, 100))
+        lines, call_count = self.run_report(self.data)
+        self.assertEqual(expected, lines)
+        self.assertEqual(3, call_count)
+
+        lines, call_count = self.run_report(self.data)
+        self.assertEqual(expected, lines)
+        self.assertEqual(0, call_count)
+
+    def test_changed_file(self):
+        self.run_report(self.data)
+        changed = tokenizer.get_tokens("package main\n", "go", "new.go")
+        data = [changed, self.data[1]]
+        lines, call_count = self.run_report(data)
+        self.assertEqual(
+            list(generate_report.compare_all_files(data, 100)), lines)
+        # Only the pairs involving the changed file are compared again.
+        self.assertEqual(2, call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+import abc
+import json
+import sys
+import urllib.parse
+from types import TracebackType
+from typing import Any, Iterator, NamedTuple, Optional, Self, TextIO
+
+import report_cache
+import tokenizer
+
+
+class PairResult(NamedTuple):
+    data_a: tokenizer.FileInfo
+    data_b: tokenizer.FileInfo
+    segments: report_cache.Segments
+    # How long it took to compare the two files, or None if they weren't
+    # compared on their own (e.g., the results came from the cache).
+    seconds: Optional[float]
+
+
+def get_line_segments(
+    result: PairResult,
+) -> set[tuple[int, int, int, int, int]]:
+    """
+    We return the segments in the result as tuples of (size, start_line_a,
+    end_line_a, start_line_b, end_line_b). Different segments can end up on
+    the same lines, in which case we only return them once.
+    """
+    boundaries_a = result.data_a.boundaries
+    boundaries_b = result.data_b.boundaries
+    return {(size,
+             boundaries_a[top_a][0][0], boundaries_a[bottom_a][1][0],
+             boundaries_b[top_b][0][0], boundaries_b[bottom_b][1][0])
+            for size, top_a, top_b, bottom_a, bottom_b
+            in result.segments}
+
+
+def format_text(result: PairResult) -> Iterator[str]:
+    """
+    We return the lines of the human-readable report about the pair of files.
+    """
+    filename_a = result.data_a.filename
+    filename_b = result.data_b.filename
+    if not result.segments:
+        return  # No major duplication!
+    # Otherwise...
+    yield f"Found duplicated code between {filename_a} and {filename_b}:"
+
+    def sorting_key(
+        data: tuple[int, int, int, int, int]
+    ) -> tuple[int, int, int]:
+        # Sort by the starting line in file A, then starting line in file B,
+        # then by length (largest to smallest).
+        return (data[1], data[3], -data[0])
+    sorted_large_segments = sorted(get_line_segments(result), key=sorting_key)
+    for size, start_a, end_a, start_b, end_b in sorted_large_segments:
+        yield (f"    {size} tokens on lines "
+               f"{start_a}-{end_a} and lines {start_b}-{end_b}")
+
+
+def _describe_tokens(
+    data: tokenizer.FileInfo, top: int, bottom: int
+) -> dict[str, Any]:
+    """
+    We return the positions of the tokens from top to bottom (inclusive) in
+    the file. Like everywhere else, lines count from 1 and columns from 0, and
+    the ends are the first token and column after the range.
+    """
+    (start_line, start_column), _ = data.boundaries[top]
+    _, (end_line, end_column) = data.boundaries[bottom]
+    return {"start_token": int(top), "end_token": int(bottom) + 1,
+            "start_line": start_line, "start_column": start_column,
+            "end_line": end_line, "end_column": end_column}
+
+
+def _sorted_segments(
+    result: PairResult,
+) -> list[tuple[int, int, int, int, int]]:
+    # Sort by the starting token in file A, then starting token in file B,
+    # then by size (largest to smallest), like the text report.
+    return sorted(result.segments,
+                  key=lambda segment: (segment[1], segment[2], -segment[0]))
+
+
+class ReportWriter(abc.ABC):
+    """
+    Writes the results of comparing pairs of files to a stream, one pair at a
+    time as they come in, so that whoever is reading the report can start on
+    it before it's finished. The stream is flushed after each pair rather than
+    after each line. Subclasses choose the format.
+    """
+    def __init__(self, stream: TextIO) -> None:
+        self._stream = stream
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close(exc_type is None)
+
+    @abc.abstractmethod
+    def _format_result(self, result: PairResult) -> str:
+        """
+        We return the text to write about the pair of files, which is empty
+        if there's nothing to say about them.
+        """
+
+    def write_result(self, result: PairResult) -> None:
+        text = self._format_result(result)
+        if text:
+            self._stream.write(text)
+            self._stream.flush()
+
+    def write_message(self, message: str) -> None:
+        """
+        Reports a problem that isn't about any pair of files, such as a file
+        that couldn't be parsed. Machine-readable formats write these to
+        stderr by default, so they don't get in the way.
+        """
+        print(message, file=sys.stderr)
+
+    def close(self, is_successful: bool=True) -> None:
+        """
+        Finishes the report. is_successful is false if we're stopping because
+        something went wrong, so the report might be incomplete. The stream
+        itself is left open.
+        """
+        self._stream.flush()
+
+
+class TextWriter(ReportWriter):
+    def _format_result(self, result: PairResult) -> str:
+        return "".join(f"{line}\n" for line in format_text(result))
+
+    def write_message(self, message: str) -> None:
+        self._stream.write(f"{message}\n")
+        self._stream.flush()
+
+
+class JsonLinesWriter(ReportWriter):
+    """
+    Writes one JSON object per line for every pair of files compared, even
+    ones with nothing in common.
+    """
+    def _format_result(self, result: PairResult) -> str:
+        segments = [
+            {"size": int(size),
+             "a": _describe_tokens(result.data_a, top_a, bottom_a),
+             "b": _describe_tokens(result.data_b, top_b, bottom_b)}
+            for size, top_a, top_b, bottom_a, bottom_b
+            in _sorted_segments(result)]
+        record = {"file_a": result.data_a.filename,
+                  "file_b": result.data_b.filename,
+                  "seconds": result.seconds,
+                  "segments": segments}
+        return json.dumps(record) + "\n"
+
+
+class SarifWriter(ReportWriter):
+    """
+    Writes a SARIF 2.1.0 log with one result for every duplicated segment,
+    which code scanning tools can show next to the code. The results are
+    written as they come in, and the rest of the log when it's closed. Other
+    messages, such as files that couldn't be parsed, are included as
+    notifications.
+    """
+    RULE_ID = "duplicated-code"
+
+    def __init__(self, stream: TextIO) -> None:
+        super().__init__(stream)
+        self._result_count = 0
+        self._notifications: list[dict[str, Any]] = []
+        driver = {"name": "visual_diff",
+                  "rules": [{"id": self.RULE_ID,
+                             "shortDescription": {"text": "Duplicated code"}}]}
+        self._stream.write(
+            '{"version": "2.1.0", '
+            '"$schema": "https://json.schemastore.org/sarif-2.1.0.json", '
+            f'"runs": [{{"tool": {{"driver": {json.dumps(driver)}}}, '
+            '"results": [\n')
+
+    @staticmethod
+    def _get_location(
+        filename: str, tokens: dict[str, Any]
+    ) -> dict[str, Any]:
+        # SARIF counts columns from 1.
+        return {"physicalLocation": {
+            "artifactLocation": {
+                "uri": urllib.parse.quote(filename.replace("\\", "/"))},
+            "region": {"startLine": tokens["start_line"],
+                       "startColumn": tokens["start_column"] + 1,
+                       "endLine": tokens["end_line"],
+                       "endColumn": tokens["end_column"] + 1}}}
+
+    def _format_result(self, result: PairResult) -> str:
+        filename_a = result.data_a.filename
+        filename_b = result.data_b.filename
+        lines = []
+        for size, top_a, top_b, bottom_a, bottom_b in _sorted_segments(result):
+            tokens_a = _describe_tokens(result.data_a, top_a, bottom_a)
+            tokens_b = _describe_tokens(result.data_b, top_b, bottom_b)
+            location_b = self._get_location(filename_b, tokens_b)
+            location_b["id"] = 1
+            sarif_result = {
+                "ruleId": self.RULE_ID,
+                "level": "warning",
+                "message": {"text": f"{size} tokens are duplicated in "
+                                    f"[{filename_b}](1)"},
+                "locations": [self._get_location(filename_a, tokens_a)],
+                "relatedLocations": [location_b],
+                "properties": {"size": int(size),
+                               "tokens": [tokens_a, tokens_b],
+                               "seconds": result.seconds}}
+            separator = ",\n" if self._result_count > 0 else ""
+            lines.append(separator + json.dumps(sarif_result))
+            self._result_count += 1
+        return "".join(lines)
+
+    def write_message(self, message: str) -> None:
+        self._notifications.append(
+            {"level": "note", "message": {"text": message}})
+
+    def close(self, is_successful: bool=True) -> None:
+        invocation = {"executionSuccessful": is_successful,
+                      "toolExecutionNotifications": self._notifications}
+        self._stream.write(
+            f'\n], "invocations": [{json.dumps(invocation)}]}}]}}\n')
+        super().close(is_successful)
+
+
+FORMATS: dict[str, type[ReportWriter]] = {
+    "text": TextWriter,
+    "jsonl": JsonLinesWriter,
+    "sarif": SarifWriter,
+}
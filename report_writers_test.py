@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import io
+import json
+import unittest
+
+import report_writers
+import tokenizer
+
+
+class TestReportWriters(unittest.TestCase):
+    def setUp(self):
+        self.data = tokenizer.get_tokens(
+            "x = 1\nif x:\n    x = 1\n", "python", "test.py")
+        # The tokens are x = 1 if x : x = 1, and the two assignments are
+        # duplicated.
+        self.result = report_writers.PairResult(
+            self.data, self.data, {(3, 0, 6, 2, 8)}, 0.5)
+        self.empty = report_writers.PairResult(
+            self.data, self.data, set(), None)
+
+    def test_text(self):
+        stream = io.StringIO()
+        with report_writers.TextWriter(stream) as writer:
+            writer.write_result(self.result)
+            writer.write_result(self.empty)
+            writer.write_message("Cannot parse other.py")
+        expected = [
+            "Found duplicated code between test.py and test.py:",
+            "    3 tokens on lines 1-1 and lines 3-3",
+            "Cannot parse other.py",
+            ]
+        self.assertEqual(expected, stream.getvalue().splitlines())
+
+    def test_json_lines(self):
+        stream = io.StringIO()
+        with report_writers.JsonLinesWriter(stream) as writer:
+            writer.write_result(self.result)
+            # Each pair is written as soon as it's ready.
+            self.assertEqual(1, len(stream.getvalue().splitlines()))
+            writer.write_result(self.empty)
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        expected = [
+            {"file_a": "test.py", "file_b": "test.py", "seconds": 0.5,
+             "segments": [{
+                 "size": 3,
+                 "a": {"start_token": 0, "end_token": 3, "start_line": 1,
+                       "start_column": 0, "end_line": 1, "end_column": 5},
+                 "b": {"start_token": 6, "end_token": 9, "start_line": 3,
+                       "start_column": 4, "end_line": 3, "end_column": 9},
+                 }]},
+            {"file_a": "test.py", "file_b": "test.py", "seconds": None,
+             "segments": []},
+            ]
+        self.assertEqual(expected, records)
+
+    def test_sarif(self):
+        stream = io.StringIO()
+        with report_writers.SarifWriter(stream) as writer:
+            writer.write_result(self.result)
+            writer.write_result(self.empty)
+            writer.write_message("Cannot parse other.py")
+            writer.write_result(self.result)
+        log = json.loads(stream.getvalue())
+        self.assertEqual("2.1.0", log["version"])
+        [run] = log["runs"]
+        self.assertEqual(2, len(run["results"]))
+        result = run["results"][0]
+        self.assertEqual("duplicated-code", result["ruleId"])
+        [location] = result["locations"]
+        self.assertEqual(
+            {"artifactLocation": {"uri": "test.py"},
+             "region": {"startLine": 1, "startColumn": 1,
+                        "endLine": 1, "endColumn": 6}},
+            location["physicalLocation"])
+        [related] = result["relatedLocations"]
+        self.assertEqual(
+            {"startLine": 3, "startColumn": 5, "endLine": 3, "endColumn": 10},
+            related["physicalLocation"]["region"])
+        [invocation] = run["invocations"]
+        self.assertEqual(
+            ["Cannot parse other.py"],
+            [notification["message"]["text"] for notification
+             in invocation["toolExecutionNotifications"]])
+
+    def test_empty_sarif(self):
+        stream = io.StringIO()
+        report_writers.SarifWriter(stream).close()
+        log = json.loads(stream.getvalue())
+        self.assertEqual([], log["runs"][0]["results"])
+        self.assertTrue(
+            log["runs"][0]["invocations"][0]["executionSuccessful"])
+
+    def test_failed_sarif(self):
+        stream = io.StringIO()
+        with (self.assertRaises(KeyboardInterrupt),
+              report_writers.SarifWriter(stream) as writer):
+            writer.write_result(self.result)
+            raise KeyboardInterrupt
+        log = json.loads(stream.getvalue())
+        self.assertEqual(1, len(log["runs"][0]["results"]))
+        self.assertFalse(
+            log["runs"][0]["invocations"][0]["executionSuccessful"])
+
+
+if __name__ == "__main__":
+    unittest.main()
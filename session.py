@@ -0,0 +1,150 @@
+import json
+import numpy
+import numpy.typing
+import os
+import tempfile
+from typing import Any
+
+from image_pyramid import ImagePyramid, SparseImagePyramid
+import tokenizer
+
+
+# Sessions hold everything the GUI needs to display a comparison, so that
+# reopening it doesn't require re-tokenizing the files or rebuilding the
+# pyramid. The file format is:
+#   - The magic string below
+#   - The length of the header, as an 8-byte little-endian integer
+#   - The header, which is JSON describing the name, dtype, shape, and location
+#     of every array, plus any other metadata
+#   - The arrays themselves, uncompressed and aligned so they can be
+#     memory-mapped. Only the parts of them that actually get displayed are
+#     read from disk.
+EXTENSION = ".vdsession"
+_MAGIC = b"visual_diff session v1\n"
+_ALIGNMENT = 64  # Byte alignment of the start of each array
+
+_PYRAMID_TYPES: dict[str, type[ImagePyramid]] = {
+    cls.__name__: cls for cls in (ImagePyramid, SparseImagePyramid)}
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def file_info_to_arrays(
+    data: tokenizer.FileInfo
+) -> dict[str, numpy.typing.NDArray]:
+    """
+    Returns the tokens, boundaries, and lines of the file as arrays, in a form
+    file_info_from_arrays can read.
+    """
+    return {"tokens": data.tokens,
+            "boundaries": numpy.array(
+                data.boundaries, dtype=numpy.int64).reshape(-1, 2, 2),
+            "lines": numpy.frombuffer(
+                "\n".join(data.lines).encode(), dtype=numpy.uint8)}
+
+
+def file_info_from_arrays(
+    arrays: dict[str, numpy.typing.NDArray], filename: str, has_lines: bool
+) -> tokenizer.FileInfo:
+    """
+    The inverse of file_info_to_arrays. An empty file has no lines, which we
+    can't distinguish from a file with one empty line once they've been joined
+    together, so has_lines says which it is.
+    """
+    lines = []
+    if has_lines:
+        lines = bytes(arrays["lines"]).decode().split("\n")
+    boundaries = [((a, b), (c, d)) for (a, b), (c, d)
+                  in arrays["boundaries"].tolist()]
+    return tokenizer.FileInfo(arrays["tokens"], lines, boundaries, filename)
+
+
+def save(
+    filename: str,
+    pyramid: ImagePyramid,
+    data_a: tokenizer.FileInfo,
+    data_b: tokenizer.FileInfo,
+) -> None:
+    arrays = {f"pyramid/{name}": array
+              for name, array in pyramid.to_arrays().items()}
+    metadata: dict[str, Any] = {"pyramid_type": type(pyramid).__name__}
+    for label, data in (("a", data_a), ("b", data_b)):
+        arrays.update({f"{label}/{name}": array for name, array
+                       in file_info_to_arrays(data).items()})
+        metadata[f"{label}/filename"] = data.filename
+        metadata[f"{label}/has_lines"] = bool(data.lines)
+
+    # Lay out the arrays one after another, each starting on an aligned
+    # boundary. Offsets are relative to the end of the header.
+    array_info: dict[str, dict[str, Any]] = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        array_info[name] = {"dtype": array.dtype.str,
+                            "shape": list(array.shape),
+                            "offset": offset}
+        offset += array.nbytes
+    header = json.dumps({"metadata": metadata, "arrays": array_info}).encode()
+
+    # The arrays might be memory-mapped from the file we're about to replace
+    # (if the session was loaded from it), so rather than truncating it out
+    # from under them, write to a new file and then move it into place.
+    descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(filename) or ".", suffix=EXTENSION)
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(_MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            data_start = _align(f.tell())
+            for name, array in arrays.items():
+                f.seek(data_start + array_info[name]["offset"])
+                f.write(numpy.ascontiguousarray(array).tobytes())
+        os.replace(temporary, filename)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def load(
+    filename: str, sidelength: int
+) -> tuple[ImagePyramid, tokenizer.FileInfo, tokenizer.FileInfo]:
+    """
+    Reopens a session written by save(). The pyramid's sidelength does not need
+    to match the one used when the session was saved.
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"'{filename}' is not a visual_diff session")
+        header_length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_length))
+        data_start = _align(f.tell())
+
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype = numpy.dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        if dtype.itemsize * numpy.prod(shape, dtype=numpy.int64) == 0:
+            # You can't memory-map an empty region of a file.
+            arrays[name] = numpy.zeros(shape, dtype=dtype)
+            continue
+        arrays[name] = numpy.memmap(filename, dtype=dtype, mode="r",
+                                    offset=data_start + info["offset"],
+                                    shape=shape)
+
+    metadata = header["metadata"]
+    pyramid_type = _PYRAMID_TYPES[metadata["pyramid_type"]]
+    pyramid = pyramid_type.from_arrays(
+        {name.removeprefix("pyramid/"): array
+         for name, array in arrays.items() if name.startswith("pyramid/")},
+        sidelength)
+
+    def get_file_info(label: str) -> tokenizer.FileInfo:
+        return file_info_from_arrays(
+            {name.removeprefix(f"{label}/"): array
+             for name, array in arrays.items()
+             if name.startswith(f"{label}/")},
+            metadata[f"{label}/filename"], metadata[f"{label}/has_lines"])
+    return pyramid, get_file_info("a"), get_file_info("b")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import numpy
+import os
+import tempfile
+import unittest
+
+from image_pyramid import ImagePyramid, SparseImagePyramid
+import session
+import tokenizer
+import utils
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        contents = 'if x:\n\tprint(hello(1, 2))\nprint(hello("hi", 2))\n'
+        self.data = tokenizer.get_tokens(contents, "python", "test.py")
+        self.matrix = utils.make_matrix(self.data.tokens, self.data.tokens)
+        self.hues = numpy.arange(self.matrix.size, dtype=numpy.uint8).reshape(
+            self.matrix.shape)
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name,
+                                     f"test{session.EXTENSION}")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertRoundTrips(self, pyramid, sidelength):
+        session.save(self.filename, pyramid, self.data, self.data)
+        loaded, data_a, data_b = session.load(self.filename, sidelength)
+
+        self.assertIs(type(pyramid), type(loaded))
+        self.assertEqual(pyramid._max_zoom_level, loaded._max_zoom_level)
+        for zoom_level in range(-3, pyramid._max_zoom_level + 1):
+            pyramid.zoom(zoom_level - pyramid.get_zoom_level())
+            loaded.zoom(zoom_level - loaded.get_zoom_level())
+            expected, expected_x, expected_y = pyramid.get_submatrix(3, 5)
+            actual, actual_x, actual_y = loaded.get_submatrix(3, 5)
+            self.assertEqual((expected_x, expected_y), (actual_x, actual_y))
+            self.assertTrue((expected == actual).all())
+
+        for data in (data_a, data_b):
+            self.assertTrue((self.data.tokens == data.tokens).all())
+            self.assertEqual(self.data.lines, data.lines)
+            self.assertEqual(self.data.boundaries, data.boundaries)
+            self.assertEqual(self.data.filename, data.filename)
+
+    def test_dense(self):
+        self.assertRoundTrips(ImagePyramid(self.matrix, self.hues, 4), 4)
+
+    def test_dense_black_and_white(self):
+        self.assertRoundTrips(ImagePyramid(self.matrix, None, 4), 4)
+
+    def test_sparse(self):
+        rows, cols = numpy.nonzero(self.matrix)
+        self.assertRoundTrips(SparseImagePyramid(
+            rows, cols, self.hues[rows, cols], self.matrix.shape, 4), 4)
+
+    def test_different_sidelength(self):
+        # Reopening with a smaller map needs more levels than were saved.
+        session.save(self.filename, ImagePyramid(self.matrix, None, 16),
+                     self.data, self.data)
+        loaded, _, _ = session.load(self.filename, 4)
+        self.assertEqual(ImagePyramid(self.matrix, None, 4)._max_zoom_level,
+                         loaded._max_zoom_level)
+
+    def test_save_over_itself(self):
+        pyramid = ImagePyramid(self.matrix, self.hues, 4)
+        session.save(self.filename, pyramid, self.data, self.data)
+        loaded, data_a, data_b = session.load(self.filename, 4)
+        # The loaded arrays are read from the file as they're needed, so they
+        # need to keep working while it's replaced.
+        session.save(self.filename, loaded, data_a, data_b)
+        reloaded, _, _ = session.load(self.filename, 4)
+        expected, _, _ = pyramid.get_submatrix(3, 5)
+        for actual_pyramid in (loaded, reloaded):
+            actual, _, _ = actual_pyramid.get_submatrix(3, 5)
+            self.assertTrue((expected == actual).all())
+        self.assertEqual([os.path.basename(self.filename)],
+                         os.listdir(self.directory.name))
+
+    def test_not_a_session(self):
+        with open(self.filename, "w") as f:
+            f.write("print('hello')\n")
+        with self.assertRaises(ValueError):
+            session.load(self.filename, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+from parameterized import parameterized
+import subprocess
+import sys
+import unittest
+
+
+class TestLazyImports(unittest.TestCase):
+    # Modules that are slow to import, and that headless use shouldn't need
+    # until it actually uses them.
+    HEAVY_MODULES = ("code_tokenize", "darkdetect", "gui", "PIL.Image",
+                     "PIL.ImageTk", "tkinter", "multiprocessing")
+
+    @parameterized.expand((("visual_diff",), ("generate_report",)))
+    def test_heavy_modules_not_imported(self, module):
+        # Use a fresh interpreter, since this one has imported everything.
+        result = subprocess.run(
+            [sys.executable, "-c",
+             f"import sys, {module}\n"
+             f"print(' '.join(name for name in {self.HEAVY_MODULES!r} "
+             f"if name in sys.modules))"],
+            check=True, capture_output=True, text=True)
+        self.assertEqual("", result.stdout.strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import numpy
+import numpy.typing
+from typing import Container, Optional
+
+import utils
+import winnowing
+
+
+# Another way to search a whole corpus at once is to put every file of a
+# language into one long stream of token IDs, with a separator after each file
+# that matches nothing else, and sort all the suffixes of the stream. Every
+# place where a run of tokens is repeated, whether in the same file or a
+# different one, ends up next to the other places with the same run, and the
+# longest common prefix (LCP) of neighboring suffixes tells us how long the run
+# is. Each group of neighbors sharing at least MIN_PIECE_LENGTH tokens gives
+# us identical pieces, and from there we search around them exactly like
+# winnowing does. Unlike fingerprints, this finds every pair of identical runs
+# of MIN_PIECE_LENGTH tokens, and needs no hashing.
+MIN_PIECE_LENGTH = winnowing.MIN_PIECE_LENGTH
+# A group of suffixes bigger than this is boilerplate, and pairing up all of
+# them would take quadratic time. Rather than ignoring it, we only pair each
+# suffix with its neighbors in sorted order, which share the most with it.
+MAX_OCCURRENCES = winnowing.MAX_OCCURRENCES
+
+
+def get_suffix_array(
+    token_ids: numpy.typing.NDArray[numpy.int64],
+) -> numpy.typing.NDArray[numpy.int64]:
+    """
+    We return the start positions of all the suffixes of the token IDs, in
+    sorted order. We use prefix doubling: once the suffixes are ranked by
+    their first length tokens, ranking them by pairs of ranks length apart
+    sorts them by their first 2 * length tokens. We stop when every rank is
+    different, which takes about log2 of the longest repeated run rounds.
+    """
+    count = len(token_ids)
+    _, ranks = numpy.unique(token_ids, return_inverse=True)
+    ranks = ranks.reshape(-1).astype(numpy.int64)
+    order = numpy.argsort(ranks, kind="stable")
+    length = 1
+    while count > 0 and ranks[order[-1]] < count - 1:
+        # Suffixes too short to have a second half sort before all others.
+        second = numpy.zeros(count, dtype=numpy.int64)
+        second[:count - length] = ranks[length:] + 1
+        keys = ranks * (count + 1) + second
+        order = numpy.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        ranks = numpy.empty(count, dtype=numpy.int64)
+        ranks[order] = numpy.concatenate(
+            [[0], numpy.cumsum(numpy.diff(sorted_keys) != 0)])
+        length *= 2
+    return order
+
+
+def get_lcp(
+    token_ids: numpy.typing.NDArray[numpy.int64],
+    suffix_array: numpy.typing.NDArray[numpy.int64],
+    limit: int,
+) -> numpy.typing.NDArray[numpy.int64]:
+    """
+    We return the length of the longest common prefix of each suffix in the
+    suffix array and the one after it, up to a maximum of limit. The last
+    token must be different from all the others, so that no common prefix
+    runs off the end.
+    """
+    first, second = suffix_array[:-1], suffix_array[1:]
+    lcp = numpy.zeros(len(first), dtype=numpy.int64)
+    matching = numpy.arange(len(first))
+    # We only need to know about short prefixes, so rather than Kasai's
+    # algorithm, we compare all the neighbors one token at a time.
+    for length in range(limit):
+        matching = matching[token_ids[first[matching] + length] ==
+                            token_ids[second[matching] + length]]
+        if len(matching) == 0:
+            break
+        lcp[matching] += 1
+    return lcp
+
+
+def _find_pairs(
+    token_ids: numpy.typing.NDArray[numpy.int32],
+    offsets: list[int],
+    piece_length: int,
+) -> list[tuple[int, int]]:
+    """
+    We return pairs of positions (a, b), with a < b, where runs of at least
+    piece_length identical tokens start, including at least one in every pair
+    of such runs. Positions are in the concatenation of all the files. We only
+    return pairs whose runs can't be grown to the left, so a long run gives us
+    one pair per pair of copies rather than one per token.
+    """
+    file_count = len(offsets) - 1
+    # Separator i goes after file i and has ID i. Real tokens' IDs come after
+    # all of theirs.
+    separators = numpy.array(offsets[1:], dtype=numpy.int64) + numpy.arange(
+        file_count)
+    stream = numpy.empty(len(token_ids) + file_count, dtype=numpy.int64)
+    is_token = numpy.ones(len(stream), dtype=bool)
+    is_token[separators] = False
+    stream[is_token] = token_ids.astype(numpy.int64) + file_count
+    stream[separators] = numpy.arange(file_count)
+
+    suffix_array = get_suffix_array(stream)
+    shared = get_lcp(stream, suffix_array, piece_length) >= piece_length
+    # Go back to positions without the separators. Suffixes that share any
+    # tokens always start with a real one.
+    starts = suffix_array - numpy.searchsorted(separators, suffix_array)
+    # The token before each suffix. Separators are different from everything
+    # else, so suffixes at the start of a file never have the same one as
+    # anything, and neither does the very first one.
+    lefts = numpy.where(suffix_array > 0, stream[suffix_array - 1], -1)
+
+    # Runs of neighbors that share a piece are groups of suffixes that all
+    # share it. We pair up everything in small groups, and only neighbors in
+    # big ones. Either way, two suffixes with the same token before them are
+    # part of a longer pair of runs starting one token earlier, which is
+    # paired up instead (it's in another group, and if they're neighbors, so
+    # are the longer ones).
+    edges = numpy.diff(numpy.concatenate([[0], shared, [0]]).astype(int))
+    group_starts = numpy.flatnonzero(edges == 1)
+    group_ends = numpy.flatnonzero(edges == -1) + 1
+    pairs: list[tuple[int, int]] = []
+    for start, end in zip(group_starts, group_ends):
+        group, group_lefts = starts[start:end], lefts[start:end]
+        if (group_lefts == group_lefts[0]).all():
+            continue
+        if len(group) <= MAX_OCCURRENCES:
+            order = numpy.argsort(group)
+            group, group_lefts = group[order], group_lefts[order]
+            for k in range(len(group) - 1):
+                others = group[k + 1:][group_lefts[k + 1:] != group_lefts[k]]
+                pairs.extend((int(group[k]), b) for b in others.tolist())
+        else:
+            different = group_lefts[:-1] != group_lefts[1:]
+            firsts, seconds = group[:-1][different], group[1:][different]
+            pairs.extend(zip(numpy.minimum(firsts, seconds).tolist(),
+                             numpy.maximum(firsts, seconds).tolist()))
+    return pairs
+
+
+def get_segments(
+    token_arrays: list[numpy.typing.NDArray[numpy.str_]],
+    min_length: int,
+    max_pixels: Optional[int]=None,
+    pairs: Optional[Container[tuple[int, int]]]=None,
+) -> dict[tuple[int, int], set[tuple[int, int, int, int, int]]]:
+    """
+    We return the same results as winnowing.get_segments, but find the
+    identical runs of tokens to search around with a suffix array of all the
+    token arrays.
+    """
+    token_ids, offsets = utils.get_token_ids(token_arrays)
+    piece_length = min(MIN_PIECE_LENGTH, min_length)
+    pieces = winnowing.grow_pieces(
+        token_ids, offsets, _find_pairs(token_ids, offsets, piece_length),
+        piece_length)
+    return winnowing.search_pieces(token_arrays, offsets, pieces, min_length,
+                                   max_pixels, pairs)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import numpy
+import unittest
+
+import suffix_array
+
+
+class TestSuffixArray(unittest.TestCase):
+    def setUp(self):
+        self.rng = numpy.random.default_rng(1)
+
+    def test_sorted_suffixes(self):
+        for length in (0, 1, 2, 10, 100):
+            token_ids = self.rng.integers(0, 3, length, dtype=numpy.int64)
+            expected = sorted(range(length),
+                              key=lambda i: token_ids[i:].tolist())
+            self.assertEqual(
+                expected, suffix_array.get_suffix_array(token_ids).tolist())
+
+    def test_lcp(self):
+        token_ids = numpy.array([1, 2, 1, 2, 1, 0], dtype=numpy.int64)
+        array = suffix_array.get_suffix_array(token_ids)
+        # The suffixes in order are 0, 1 0, 1 2 1 0, 1 2 1 2 1 0, 2 1 0, and
+        # 2 1 2 1 0.
+        self.assertEqual([5, 4, 2, 0, 3, 1], array.tolist())
+        self.assertEqual([0, 1, 3, 0, 2],
+                         suffix_array.get_lcp(token_ids, array, 10).tolist())
+        self.assertEqual([0, 1, 2, 0, 2],
+                         suffix_array.get_lcp(token_ids, array, 2).tolist())
+
+    def test_boilerplate(self):
+        # A run of 12 tokens, each copy followed by something different
+        run = numpy.arange(12, dtype=numpy.int32)
+        copies = [numpy.append(run, 100 + k) for k in range(200)]
+        token_ids = numpy.concatenate(copies)
+        pairs = suffix_array._find_pairs(token_ids, [0, len(token_ids)], 12)
+        # There are too many copies to pair them all up, so each one is only
+        # paired with the ones next to it in the suffix array.
+        self.assertEqual(199, len(pairs))
+        self.assertEqual(set(range(0, len(token_ids), 13)),
+                         {a for a, _ in pairs} | {b for _, b in pairs})
+
+        copies = copies[:suffix_array.MAX_OCCURRENCES]
+        token_ids = numpy.concatenate(copies)
+        pairs = suffix_array._find_pairs(token_ids, [0, len(token_ids)], 12)
+        self.assertEqual(len(copies) * (len(copies) - 1) // 2, len(pairs))
+
+    def test_long_run(self):
+        # Each file has something different, then a long run shared by all of
+        # them, then something different again.
+        run = numpy.arange(500, dtype=numpy.int32)
+        files = [numpy.concatenate([[1000 + k], run, [2000 + k]])
+                 for k in range(50)]
+        token_ids = numpy.concatenate(files)
+        offsets = [0, *numpy.cumsum([len(f) for f in files]).tolist()]
+        pairs = suffix_array._find_pairs(token_ids, offsets, 12)
+        # Each pair of copies of the run is only paired up once, where it
+        # starts, rather than once for every token in it.
+        self.assertEqual(len(files) * (len(files) - 1) // 2, len(pairs))
+        self.assertEqual({offset + 1 for offset in offsets[:-1]},
+                         {a for a, _ in pairs} | {b for _, b in pairs})
+
+
+class TestSegments(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(1)
+        vocabulary = numpy.array([f"token{i}" for i in range(50)])
+        self.files = [vocabulary[rng.integers(0, len(vocabulary), 2000)]
+                      for _ in range(3)]
+
+    def test_unrelated_files(self):
+        self.assertEqual({}, suffix_array.get_segments(self.files, 300))
+
+    def test_duplicates(self):
+        self.files[2][700:1000] = self.files[0][100:400]
+        self.files[2][800] = "changed"
+        self.files[1][100:400] = self.files[1][1200:1500]
+        expected = {(0, 2): {(299, 100, 700, 399, 999)},
+                    (1, 1): {(300, 100, 1200, 399, 1499)}}
+        self.assertEqual(expected, suffix_array.get_segments(self.files, 200))
+
+    def test_across_file_boundaries(self):
+        # The end of one file followed by the start of the next isn't
+        # duplicated code, even if it's identical to something else.
+        self.files[2][:300] = numpy.concatenate(
+            [self.files[0][-150:], self.files[1][:150]])
+        self.assertEqual({}, suffix_array.get_segments(self.files, 200))
+
+
+if __name__ == "__main__":
+    unittest.main()
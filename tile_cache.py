@@ -0,0 +1,163 @@
+import collections
+import concurrent.futures
+import PIL.Image
+from typing import Optional
+
+from image_pyramid import ImagePyramid
+from latency import LatencyLog
+import utils
+
+
+# The map is divided into a grid of square tiles. A tile is identified by its
+# zoom level and its column and row within the grid.
+TileKey = tuple[int, int, int]
+# A rendered tile: an RGB image and the canvas coordinates of its top-left
+# corner. Tiles outside the data contain nothing, and are None.
+Tile = Optional[tuple[PIL.Image.Image, int, int]]
+# How long each step of rendering a tile took: the names and durations (in
+# seconds) to record in the latency log.
+_Timings = list[tuple[str, float]]
+
+
+class TileCache:
+    """
+    Renders tiles of an ImagePyramid, either immediately or on a background
+    thread so that they're ready by the time the map needs to display them. All
+    methods must be called from the same thread (the GUI's thread); only the
+    background rendering itself happens elsewhere.
+    """
+    def __init__(
+        self,
+        pyramid: ImagePyramid,
+        tile_size: int,
+        max_size: int,
+        latency: Optional[LatencyLog]=None,
+    ) -> None:
+        """
+        Tiles are tile_size pixels on a side. We hold on to at most max_size
+        finished tiles, discarding the least recently used ones first. Time
+        spent waiting for and rendering tiles (including the ones rendered in
+        the background) is recorded in the latency log, if given.
+        """
+        self._pyramid = pyramid
+        self._latency = LatencyLog() if latency is None else latency
+        self._tile_size = tile_size
+        self._max_size = max_size
+        # A single worker is enough: its job is to get ahead of the user, not
+        # to render lots of things at once.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending: dict[
+            TileKey, concurrent.futures.Future[tuple[Tile, _Timings]]] = {}
+        self._finished: collections.OrderedDict[TileKey, Tile] = (
+            collections.OrderedDict())
+
+    def keys_for_region(
+        self, zoom_level: int, min_x: int, min_y: int, max_x: int, max_y: int
+    ) -> list[TileKey]:
+        """
+        Returns the keys of all the tiles that overlap the region from
+        (min_x, min_y) up to but not including (max_x, max_y), in canvas
+        coordinates at the given zoom level. The ones nearest the center of the
+        region come first.
+        """
+        size = self._tile_size
+        # Nothing has negative coordinates, so don't bother with those tiles.
+        columns = range(max(0, min_x // size), -(-max_x // size))
+        rows = range(max(0, min_y // size), -(-max_y // size))
+        center_column = (min_x + max_x) / 2 / size - 0.5
+        center_row = (min_y + max_y) / 2 / size - 0.5
+        keys = [(zoom_level, column, row) for row in rows for column in columns]
+        return sorted(keys, key=lambda key: (abs(key[1] - center_column) +
+                                             abs(key[2] - center_row)))
+
+    def get(self, key: TileKey) -> Tile:
+        """
+        Returns the tile for this key, rendering it now if we haven't already.
+        """
+        if key in self._finished:
+            self._finished.move_to_end(key)
+            return self._finished[key]
+
+        future = self._pending.pop(key, None)
+        if future is not None and not future.cancelled():
+            with self._latency.measure("wait for prefetched tile"):
+                # Partway done is better than starting over
+                tile, timings = future.result()
+        else:
+            with self._latency.measure("render tile"):
+                tile, timings = self._render(key)
+        self._store(key, tile, timings)
+        return tile
+
+    def prefetch(self, keys: list[TileKey]) -> None:
+        """
+        Starts rendering these tiles in the background, in order. Tiles we were
+        going to prefetch earlier but haven't started on yet are dropped if
+        they're not in this list: the user has moved on.
+        """
+        for key, future in list(self._pending.items()):
+            if key not in keys and future.cancel():
+                del self._pending[key]
+        for key in keys:
+            if key in self._finished or key in self._pending:
+                continue
+            if not self._pyramid.is_valid_zoom_level(key[0]):
+                continue
+            self._pending[key] = self._executor.submit(self._render, key)
+
+    def collect(self) -> bool:
+        """
+        Moves any finished background work into the cache. Returns whether
+        there is still work in progress.
+        """
+        for key, future in list(self._pending.items()):
+            if future.done():
+                del self._pending[key]
+                if not future.cancelled():
+                    self._store(key, *future.result())
+        return bool(self._pending)
+
+    def clear(self) -> None:
+        """
+        Forgets every tile, finished or not, because the pyramid's contents
+        have changed. Work already in progress runs to completion, but its
+        results are discarded.
+        """
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._finished.clear()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _store(self, key: TileKey, tile: Tile, timings: _Timings) -> None:
+        for name, seconds in timings:
+            self._latency.record(name, seconds)
+        self._finished[key] = tile
+        self._finished.move_to_end(key)
+        while len(self._finished) > self._max_size:
+            self._finished.popitem(last=False)
+
+    def _render(self, key: TileKey) -> tuple[Tile, _Timings]:
+        """
+        We return the tile for this key and how long each step of rendering it
+        took. This often runs on the background thread, so it leaves recording
+        those to our callers.
+        """
+        zoom_level, column, row = key
+        size = self._tile_size
+        timings: _Timings = []
+        with self._latency.measure_into(timings, "get submatrix"):
+            submatrix, subhues, min_x, min_y = self._pyramid.get_region_data(
+                column * size, row * size, (column + 1) * size,
+                (row + 1) * size, zoom_level)
+        if submatrix.size == 0:
+            return None, timings
+        with self._latency.measure_into(timings, "to hsv"):
+            hsv = utils.to_hsv_matrix(submatrix, subhues)
+        # Converting to RGB here, rather than letting tkinter do it when we
+        # display the image, keeps that work off the GUI's thread.
+        with self._latency.measure_into(timings, "convert to RGB"):
+            image = PIL.Image.fromarray(hsv, mode="HSV").convert(mode="RGB")
+        return (image, min_x, min_y), timings
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import numpy
+import PIL.Image
+import threading
+import unittest
+
+from image_pyramid import ImagePyramid
+from latency import LatencyLog
+from tile_cache import TileCache
+
+
+class TestTileCache(unittest.TestCase):
+    def setUp(self):
+        generator = numpy.random.default_rng(3)
+        matrix = generator.integers(0, 2, [300, 200], dtype=numpy.uint8)
+        hues = generator.integers(0, 171, matrix.shape, dtype=numpy.uint8)
+        self.pyramid = ImagePyramid(matrix, hues, 40)
+        self.cache = TileCache(self.pyramid, 20, 3)
+
+    def tearDown(self):
+        self.cache.shutdown()
+
+    def assertTileMatches(self, tile, key):
+        zoom_level, column, row = key
+        expected, expected_x, expected_y = self.pyramid.render_region(
+            20 * column, 20 * row, 20 * (column + 1), 20 * (row + 1),
+            zoom_level)
+        expected_image = PIL.Image.fromarray(expected, mode="HSV")
+        image, min_x, min_y = tile
+        self.assertEqual((expected_x, expected_y), (min_x, min_y))
+        self.assertEqual(list(expected_image.convert(mode="RGB").getdata()),
+                         list(image.getdata()))
+
+    def test_keys_for_region(self):
+        self.assertEqual([(1, 0, 1), (1, 0, 2), (1, 0, 0)],
+                         self.cache.keys_for_region(1, -15, 9, 11, 59))
+        self.assertEqual([(-2, 5, 6)],
+                         self.cache.keys_for_region(-2, 100, 120, 120, 140))
+
+    def test_get(self):
+        for key in ((1, 1, 2), (0, 9, 14), (-2, 3, 5)):
+            self.assertTileMatches(self.cache.get(key), key)
+
+    def test_tiles_line_up(self):
+        # Neighboring tiles should fit together without gaps or overlaps.
+        image, min_x, min_y = self.cache.get((-1, 2, 3))
+        self.assertEqual((40, 60), (min_x, min_y))
+        self.assertEqual((20, 20), image.size)
+        # The bottom-right tile is cut off where the data ends.
+        image, min_x, min_y = self.cache.get((0, 9, 14))
+        self.assertEqual((180, 280), (min_x, min_y))
+        self.assertEqual((20, 20), image.size)
+        image, _, _ = self.cache.get((1, 4, 7))
+        self.assertEqual((20, 10), image.size)
+
+    def test_far_away(self):
+        self.assertIsNone(self.cache.get((0, 5000, 5000)))
+
+    def test_prefetch(self):
+        keys = [(0, 0, 0), (-1, 2, 1), (2, 0, 1)]
+        self.cache.prefetch(keys)
+        while self.cache.collect():
+            pass
+        for key in keys:
+            self.assertIn(key, self.cache._finished)
+            self.assertTileMatches(self.cache.get(key), key)
+
+    def test_invalid_zoom_levels_skipped(self):
+        self.cache.prefetch([(-4, 0, 0), (100, 0, 0)])
+        self.assertFalse(self.cache.collect())
+
+    def test_eviction(self):
+        for x in range(5):
+            self.cache.get((0, x, 0))
+        self.assertEqual([(0, 2, 0), (0, 3, 0), (0, 4, 0)],
+                         list(self.cache._finished))
+
+    def test_latency(self):
+        latency = LatencyLog(True)
+        heard = []
+
+        def listen(name, seconds):
+            # The listener updates the GUI, so it's only called on our thread.
+            self.assertIs(threading.main_thread(), threading.current_thread())
+            heard.append(name)
+        latency.listener = listen
+        cache = TileCache(self.pyramid, 20, 3, latency)
+        try:
+            steps = ["get submatrix", "to hsv", "convert to RGB"]
+            cache.get((0, 0, 0))
+            self.assertEqual(["render tile", *steps], heard)
+            # Tiles rendered in the background are measured too, once they're
+            # collected.
+            heard.clear()
+            cache.prefetch([(0, 1, 0)])
+            while cache.collect():
+                pass
+            self.assertEqual(steps, heard)
+        finally:
+            cache.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
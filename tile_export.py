@@ -0,0 +1,93 @@
+import concurrent.futures
+import json
+import os
+import PIL.Image
+import shutil
+
+from image_pyramid import ImagePyramid
+import tokenizer
+
+
+# An export is a directory that can be served by any static web server (e.g.,
+# `python3 -m http.server`) and viewed in a browser, containing:
+#   - index.html, the viewer
+#   - metadata.json, describing the image and the code in both files
+#   - tiles/<zoom level>/<column>_<row>.<format>, the image itself, cut into
+#     square tiles at every zoom level of the pyramid. The viewer loads only
+#     the tiles it displays. It zooms in beyond 100% by scaling up the tiles
+#     from zoom level 0.
+_VIEWER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "tile_viewer.html")
+DEFAULT_TILE_SIZE = 256
+
+
+def _save_tile(
+    pyramid: ImagePyramid,
+    directory: str,
+    tile_size: int,
+    image_format: str,
+    zoom_level: int,
+    column: int,
+    row: int,
+) -> None:
+    submatrix, _, _ = pyramid.render_region(
+        column * tile_size, row * tile_size,
+        (column + 1) * tile_size, (row + 1) * tile_size, zoom_level)
+    image = PIL.Image.fromarray(submatrix, mode="HSV").convert(mode="RGB")
+    image.save(os.path.join(directory, "tiles", str(zoom_level),
+                            f"{column}_{row}.{image_format}"))
+
+
+def _describe_file(data: tokenizer.FileInfo) -> dict:
+    # Flatten the token boundaries into one list of (start line, start column,
+    # end line, end column) quadruples, which is much more compact in JSON than
+    # nested lists.
+    boundaries = [value for (a, b), (c, d) in data.boundaries
+                  for value in (a, b, c, d)]
+    return {"filename": data.filename,
+            "lines": data.lines,
+            "boundaries": boundaries}
+
+
+def export(
+    directory: str,
+    pyramid: ImagePyramid,
+    data_a: tokenizer.FileInfo,
+    data_b: tokenizer.FileInfo,
+    tile_size: int=DEFAULT_TILE_SIZE,
+    image_format: str="png",
+    worker_count: int=1,
+) -> None:
+    """
+    Writes the pyramid and the code it compares to the directory, in a form
+    that can be viewed in a web browser. Tiles are rendered and saved on
+    worker_count threads.
+    """
+    max_zoom_level = pyramid.get_max_zoom_level()
+    levels = []
+    for zoom_level in range(max_zoom_level + 1):
+        os.makedirs(os.path.join(directory, "tiles", str(zoom_level)),
+                    exist_ok=True)
+        height, width = pyramid.get_shape(zoom_level)
+        levels.append({"width": width, "height": height})
+
+    with concurrent.futures.ThreadPoolExecutor(worker_count) as executor:
+        futures = []
+        for zoom_level, level in enumerate(levels):
+            for row in range(-(-level["height"] // tile_size)):
+                for column in range(-(-level["width"] // tile_size)):
+                    futures.append(executor.submit(
+                        _save_tile, pyramid, directory, tile_size,
+                        image_format, zoom_level, column, row))
+        for future in futures:
+            future.result()  # Re-raise any exceptions from the threads
+
+    metadata = {"tile_size": tile_size,
+                "format": image_format,
+                "map_width": pyramid.get_sidelength(),
+                "levels": levels,
+                "a": _describe_file(data_a),
+                "b": _describe_file(data_b)}
+    with open(os.path.join(directory, "metadata.json"), "w") as f:
+        json.dump(metadata, f, separators=(",", ":"))
+    shutil.copyfile(_VIEWER, os.path.join(directory, "index.html"))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import json
+import numpy
+import os
+import PIL.Image
+import tempfile
+import unittest
+
+from image_pyramid import ImagePyramid
+import tile_export
+import tokenizer
+import utils
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        code = 'if x:\n\tprint(hello(1, 2))\nprint(hello("hi", 2))\n'
+        self.data = tokenizer.get_tokens(code, "python", "hello.py")
+        generator = numpy.random.default_rng(9)
+        self.matrix = generator.integers(0, 2, [70, 45], dtype=numpy.uint8)
+        self.hues = generator.integers(0, 171, self.matrix.shape,
+                                       dtype=numpy.uint8)
+        self.pyramid = ImagePyramid(self.matrix, self.hues, 20)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        tile_export.export(self.directory, self.pyramid, self.data, self.data,
+                           tile_size=16, worker_count=2)
+
+    def test_metadata(self):
+        with open(os.path.join(self.directory, "metadata.json")) as f:
+            metadata = json.load(f)
+        self.assertEqual(16, metadata["tile_size"])
+        self.assertEqual([{"width": 45, "height": 70},
+                          {"width": 22, "height": 35},
+                          {"width": 11, "height": 17}],
+                         metadata["levels"])
+        self.assertEqual(self.data.lines, metadata["a"]["lines"])
+        self.assertEqual([1, 0, 1, 2], metadata["a"]["boundaries"][:4])
+        self.assertEqual(4 * len(self.data.tokens),
+                         len(metadata["b"]["boundaries"]))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, "index.html")))
+
+    def test_tiles(self):
+        for zoom_level in range(3):
+            expected, expected_hues = ImagePyramid.downscale(
+                self.matrix, self.hues, zoom_level)
+            expected_image = PIL.Image.fromarray(
+                utils.to_hsv_matrix(expected, expected_hues), mode="HSV")
+            expected_rgb = numpy.asarray(expected_image.convert(mode="RGB"))
+
+            # Stitch the tiles back together.
+            height, width = expected.shape
+            actual = numpy.zeros_like(expected_rgb)
+            tile_directory = os.path.join(self.directory, "tiles",
+                                          str(zoom_level))
+            tile_count = 0
+            for row in range(0, height, 16):
+                for column in range(0, width, 16):
+                    filename = f"{column // 16}_{row // 16}.png"
+                    with PIL.Image.open(os.path.join(tile_directory,
+                                                     filename)) as tile:
+                        actual[row:row + 16, column:column + 16] = tile
+                    tile_count += 1
+            self.assertEqual(tile_count, len(os.listdir(tile_directory)))
+            self.assertTrue((expected_rgb == actual).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,14 @@
-import code_tokenize
 import numpy
 import numpy.typing
-from typing import NamedTuple, Optional
-
-from code_tokenize.tokens import ASTToken
+from typing import NamedTuple, Optional, TYPE_CHECKING
 
 import utils
 
+if TYPE_CHECKING:
+    # code_tokenize takes longer to import than everything else put together,
+    # so we only import it for real once we have something to tokenize.
+    from code_tokenize.tokens import ASTToken
+
 
 # Syntactic sugar: a Boundary contains the start and end of a token, where
 # each position is described by its line number and the column within the line.
@@ -44,6 +46,7 @@ def get_file_tokens(filename: str, language: Optional[str]=None) -> FileInfo:
 
 
 def get_tokens(file_contents: str, language: str, filename: str) -> FileInfo:
+    import code_tokenize
     try:
         toks = code_tokenize.tokenize(file_contents, lang=language)
     except ValueError:
@@ -62,8 +65,8 @@ def get_tokens(file_contents: str, language: str, filename: str) -> FileInfo:
 
 def _find_boundary(
     i: int,
-    tok: ASTToken,
-    toks: list[ASTToken],
+    tok: "ASTToken",
+    toks: list["ASTToken"],
     most_recent_line: int
 ) -> Boundary:
     """
@@ -100,7 +103,7 @@ def _find_boundary(
                 raise
 
 
-def _get_boundaries(toks: list[ASTToken]) -> list[Boundary]:
+def _get_boundaries(toks: list["ASTToken"]) -> list[Boundary]:
     most_recent_line = 0  # Used when parsing dedents in Python
     boundaries = []
     for i, tok in enumerate(toks):
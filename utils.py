@@ -1,27 +1,67 @@
+import concurrent.futures
 import numpy
 import numpy.typing
-from typing import Optional
+from typing import Callable, Optional
 
 
 PIXELS_IN_BIG_FILE = 50 * 1000 * 1000  # 50 megapixels
+# When writing out images piece by piece, each piece has about this many pixels
+PIXELS_PER_STRIP = 1 << 22
+# Splitting work across threads only pays off when each thread has at least
+# this many pixels to work on.
+_MIN_PIXELS_PER_BAND = 1 << 20
+
+
+def in_row_bands(
+    function: Callable[[int, int], None],
+    shape: tuple[int, ...],
+    worker_count: int,
+) -> None:
+    """
+    Calls function(start, end) on consecutive bands of rows which together
+    cover all the rows of an image of the given shape. If worker_count is more
+    than 1 and the image is big enough, the bands are processed in parallel on
+    that many threads. numpy releases the GIL during large array operations,
+    so this speeds things up as long as function spends most of its time in
+    numpy. The bands must not depend on each other.
+    """
+    row_count = shape[0]
+    pixel_count = int(numpy.prod(shape))
+    band_count = min(worker_count, row_count,
+                     pixel_count // _MIN_PIXELS_PER_BAND)
+    if band_count <= 1:
+        function(0, row_count)
+        return
+
+    bounds = [row_count * i // band_count for i in range(band_count + 1)]
+    with concurrent.futures.ThreadPoolExecutor(band_count) as executor:
+        futures = [executor.submit(function, start, end)
+                   for start, end in zip(bounds, bounds[1:])]
+        for future in futures:
+            future.result()  # Re-raise any exceptions from the threads
 
 
 def to_hsv_matrix(
     matrix: numpy.typing.NDArray[numpy.uint8],
     hues: Optional[numpy.typing.NDArray[numpy.uint8]],
+    worker_count: int=1,
 ) -> numpy.typing.NDArray[numpy.uint8]:
     """
     The matrix is a 2D array of uint8's. The hues are either None or another 2D
     array of the same shape.
 
     We return a 3D array representing an HSV image of the matrix, optionally
-    colored by the hues.
+    colored by the hues. Large images are split across worker_count threads.
     """
     result = numpy.zeros([*matrix.shape, 3], numpy.uint8)
-    result[:, :, 2] = matrix * 255
-    if hues is not None:
-        result[:, :, 0] = hues
-        result[:, :, 1] = 255  # Saturation
+
+    def fill_rows(start: int, end: int) -> None:
+        result[start:end, :, 2] = matrix[start:end] * 255
+        if hues is not None:
+            result[start:end, :, 0] = hues[start:end]
+            result[start:end, :, 1] = 255  # Saturation
+
+    in_row_bands(fill_rows, matrix.shape, worker_count)
     return result
 
 
@@ -35,6 +75,94 @@ def make_matrix(
     return matrix
 
 
+def get_matches(
+    tokens_a: numpy.typing.NDArray,
+    tokens_b: numpy.typing.NDArray,
+) -> tuple[numpy.typing.NDArray[numpy.int64],
+           numpy.typing.NDArray[numpy.int64]]:
+    """
+    We return the row and column indices of every set pixel in the matrix that
+    make_matrix would build, sorted by row and then by column, without ever
+    building the matrix itself. The memory used is proportional to the number
+    of matching pairs of tokens rather than the number of pixels.
+    """
+    if len(tokens_a) == 0 or len(tokens_b) == 0:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return empty, empty.copy()
+
+    # Group the indices of tokens_b by their value: order_b lists them so that
+    # all copies of the same value are contiguous (and in increasing order),
+    # and the copies of values[i] start at starts_b[i].
+    values, inverse_b, counts_b = numpy.unique(
+        tokens_b, return_inverse=True, return_counts=True)
+    order_b = numpy.argsort(inverse_b, kind="stable")
+    starts_b = numpy.cumsum(counts_b) - counts_b
+
+    # Find which group (if any) each token in tokens_a belongs to.
+    group = numpy.minimum(numpy.searchsorted(values, tokens_a), len(values) - 1)
+    row_counts = numpy.where(values[group] == tokens_a, counts_b[group], 0)
+
+    # Row i gets every column in its group. Build all those runs of columns at
+    # once: each match's position within order_b is the start of its group plus
+    # how far it is into the current run.
+    rows = numpy.repeat(numpy.arange(len(tokens_a)), row_counts)
+    run_starts = numpy.cumsum(row_counts) - row_counts
+    offsets = numpy.arange(len(rows)) - numpy.repeat(run_starts, row_counts)
+    cols = order_b[numpy.repeat(starts_b[group], row_counts) + offsets]
+    return rows.astype(numpy.int64), cols.astype(numpy.int64)
+
+
+def get_diagonal_matches(
+    tokens_a: numpy.typing.NDArray[numpy.str_],
+    tokens_b: numpy.typing.NDArray[numpy.str_]
+) -> tuple[numpy.typing.NDArray[numpy.int64],
+           numpy.typing.NDArray[numpy.int64]]:
+    """
+    Like get_matches, but we only return the set pixels with another one
+    immediately diagonal from them, which are the only ones that can be part
+    of a segment. We find them by matching up pairs of consecutive tokens, so
+    the memory used is proportional to the number of matching pairs of those.
+    """
+    if len(tokens_a) == 0 or len(tokens_b) == 0:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return empty, empty.copy()
+
+    # Number the tokens in tokens_b, and give the same numbers to the ones in
+    # tokens_a, except that ones not in tokens_b all get the next number up.
+    values, ids_b = numpy.unique(tokens_b, return_inverse=True)
+    ids_b = ids_b.reshape(-1).astype(numpy.int64)
+    ids_a = numpy.minimum(numpy.searchsorted(values, tokens_a),
+                          len(values) - 1).astype(numpy.int64)
+    ids_a = numpy.where(values[ids_a] == tokens_a, ids_a, len(values))
+
+    id_count = len(values) + 1
+    rows, cols = get_matches(ids_a[:-1] * id_count + ids_a[1:],
+                             ids_b[:-1] * id_count + ids_b[1:])
+    # Each matching bigram sets the pixel at its start and the one after it.
+    column_count = len(tokens_b)
+    positions = numpy.unique(numpy.concatenate(
+        [rows * column_count + cols, (rows + 1) * column_count + cols + 1]))
+    return positions // column_count, positions % column_count
+
+
+def get_token_ids(
+    token_arrays: list[numpy.typing.NDArray[numpy.str_]]
+) -> tuple[numpy.typing.NDArray[numpy.int32], list[int]]:
+    """
+    We replace every token in all the arrays with an integer that is the same
+    for equal tokens and different for different ones, which is much cheaper to
+    store and compare than the strings. We return the IDs of all the tokens,
+    concatenated together, and the offsets at which each array starts, plus the
+    total number of tokens at the end.
+    """
+    all_tokens = numpy.concatenate(
+        [numpy.array([], dtype=str)] +
+        [numpy.asarray(tokens, dtype=str) for tokens in token_arrays])
+    _, token_ids = numpy.unique(all_tokens, return_inverse=True)
+    offsets = numpy.cumsum([0] + [len(tokens) for tokens in token_arrays])
+    return token_ids.astype(numpy.int32), offsets.tolist()
+
+
 def guess_language(filename: str) -> str:
     file_type = filename.split(".")[-1]
     known_types = {  # Sorted by language (sorted by value, not key!)
@@ -1,32 +1,80 @@
 #!/usr/bin/env python3
 import argparse
-import PIL.Image
+import math
+import numpy
+import numpy.typing
+import os
 import sys
+from typing import Iterator, NamedTuple, Optional, TYPE_CHECKING
 
 import find_duplicates
+from image_pyramid import ImagePyramid, SparseImagePyramid
+import png_writer
+import raw_arrays
+import session
 import tokenizer
 import utils
 
-try:
-    # To get the GUI to work, you'll need to be able to install the TK bindings
-    # for PIL (in Ubuntu, it's the python3-pil.imagetk package). We put this in
-    # a try block so that the non-GUI functionality will still work even if you
-    # can't install this.
-    import gui
-    can_use_gui = True
-except ImportError:
-    can_use_gui = False
+# Modules that are only needed on some paths through the program are imported
+# where they're used, to keep startup fast. Importing them here is just for
+# the type annotations.
+if TYPE_CHECKING:
+    import multiprocessing.pool
+    _HueLevels = multiprocessing.pool.AsyncResult[
+        list[numpy.typing.NDArray[numpy.uint8]]]
+
+
+class SparseHues(NamedTuple):
+    """
+    The hues of just the set pixels of a matrix, which are at rows and cols
+    (sorted like utils.get_matches returns them), for coloring matrices too
+    big to build all at once.
+    """
+    rows: numpy.typing.NDArray[numpy.int64]
+    cols: numpy.typing.NDArray[numpy.int64]
+    hues: numpy.typing.NDArray[numpy.uint8]
+
+    def get_block(
+        self, top: int, left: int, shape: tuple[int, int]
+    ) -> numpy.typing.NDArray[numpy.uint8]:
+        """
+        We return the hues of the part of the matrix with the given shape and
+        top-left corner.
+        """
+        start, end = numpy.searchsorted(self.rows, [top, top + shape[0]])
+        rows, cols = self.rows[start:end], self.cols[start:end]
+        inside = (left <= cols) & (cols < left + shape[1])
+        # Pixels that aren't set are black whatever their hue, but zooming out
+        # keeps the lowest hue of every square of pixels, so give them the
+        # highest one.
+        block = numpy.full(shape, numpy.iinfo(numpy.uint8).max,
+                           dtype=numpy.uint8)
+        block[rows[inside] - top, cols[inside] - left] = (
+            self.hues[start:end][inside])
+        return block
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
-    parser.add_argument("filename_a", help="File to analyze")
+    parser.add_argument("filename_a",
+                        help="File to analyze, or a session or raw array "
+                             f"({raw_arrays.EXTENSION}) file to reopen")
     parser.add_argument("filename_b", nargs="?",
                         help="(Optional) Second file to analyze")
     parser.add_argument("--output_location", "-o",
-                        help="Save an image to this location and exit")
+                        help="Save an image to this location and exit. If it "
+                             f"ends in {raw_arrays.EXTENSION}, save the raw "
+                             "matrix, hues, and segments instead")
     parser.add_argument("--big_file", "-b", action="store_true",
-                        help="Save the image even if the file is big")
+                        help="Save the image even if the file is big, and "
+                             "color big files by building their whole "
+                             "matrix rather than just finding their matches")
+    parser.add_argument("--output_scale", "-os", type=int, default=0,
+                        help="Shrink the saved image by a factor of 2 this "
+                             "many times, the same way the GUI zooms out")
+    parser.add_argument("--max_output_size", "-ms", type=int,
+                        help="Shrink the saved image by factors of 2 until it "
+                             "is at most this many pixels wide and tall")
     parser.add_argument("--language", "-l", default=None,
                         help="Language of code in files")
     parser.add_argument("--map_width", "-mw", type=int, default=600,
@@ -36,19 +84,284 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--black_and_white", "--black-and-white", "-bw",
                         action="store_true",
                         help="Don't color based on the amount of duplication")
-    return parser.parse_args()
+    parser.add_argument("--save_session", "-s",
+                        help="Before opening the GUI or exporting tiles, save "
+                             "everything the GUI needs to this file so it can "
+                             "be reopened quickly (the name should end in "
+                             f"{session.EXTENSION})")
+    parser.add_argument("--export_tiles", "-e",
+                        help="Instead of opening the GUI, save the map as "
+                             "tiles in this directory, along with a web page "
+                             "for viewing them")
+    parser.add_argument("--tile_format", default="png",
+                        choices=("png", "webp"),
+                        help="Image format of exported tiles")
+    parser.add_argument("--workers", "-w", type=int,
+                        default=os.cpu_count() or 1,
+                        help="Number of threads to use when building images")
+    parser.add_argument("--show_latency", action="store_true",
+                        help="Display how long the GUI takes to respond to "
+                             "each event, and print a summary on exit")
+    args = parser.parse_args()
+    if args.save_session is not None and args.output_location is not None:
+        parser.error("--save_session can't be used with --output_location")
+    return args
 
 
-def get_text_width(args: argparse.Namespace) -> int:
+def get_text_width(args: argparse.Namespace, filename: str) -> int:
     if args.text_width is not None:
         return args.text_width
-    if args.language == "python" or args.filename_a.split(".")[-1] == "py":
+    if args.language == "python" or filename.split(".")[-1] == "py":
         return 80
     return 100
 
 
+def get_hue_levels(
+    matrix: numpy.typing.NDArray[numpy.uint8],
+    is_single_file: bool,
+    sidelength: int,
+    worker_count: int,
+) -> list[numpy.typing.NDArray[numpy.uint8]]:
+    """
+    Computes the hues for the matrix and zooms them out, ready to be added to
+    a black-and-white ImagePyramid. This is run in a separate process, so it
+    must be a top-level function.
+    """
+    hues = find_duplicates.get_hues(matrix, is_single_file)
+    return ImagePyramid.build_hue_levels([hues], sidelength, worker_count)
+
+
+def get_sparse_hue_levels(
+    rows: numpy.typing.NDArray[numpy.int64],
+    cols: numpy.typing.NDArray[numpy.int64],
+    shape: tuple[int, int],
+    is_single_file: bool,
+    sidelength: int,
+) -> list[numpy.typing.NDArray[numpy.uint8]]:
+    """
+    Like get_hue_levels, but for the matches at rows and cols in a matrix of
+    the given shape, ready to be added to a SparseImagePyramid built with
+    will_set_hues.
+    """
+    hues, _ = find_duplicates.get_sparse_hues_and_segments(
+        rows, cols, shape, is_single_file)
+    return SparseImagePyramid.build_sparse_hue_levels(
+        rows, cols, hues, shape, sidelength)
+
+
+def is_png(filename: str) -> bool:
+    return filename.lower().endswith(".png")
+
+
+def get_output_zoom_level(
+    args: argparse.Namespace, shape: tuple[int, int]
+) -> int:
+    """
+    Returns how many times the saved image should be zoomed out (each time
+    halving its width and height), based on the command-line arguments.
+    """
+    zoom_level = args.output_scale
+    if args.max_output_size is not None:
+        while max(shape) >> zoom_level > args.max_output_size:
+            zoom_level += 1
+    # Don't shrink the image down to nothing.
+    while zoom_level > 0 and min(shape) >> zoom_level == 0:
+        zoom_level -= 1
+    return zoom_level
+
+
+def get_checked_output_zoom_level(
+    args: argparse.Namespace, shape: tuple[int, int]
+) -> int:
+    """
+    Like get_output_zoom_level, but exits if the image would be too big to
+    save safely.
+    """
+    zoom_level = get_output_zoom_level(args, shape)
+    output_pixel_count = (shape[0] >> zoom_level) * (shape[1] >> zoom_level)
+    if (output_pixel_count > utils.PIXELS_IN_BIG_FILE and
+            not args.big_file and not is_png(args.output_location)):
+        print("WARNING: the image is over 50 megapixels. Saving very large "
+              "images can use so many resources that your computer "
+              "will freeze. To perform this action anyway, use the "
+              "--big_file flag, or save it as a PNG, or shrink it with "
+              "--output_scale or --max_output_size.")
+        sys.exit(2)
+    return zoom_level
+
+
+def check_coloring_size(args: argparse.Namespace, pixel_count: int) -> None:
+    if pixel_count > utils.PIXELS_IN_BIG_FILE and not args.big_file:
+        print("WARNING: the image is over 50 megapixels. Coloring very "
+              "large images can use so many resources that your computer "
+              "will freeze. To perform this action anyway, use the "
+              "--big_file flag. To skip coloring and use a "
+              "black-and-white image, use the --black_and_white flag.")
+        sys.exit(3)
+
+
+def get_image_strips(
+    tokens_a: numpy.typing.NDArray[numpy.str_],
+    tokens_b: numpy.typing.NDArray[numpy.str_],
+    hues: Optional[numpy.typing.NDArray[numpy.uint8] | SparseHues],
+    zoom_level: int,
+) -> Iterator[tuple[numpy.typing.NDArray[numpy.uint8],
+                    Optional[numpy.typing.NDArray[numpy.uint8]]]]:
+    """
+    Yields the matrix and hues at the given zoom level, as horizontal strips
+    from top to bottom. Zooming out is done the same way as in the GUI, but we
+    never build the whole full-resolution matrix: just one block of it at a
+    time, with about utils.PIXELS_PER_STRIP pixels in the block and in the
+    strip. Only the hues (if any) are needed up front.
+    """
+    scale = 1 << zoom_level
+    output_width = len(tokens_b) >> zoom_level
+    # Blocks must start at multiples of the scale for zooming out a block at a
+    # time to give the same results as zooming out the whole thing.
+    block_rows = scale * min(
+        max(1, math.isqrt(utils.PIXELS_PER_STRIP) // scale),
+        max(1, utils.PIXELS_PER_STRIP // max(1, output_width)))
+    block_cols = scale * max(1, utils.PIXELS_PER_STRIP // block_rows // scale)
+
+    for row in range(0, len(tokens_a), block_rows):
+        matrix_blocks = []
+        hue_blocks: list[numpy.typing.NDArray[numpy.uint8]] = []
+        for col in range(0, len(tokens_b), block_cols):
+            matrix = utils.make_matrix(tokens_a[row:row + block_rows],
+                                       tokens_b[col:col + block_cols])
+            block_hues = None
+            if isinstance(hues, SparseHues):
+                block_hues = hues.get_block(row, col, matrix.shape)
+            elif hues is not None:
+                block_hues = hues[row:row + block_rows, col:col + block_cols]
+            matrix, block_hues = ImagePyramid.downscale(
+                matrix, block_hues, zoom_level)
+            matrix_blocks.append(matrix)
+            if block_hues is not None:
+                hue_blocks.append(block_hues)
+        yield (numpy.concatenate(matrix_blocks, axis=1),
+               numpy.concatenate(hue_blocks, axis=1) if hue_blocks else None)
+
+
+def save_image(
+    filename: str,
+    tokens_a: numpy.typing.NDArray[numpy.str_],
+    tokens_b: numpy.typing.NDArray[numpy.str_],
+    hues: Optional[numpy.typing.NDArray[numpy.uint8] | SparseHues],
+    zoom_level: int,
+    worker_count: int,
+) -> None:
+    """
+    Saves the image, zoomed out zoom_level times. PNGs are written one
+    horizontal strip at a time, so we never hold more than a strip of them in
+    memory. Other formats need the whole (zoomed-out) image at once.
+    """
+    import PIL.Image
+    height = len(tokens_a) >> zoom_level
+    width = len(tokens_b) >> zoom_level
+
+    def get_rgb_strips() -> Iterator[numpy.typing.NDArray[numpy.uint8]]:
+        for matrix, strip_hues in get_image_strips(
+                tokens_a, tokens_b, hues, zoom_level):
+            if hues is None:
+                yield matrix * 255  # Grayscale
+                continue
+            image = utils.to_hsv_matrix(matrix, strip_hues, worker_count)
+            yield numpy.asarray(PIL.Image.fromarray(image, mode="HSV").convert(
+                mode="RGB"))
+
+    channels = 1 if hues is None else 3
+    if is_png(filename):
+        png_writer.write(filename, width, height, channels, get_rgb_strips())
+        return
+
+    pil_image = PIL.Image.fromarray(numpy.concatenate(list(get_rgb_strips())),
+                                    mode="L" if channels == 1 else "RGB")
+    pil_image.convert(mode="RGB").save(filename)
+
+
+def launch_gui(
+    args: argparse.Namespace,
+    pyramid: ImagePyramid,
+    data_a: tokenizer.FileInfo,
+    data_b: tokenizer.FileInfo,
+    hue_levels: Optional["_HueLevels"]=None,
+) -> None:
+    if args.save_session is not None:
+        session.save(args.save_session, pyramid, data_a, data_b)
+    if args.export_tiles is not None:
+        import tile_export
+        # The exported tiles are viewed in a browser instead of the GUI.
+        tile_export.export(args.export_tiles, pyramid, data_a, data_b,
+                           image_format=args.tile_format,
+                           worker_count=args.workers)
+        print(f"Exported tiles to {args.export_tiles}. To view them, run "
+              f"`python3 -m http.server` in that directory and open it in a "
+              f"web browser.")
+        return
+    try:
+        # To get the GUI to work, you'll need to be able to install the TK
+        # bindings for PIL (in Ubuntu, it's the python3-pil.imagetk package).
+        # We only import it here so that the non-GUI functionality will still
+        # work even if you can't install this, and so that it doesn't slow
+        # down starting up when we're not going to use it.
+        import gui
+    except ImportError:
+        print("ERROR: Cannot load GUI. Try doing a `sudo apt-get install "
+              "python3-pil.imagetk`. If that doesn't help, open a python3 "
+              "shell, `import gui`, and see what's going wrong.")
+        sys.exit(1)
+    gui.launch(pyramid, data_a, data_b, get_text_width(args, data_a.filename),
+               hue_levels, args.show_latency)
+
+
+def save_raw_arrays(
+    args: argparse.Namespace,
+    data_a: tokenizer.FileInfo,
+    data_b: tokenizer.FileInfo,
+) -> None:
+    if not args.black_and_white:
+        # Check before building the matrix, which is just as big.
+        check_coloring_size(args, len(data_a.tokens) * len(data_b.tokens))
+    matrix = utils.make_matrix(data_a.tokens, data_b.tokens)
+    hues, segments = None, None
+    if not args.black_and_white:
+        hues, segment_set = find_duplicates.get_hues_and_segments(
+            matrix, args.filename_b is None)
+        segments = find_duplicates.segments_to_array(segment_set)
+    raw_arrays.save(args.output_location, raw_arrays.RawArrays(
+        matrix, hues, segments, data_a, data_b))
+
+
+def reopen_raw_arrays(args: argparse.Namespace) -> None:
+    """
+    Displays or re-renders the contents of a raw array file, without having
+    to re-tokenize the code or recompute the hues.
+    """
+    loaded = raw_arrays.load(args.filename_a)
+    hues = None if args.black_and_white else loaded.hues
+    if args.output_location is None:
+        pyramid = ImagePyramid(loaded.matrix, hues, args.map_width,
+                               args.workers)
+        launch_gui(args, pyramid, loaded.data_a, loaded.data_b)
+    elif raw_arrays.is_raw_arrays(args.output_location):
+        raw_arrays.save(args.output_location, loaded._replace(hues=hues))
+    else:
+        zoom_level = get_checked_output_zoom_level(args, loaded.matrix.shape)
+        save_image(args.output_location, loaded.data_a.tokens,
+                   loaded.data_b.tokens, hues, zoom_level, args.workers)
+
+
 def main() -> None:
     args = parse_args()
+    if args.filename_a.endswith(session.EXTENSION):
+        pyramid, data_a, data_b = session.load(args.filename_a, args.map_width)
+        launch_gui(args, pyramid, data_a, data_b)
+        return
+    if raw_arrays.is_raw_arrays(args.filename_a):
+        reopen_raw_arrays(args)
+        return
+
     language = args.language
     if language is None:
         language = utils.guess_language(args.filename_a)
@@ -62,41 +375,95 @@ def main() -> None:
     print(f"Comparing a file with {len(data_a.tokens)} tokens to "
           f"one that has {len(data_b.tokens)}: final image has "
           f"{pixel_count} pixels.")
+
+    shape = (len(data_a.tokens), len(data_b.tokens))
+    # Unless the user asks for the whole matrix anyway, big ones are colored
+    # using just the locations of the matches, which takes memory in
+    # proportion to the number of them rather than the number of pixels.
+    use_sparse_hues = (pixel_count > utils.PIXELS_IN_BIG_FILE and
+                       not args.big_file and not args.black_and_white)
+
+    if (args.output_location is None and
+            pixel_count > utils.PIXELS_IN_BIG_FILE and
+            (args.black_and_white or use_sparse_hues)):
+        # Big images are mostly empty space. Rather than building the whole
+        # matrix, give the GUI just the locations of the matches, and only
+        # fill in the parts of the image it actually displays.
+        rows, cols = utils.get_matches(data_a.tokens, data_b.tokens)
+        is_single_file = args.filename_b is None
+        if (use_sparse_hues and args.save_session is None and
+                args.export_tiles is None):
+            # Like below, open the GUI in black and white right away, and
+            # color it in once the hues are ready.
+            import multiprocessing
+            pyramid = SparseImagePyramid(rows, cols, None, shape,
+                                         args.map_width, will_set_hues=True)
+            with multiprocessing.Pool(1) as pool:
+                hue_levels = pool.apply_async(
+                    get_sparse_hue_levels, (rows, cols, shape, is_single_file,
+                                            args.map_width))
+                launch_gui(args, pyramid, data_a, data_b, hue_levels)
+            return
+        hues = None
+        if use_sparse_hues:
+            hues, _ = find_duplicates.get_sparse_hues_and_segments(
+                rows, cols, shape, is_single_file)
+        launch_gui(args, SparseImagePyramid(rows, cols, hues, shape,
+                                            args.map_width), data_a, data_b)
+        return
+
+    if args.output_location is not None:
+        if raw_arrays.is_raw_arrays(args.output_location):
+            save_raw_arrays(args, data_a, data_b)
+            return
+        zoom_level = get_checked_output_zoom_level(args, shape)
+        if args.black_and_white:
+            # We don't need the whole matrix at once for this.
+            save_image(args.output_location, data_a.tokens, data_b.tokens,
+                       None, zoom_level, args.workers)
+            return
+        if use_sparse_hues:
+            rows, cols = utils.get_matches(data_a.tokens, data_b.tokens)
+            sparse_hues, _ = find_duplicates.get_sparse_hues_and_segments(
+                rows, cols, shape, args.filename_b is None)
+            save_image(args.output_location, data_a.tokens, data_b.tokens,
+                       SparseHues(rows, cols, sparse_hues), zoom_level,
+                       args.workers)
+            return
+
     matrix = utils.make_matrix(data_a.tokens, data_b.tokens)
 
     if args.black_and_white:
         hues = None
     else:
-        if pixel_count > utils.PIXELS_IN_BIG_FILE and not args.big_file:
-            print("WARNING: the image is over 50 megapixels. Coloring very "
-                  "large images can use so many resources that your computer "
-                  "will freeze. To perform this action anyway, use the "
-                  "--big_file flag. To skip coloring and use a "
-                  "black-and-white image, use the --black_and_white flag.")
-            sys.exit(3)
+        check_coloring_size(args, pixel_count)
+        if (args.output_location is None and args.save_session is None and
+                args.export_tiles is None):
+            # Finding the duplicated segments can take a while on mid-sized
+            # files. Rather than making the user stare at nothing until it's
+            # done, open the GUI with a black-and-white map right away, and
+            # color it in once the hues have been computed in another process.
+            # When the GUI closes, leaving the `with` block kills that process
+            # if it's still running.
+            import multiprocessing
+            pyramid = ImagePyramid(matrix, None, args.map_width, args.workers)
+            with multiprocessing.Pool(1) as pool:
+                hue_levels = pool.apply_async(
+                    get_hue_levels, (matrix, args.filename_b is None,
+                                     args.map_width, args.workers))
+                launch_gui(args, pyramid, data_a, data_b, hue_levels)
+            return
         hues = find_duplicates.get_hues(matrix, args.filename_b is None)
 
     if args.output_location is None:
-        if can_use_gui:
-            text_width = get_text_width(args)
-            gui.launch(matrix, hues, data_a, data_b, args.map_width, text_width)
-        else:
-            print("ERROR: Cannot load GUI. Try doing a `sudo apt-get install "
-                  "python3-pil.imagetk`. If that doesn't help, open a python3 "
-                  "shell, `import gui`, and see what's going wrong.")
-            sys.exit(1)
+        pyramid = ImagePyramid(matrix, hues, args.map_width, args.workers)
+        launch_gui(args, pyramid, data_a, data_b)
     else:
-        if pixel_count > utils.PIXELS_IN_BIG_FILE and not args.big_file:
-            print("WARNING: the image is over 10 megapixels. Saving very large "
-                  "images can use so many resources that your computer "
-                  "will freeze. To perform this action anyway, use the "
-                  "--big_file flag.")
-            sys.exit(2)
-
-        # Otherwise, all is well.
-        image = utils.to_hsv_matrix(matrix, hues)
-        pil_image = PIL.Image.fromarray(image, mode="HSV")
-        pil_image.convert(mode="RGB").save(args.output_location)
+        # The image is built a block at a time, so we don't need the whole
+        # matrix any more: just the hues.
+        del matrix
+        save_image(args.output_location, data_a.tokens, data_b.tokens, hues,
+                   zoom_level, args.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import argparse
+import numpy
+import unittest
+import unittest.mock
+
+from image_pyramid import ImagePyramid
+import utils
+import visual_diff
+
+
+class TestOutputZoomLevel(unittest.TestCase):
+    def get_zoom_level(self, shape, output_scale=0, max_output_size=None):
+        args = argparse.Namespace(output_scale=output_scale,
+                                  max_output_size=max_output_size)
+        return visual_diff.get_output_zoom_level(args, shape)
+
+    def test_defaults(self):
+        self.assertEqual(0, self.get_zoom_level((5000, 3000)))
+
+    def test_output_scale(self):
+        self.assertEqual(3, self.get_zoom_level((5000, 3000), 3))
+        # We don't shrink the image to nothing.
+        self.assertEqual(3, self.get_zoom_level((5000, 8), 10))
+
+    def test_max_output_size(self):
+        self.assertEqual(3, self.get_zoom_level((5000, 3000), 0, 625))
+        self.assertEqual(4, self.get_zoom_level((5000, 3000), 0, 624))
+        self.assertEqual(5, self.get_zoom_level((5000, 3000), 5, 624))
+
+
+class TestImageStrips(unittest.TestCase):
+    def setUp(self):
+        generator = numpy.random.default_rng(8)
+        self.tokens_a = generator.integers(0, 4, 301).astype(str)
+        self.tokens_b = generator.integers(0, 4, 173).astype(str)
+        self.matrix = utils.make_matrix(self.tokens_a, self.tokens_b)
+        self.hues = generator.integers(0, 171, self.matrix.shape,
+                                       dtype=numpy.uint8)
+
+    def test_matches_whole_image(self):
+        # Use tiny blocks so the image gets split up in both directions.
+        with unittest.mock.patch.object(utils, "PIXELS_PER_STRIP", 200):
+            for zoom_level in range(4):
+                strips = list(visual_diff.get_image_strips(
+                    self.tokens_a, self.tokens_b, self.hues, zoom_level))
+                self.assertGreater(len(strips), 1)
+                expected_matrix, expected_hues = ImagePyramid.downscale(
+                    self.matrix, self.hues, zoom_level)
+                actual_matrix = numpy.concatenate([m for m, _ in strips])
+                actual_hues = numpy.concatenate([h for _, h in strips])
+                self.assertEqual(expected_matrix.shape, actual_matrix.shape)
+                self.assertTrue((expected_matrix == actual_matrix).all())
+                self.assertTrue((expected_hues == actual_hues).all())
+
+    def test_sparse_hues(self):
+        # Unmatched pixels get the bluest hue, as in find_duplicates.get_hues.
+        self.hues[self.matrix == 0] = 170
+        rows, cols = utils.get_matches(self.tokens_a, self.tokens_b)
+        hues = visual_diff.SparseHues(rows, cols, self.hues[rows, cols])
+        with unittest.mock.patch.object(utils, "PIXELS_PER_STRIP", 200):
+            for zoom_level in range(4):
+                strips = list(visual_diff.get_image_strips(
+                    self.tokens_a, self.tokens_b, hues, zoom_level))
+                expected_matrix, expected_hues = ImagePyramid.downscale(
+                    self.matrix, self.hues, zoom_level)
+                actual_hues = numpy.concatenate([h for _, h in strips])
+                # Pixels that aren't set are black no matter what their hue
+                # is, so only compare the ones that are set.
+                is_set = expected_matrix != 0
+                self.assertTrue(
+                    (expected_hues[is_set] == actual_hues[is_set]).all())
+
+    def test_black_and_white(self):
+        strips = list(visual_diff.get_image_strips(
+            self.tokens_a, self.tokens_b, None, 2))
+        self.assertTrue(all(hues is None for _, hues in strips))
+        actual = numpy.concatenate([matrix for matrix, _ in strips])
+        expected, _ = ImagePyramid.downscale(self.matrix, None, 2)
+        self.assertTrue((expected == actual).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,348 @@
+import collections
+import numpy
+import numpy.typing
+from typing import Container, Optional
+
+import find_duplicates
+import minhash
+import utils
+
+
+# Rather than comparing every pair of files, we can find duplicated code in a
+# whole corpus at once, the way MOSS does. We hash every run of KGRAM_LENGTH
+# tokens (a k-gram) and, using winnowing, keep only the k-grams whose hashes
+# are the smallest in some window of consecutive k-grams as the file's
+# fingerprints. The windows are sized so that any two identical runs of at
+# least MIN_PIECE_LENGTH tokens have a fingerprint in common. Putting every
+# fingerprint of every file in one index tells us where to look, and we grow
+# each shared fingerprint into the longest identical run of tokens containing
+# it. Finally, we gather up runs that are near each other, and look for
+# segments in just the part of the matrix around them, using the same code as
+# everywhere else. The time this takes grows with the amount of duplicated
+# code, not with the number of pairs of files. The only segments we miss are
+# ones where no MIN_PIECE_LENGTH tokens in a row are identical.
+KGRAM_LENGTH = 6
+MIN_PIECE_LENGTH = 12
+# A fingerprint that shows up in more places than this is boilerplate, and
+# comparing every pair of places would take quadratic time, so we ignore it.
+# Any duplicated code long enough to report will almost always have other,
+# rarer fingerprints too.
+MAX_OCCURRENCES = 100
+# When growing a shared fingerprint, we compare this many tokens at a time at
+# first, doubling each time they all match.
+_FIRST_STEP = 64
+
+
+def _sliding_min(
+    values: numpy.typing.NDArray[numpy.uint64], window: int
+) -> numpy.typing.NDArray[numpy.uint64]:
+    """
+    We return the minimum of every window of consecutive values, in linear
+    time, using the van Herk/Gil-Werman algorithm: split the values into
+    blocks the size of a window, and every window is the end of one block
+    followed by the start of the next.
+    """
+    count = len(values) - window + 1
+    padded = numpy.full(-(-len(values) // window) * window,
+                        numpy.iinfo(numpy.uint64).max, dtype=numpy.uint64)
+    padded[:len(values)] = values
+    blocks = padded.reshape(-1, window)
+    prefixes = numpy.minimum.accumulate(blocks, axis=1).ravel()
+    suffixes = numpy.minimum.accumulate(
+        blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return numpy.minimum(suffixes[:count],
+                         prefixes[window - 1:window - 1 + count])
+
+
+def get_fingerprints(
+    token_ids: numpy.typing.NDArray[numpy.int32],
+    kgram_length: int,
+    window: int,
+) -> tuple[numpy.typing.NDArray[numpy.int64],
+           numpy.typing.NDArray[numpy.uint64]]:
+    """
+    We return the positions of the k-grams chosen as fingerprints by
+    winnowing, and their hashes. Ties for the smallest hash in a window are
+    all chosen.
+    """
+    hashes = minhash.hash_shingles(token_ids, kgram_length)
+    if len(hashes) < window:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return empty, numpy.zeros(0, dtype=numpy.uint64)
+    minimums = _sliding_min(hashes, window)
+    # A k-gram is the smallest one in some window containing it exactly when
+    # it equals the largest of the minimums of those windows. We pad the
+    # minimums with 0's, which never win, so every k-gram has window of them.
+    # Taking the complement of unsigned values reverses their order, which
+    # turns the sliding minimum into a sliding maximum.
+    padding = numpy.zeros(window - 1, dtype=numpy.uint64)
+    padded = numpy.concatenate([padding, minimums, padding])
+    largest = ~_sliding_min(~padded, window)
+    positions = numpy.flatnonzero(hashes == largest)
+    return positions, hashes[positions]
+
+
+def _match_length(
+    token_ids: numpy.typing.NDArray[numpy.int32], a: int, b: int, limit: int
+) -> int:
+    """
+    We return how many tokens starting at a are equal to the ones starting at
+    b, up to a maximum of limit.
+    """
+    length = 0
+    step = _FIRST_STEP
+    while length < limit:
+        count = min(step, limit - length)
+        mismatches = numpy.flatnonzero(
+            token_ids[a + length:a + length + count] !=
+            token_ids[b + length:b + length + count])
+        if len(mismatches) > 0:
+            return length + int(mismatches[0])
+        length += count
+        step *= 2
+    return limit
+
+
+def _find_pieces(
+    token_ids: numpy.typing.NDArray[numpy.int32],
+    offsets: list[int],
+    piece_length: int,
+) -> list[tuple[int, int, int]]:
+    """
+    We return the start positions and lengths of all the pairs of identical
+    runs of at least piece_length tokens, as (start a, start b, length) with
+    a < b. Positions are in the concatenation of all the files.
+    """
+    kgram_length = min(KGRAM_LENGTH, piece_length)
+    window = piece_length - kgram_length + 1
+    all_positions = []
+    all_hashes = []
+    for start, end in zip(offsets, offsets[1:]):
+        positions, hashes = get_fingerprints(
+            token_ids[start:end], kgram_length, window)
+        all_positions.append(positions + start)
+        all_hashes.append(hashes)
+    if not all_positions:
+        return []
+    positions = numpy.concatenate(all_positions)
+    hashes = numpy.concatenate(all_hashes)
+
+    # Sort the index by hash, and find every pair of places that share one.
+    order = numpy.argsort(hashes, kind="stable")
+    positions, hashes = positions[order], hashes[order]
+    group_starts = numpy.flatnonzero(numpy.diff(hashes)) + 1
+    pairs: list[tuple[int, int]] = []
+    for group in numpy.split(positions, group_starts):
+        if 1 < len(group) <= MAX_OCCURRENCES:
+            group = numpy.sort(group)
+            for k in range(len(group) - 1):
+                pairs.extend((int(group[k]), int(b)) for b in group[k + 1:])
+    return grow_pieces(token_ids, offsets, pairs, piece_length)
+
+
+def grow_pieces(
+    token_ids: numpy.typing.NDArray[numpy.int32],
+    offsets: list[int],
+    pairs: list[tuple[int, int]],
+    piece_length: int,
+) -> list[tuple[int, int, int]]:
+    """
+    The pairs are positions (a, b), with a < b, where the tokens are known to
+    match. We grow each one in both directions into the longest identical runs
+    of tokens containing it, without crossing into another file, and return
+    the ones at least piece_length long in the same format as _find_pieces.
+    """
+    # Nearby pairs in the same run all grow into the same piece. To
+    # only grow it once, go through the pairs along each diagonal (i.e., each
+    # offset between the two runs) in order, skipping any inside the last one.
+    pairs.sort(key=lambda pair: (pair[1] - pair[0], pair[0]))
+    file_ends = numpy.array(offsets[1:])
+    reversed_ids = token_ids[::-1]
+    total = len(token_ids)
+    pieces = []
+    last_offset, last_end = None, 0
+    for a, b in pairs:
+        if b - a == last_offset and a < last_end:
+            continue
+        file_a = int(numpy.searchsorted(file_ends, a, side="right"))
+        file_b = int(numpy.searchsorted(file_ends, b, side="right"))
+        before = _match_length(
+            reversed_ids, total - a, total - b,
+            min(a - offsets[file_a], b - offsets[file_b]))
+        after = _match_length(token_ids, a, b, min(offsets[file_a + 1] - a,
+                                                   offsets[file_b + 1] - b))
+        last_offset, last_end = b - a, a + after
+        if before + after >= piece_length:
+            pieces.append((a - before, b - before, before + after))
+    return pieces
+
+
+def _get_regions(
+    pieces: list[tuple[int, int, int]], margin: int, shape: tuple[int, int]
+) -> list[tuple[int, int, int, int]]:
+    """
+    The pieces are identical runs of tokens between the same pair of files, as
+    (start a, start b, length). We return the parts of the matrix comparing the
+    files that are worth searching for segments, as (start row, end row, start
+    column, end column) with exclusive ends. Each one surrounds some pieces
+    with at least margin pixels on every side, and pieces within margin of
+    each other end up in the same one.
+    """
+    regions: list[tuple[int, int, int, int]] = []
+    for start_a, start_b, length in sorted(pieces):
+        region = (max(0, start_a - margin),
+                  min(shape[0], start_a + length + margin),
+                  max(0, start_b - margin),
+                  min(shape[1], start_b + length + margin))
+        # Merge with every region this one overlaps, which can cause it to
+        # overlap more, until there are no more.
+        merged = True
+        while merged:
+            merged = False
+            for other in regions:
+                if (other[0] < region[1] and region[0] < other[1] and
+                        other[2] < region[3] and region[2] < other[3]):
+                    regions.remove(other)
+                    region = (min(region[0], other[0]),
+                              max(region[1], other[1]),
+                              min(region[2], other[2]),
+                              max(region[3], other[3]))
+                    merged = True
+                    break
+        regions.append(region)
+    return regions
+
+
+def _search_region(
+    tokens_a: numpy.typing.NDArray[numpy.str_],
+    tokens_b: numpy.typing.NDArray[numpy.str_],
+    region: tuple[int, int, int, int],
+    min_length: int,
+    is_single_file: bool,
+    max_pixels: Optional[int],
+) -> set[tuple[int, int, int, int, int]]:
+    """
+    We return the segments of at least min_length in the region of the matrix
+    comparing tokens_a to tokens_b, in the same format as get_segments.
+    Segments can grow by merging with ones next to them, so if any come within
+    min_length of the edge of the region, we make it bigger and try again. If
+    the region is bigger than max_pixels, we search it without building its
+    matrix (see find_duplicates.get_sparse_segments), which finds the same
+    segments.
+    """
+    start_a, end_a, start_b, end_b = region
+    while True:
+        region_a = tokens_a[start_a:end_a]
+        region_b = tokens_b[start_b:end_b]
+        if (max_pixels is not None and
+                (end_a - start_a) * (end_b - start_b) > max_pixels):
+            rows, cols = utils.get_diagonal_matches(region_a, region_b)
+            if is_single_file:
+                is_duplicate = rows + start_a != cols + start_b
+                rows, cols = rows[is_duplicate], cols[is_duplicate]
+            segments = [
+                (size, (top_r, top_c), (bottom_r, bottom_c))
+                for size, top_r, top_c, bottom_r, bottom_c
+                in find_duplicates.get_sparse_segments(
+                    rows, cols, (len(region_a), len(region_b)),
+                    False).tolist()
+                if size >= min_length]
+        else:
+            matrix = utils.make_matrix(region_a, region_b)
+            if is_single_file:
+                # Remove the main diagonal, like find_duplicates does when
+                # comparing a file to itself, since it isn't duplicated code.
+                rows = numpy.arange(max(start_a, start_b), min(end_a, end_b))
+                matrix[rows - start_a, rows - start_b] = 0
+            segments = [(segment.size(), segment.top, segment.bottom)
+                        for segment in find_duplicates.get_segments(
+                            matrix, False)
+                        if segment.size() >= min_length]
+        tops = [top for _, top, _ in segments]
+        bottoms = [bottom for _, _, bottom in segments]
+        grown = (
+            max(0, start_a - min_length)
+            if any(r < min_length for r, _ in tops) else start_a,
+            min(len(tokens_a), end_a + min_length)
+            if any(r >= len(region_a) - min_length for r, _ in bottoms)
+            else end_a,
+            max(0, start_b - min_length)
+            if any(c < min_length for _, c in tops) else start_b,
+            min(len(tokens_b), end_b + min_length)
+            if any(c >= len(region_b) - min_length for _, c in bottoms)
+            else end_b)
+        if grown == (start_a, end_a, start_b, end_b):
+            break
+        start_a, end_a, start_b, end_b = grown
+
+    results = set()
+    for size, (top_r, top_c), (bottom_r, bottom_c) in segments:
+        top_a, top_b = top_r + start_a, top_c + start_b
+        # When comparing a file to itself, every segment shows up twice, once
+        # on each side of the main diagonal. Only keep one of them.
+        if is_single_file and top_a > top_b:
+            continue
+        results.add((size, top_a, top_b,
+                     bottom_r + start_a, bottom_c + start_b))
+    return results
+
+
+def get_segments(
+    token_arrays: list[numpy.typing.NDArray[numpy.str_]],
+    min_length: int,
+    max_pixels: Optional[int]=None,
+    pairs: Optional[Container[tuple[int, int]]]=None,
+) -> dict[tuple[int, int], set[tuple[int, int, int, int, int]]]:
+    """
+    We return a dict mapping the indices (i, j) of pairs of token arrays, with
+    i <= j, to the segments of at least min_length tokens between them that
+    find_duplicates.get_segments would find when comparing those arrays. Each
+    segment is given as a tuple of its size and then the row and column of its
+    top-left and bottom-right ends. When i == j, we only include the segments
+    above the main diagonal. We never build more than max_pixels of a matrix
+    at once: bigger parts of it are searched without building them. If pairs
+    is given, we only search those pairs of arrays.
+    """
+    token_ids, offsets = utils.get_token_ids(token_arrays)
+    pieces = _find_pieces(token_ids, offsets,
+                          min(MIN_PIECE_LENGTH, min_length))
+    return search_pieces(token_arrays, offsets, pieces, min_length,
+                         max_pixels, pairs)
+
+
+def search_pieces(
+    token_arrays: list[numpy.typing.NDArray[numpy.str_]],
+    offsets: list[int],
+    pieces: list[tuple[int, int, int]],
+    min_length: int,
+    max_pixels: Optional[int]=None,
+    pairs: Optional[Container[tuple[int, int]]]=None,
+) -> dict[tuple[int, int], set[tuple[int, int, int, int, int]]]:
+    """
+    We return the same results as get_segments, searching around the given
+    pieces of identical tokens, which are in the format _find_pieces returns,
+    with positions in the concatenation of all the arrays (which starts each
+    one at its offset).
+    """
+    file_ends = numpy.array(offsets[1:])
+    pieces_by_files = collections.defaultdict(list)
+    for start_a, start_b, length in pieces:
+        file_a = int(numpy.searchsorted(file_ends, start_a, side="right"))
+        file_b = int(numpy.searchsorted(file_ends, start_b, side="right"))
+        pieces_by_files[(file_a, file_b)].append(
+            (start_a - offsets[file_a], start_b - offsets[file_b], length))
+
+    results: dict[tuple[int, int], set[tuple[int, int, int, int, int]]] = {}
+    for (file_a, file_b), file_pieces in sorted(pieces_by_files.items()):
+        if pairs is not None and (file_a, file_b) not in pairs:
+            continue
+        tokens_a, tokens_b = token_arrays[file_a], token_arrays[file_b]
+        segments = set()
+        for region in _get_regions(file_pieces, min_length,
+                                   (len(tokens_a), len(tokens_b))):
+            segments.update(_search_region(
+                tokens_a, tokens_b, region, min_length, file_a == file_b,
+                max_pixels))
+        if segments:
+            results[(file_a, file_b)] = segments
+    return results
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import numpy
+import unittest
+
+import minhash
+import winnowing
+
+
+class TestFingerprints(unittest.TestCase):
+    def setUp(self):
+        self.rng = numpy.random.default_rng(1)
+
+    def test_sliding_min(self):
+        values = self.rng.integers(0, 1 << 63, 100, dtype=numpy.uint64)
+        for window in (1, 3, 7, 100):
+            expected = [values[i:i + window].min()
+                        for i in range(len(values) - window + 1)]
+            self.assertEqual(expected, winnowing._sliding_min(
+                values, window).tolist())
+
+    def test_smallest_in_every_window(self):
+        token_ids = self.rng.integers(0, 100, 500, dtype=numpy.int32)
+        positions, hashes = winnowing.get_fingerprints(token_ids, 5, 10)
+        all_hashes = minhash.hash_shingles(token_ids, 5)
+        self.assertTrue((all_hashes[positions] == hashes).all())
+        expected = set()
+        for start in range(len(all_hashes) - 10 + 1):
+            window = all_hashes[start:start + 10]
+            expected.update(
+                (start + numpy.flatnonzero(window == window.min())).tolist())
+        self.assertEqual(expected, set(positions.tolist()))
+
+    def test_too_short(self):
+        token_ids = numpy.arange(10, dtype=numpy.int32)
+        positions, hashes = winnowing.get_fingerprints(token_ids, 5, 10)
+        self.assertEqual(0, len(positions))
+        self.assertEqual(0, len(hashes))
+
+
+class TestSegments(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(1)
+        vocabulary = numpy.array([f"token{i}" for i in range(50)])
+        self.files = [vocabulary[rng.integers(0, len(vocabulary), 2000)]
+                      for _ in range(3)]
+
+    def test_unrelated_files(self):
+        self.assertEqual({}, winnowing.get_segments(self.files, 300))
+
+    def test_duplicate_between_files(self):
+        self.files[2][700:1000] = self.files[0][100:400]
+        self.assertEqual({(0, 2): {(300, 100, 700, 399, 999)}},
+                         winnowing.get_segments(self.files, 300))
+
+    def test_duplicate_within_file(self):
+        self.files[1][100:400] = self.files[1][1200:1500]
+        self.assertEqual({(1, 1): {(300, 100, 1200, 399, 1499)}},
+                         winnowing.get_segments(self.files, 300))
+
+    def test_small_changes(self):
+        # Like the matrix-based search, we find segments with a few changes in
+        # them, but only count the tokens that match.
+        self.files[2][700:1000] = self.files[0][100:400]
+        self.files[2][800] = "changed"
+        self.files[2][900] = "changed"
+        self.assertEqual({(0, 2): {(298, 100, 700, 399, 999)}},
+                         winnowing.get_segments(self.files, 200))
+
+    def test_big_regions(self):
+        # Regions too big to build the matrix for are searched without it,
+        # which finds the same segments.
+        self.files[2][700:1000] = self.files[0][100:400]
+        self.files[1][100:400] = self.files[1][1200:1500]
+        expected = winnowing.get_segments(self.files, 300)
+        self.assertEqual(
+            expected, winnowing.get_segments(self.files, 300, max_pixels=1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,36 +1,54 @@
 from functools import partial
+import multiprocessing.pool
 import numpy
 import numpy.typing
-import PIL.Image
 import PIL.ImageTk
 import platform
 import tkinter as tk
 from typing import Optional
 
 from image_pyramid import ImagePyramid
+from latency import LatencyLog
+from tile_cache import TileCache, TileKey
 
 class ZoomMap(tk.Canvas):
+    # The map is drawn as a grid of tiles, each this many times smaller than
+    # the map itself.
+    _TILES_PER_SCREEN: int = 3
+    _TILE_CACHE_SIZE: int = 128  # Number of rendered tiles to keep around
+    _PREFETCH_POLL_MS: int = 25  # How often to check on background rendering
+    _HUE_POLL_MS: int = 200  # How often to check whether the hues are ready
+
     def __init__(
         self,
         tk_parent: tk.Widget,
-        matrix: numpy.typing.NDArray[numpy.uint8],
-        hues: Optional[numpy.typing.NDArray[numpy.uint8]],
-        sidelength: int,
+        pyramid: ImagePyramid,
+        latency: Optional[LatencyLog]=None,
     ) -> None:
+        sidelength = pyramid.get_sidelength()
         super().__init__(tk_parent, height=sidelength, width=sidelength,
                          bg="green", xscrollincrement=1, yscrollincrement=1)
-        # We keep a handle to the actual image being displayed, because TK
-        # doesn't do that itself and then it gets garbage collected while it's
-        # still supposed to be on the screen. We also keep track of the TK
-        # image object, so we can delete it later when we create a new, updated
-        # one to take its place.
-        self._cached_image: Optional[PIL.ImageTk.PhotoImage] = None
-        # TK canvas images are referred to by their ID numbers.
-        self._tk_image: Optional[int] = None
-
-        self._pyramid = ImagePyramid(matrix, hues, sidelength)
-
-        self._set_image()
+        # For every tile on the canvas, we keep track of the TK canvas item
+        # (referred to by its ID number), so we can delete it later. We also
+        # keep a handle to the actual image being displayed, because TK doesn't
+        # do that itself and then it gets garbage collected while it's still
+        # supposed to be on the screen.
+        self._displayed: dict[TileKey, tuple[int, PIL.ImageTk.PhotoImage]] = {}
+
+        self._pyramid = pyramid
+        self._sidelength = sidelength
+        self._latency = LatencyLog() if latency is None else latency
+        self._tile_size = -(-sidelength // self._TILES_PER_SCREEN)
+        self._tiles = TileCache(pyramid, self._tile_size,
+                                self._TILE_CACHE_SIZE, self._latency)
+        self._polling_tiles = False
+        # How far the most recent click-and-drag moved the map, which is our
+        # best guess for where the user will move it next.
+        self._last_pan = (0, 0)
+        self._drag_start = (0, 0)
+
+        self._update_tiles()
+        self._prefetch(sidelength // 2, sidelength // 2, self._last_pan)
         self.pack()
         for button_name, function in (("<Button-1>", self._on_click),
                                       ("<B1-Motion>", self._on_drag),
@@ -50,42 +68,127 @@ class ZoomMap(tk.Canvas):
             # whereas (as of January 2025) Ubuntu uses Tcl/Tk version 8.6.14,
             # which lacks this event type.
             self.bind("<TouchpadScroll>", self._zoom_touchpad)
+        self.bind("<Destroy>", lambda _: self._tiles.shutdown())
 
-    def _set_image(self) -> None:
+    def _keys_near_screen(
+        self, zoom_level: int, top_left_x: int, top_left_y: int, margin: int
+    ) -> list[TileKey]:
         """
-        Delete the old image, if it exists, then display the new one.
+        Returns the tiles that overlap the screen when its top-left corner is
+        at the given canvas coordinates, extended by margin pixels on each side.
+        """
+        return self._tiles.keys_for_region(
+            zoom_level,
+            top_left_x - margin, top_left_y - margin,
+            top_left_x + self._sidelength + margin,
+            top_left_y + self._sidelength + margin)
 
-        The image to use is at the current zoom level, 3 times taller and wider
-        than the displayed window.
+    def _update_tiles(self) -> None:
+        """
+        Display every tile on or near the screen that isn't displayed already,
+        and delete the ones that have gone far offscreen. When the map has been
+        dragged, that means we only render the newly exposed tiles.
         """
-        if self._tk_image is not None:
-            # Clean up the old image.
-            self.delete(self._tk_image)
-            self._cached_image = None
-            self._tk_image = None
-
-        # We'll make an image that covers as much of the 3-screen-by-3-screen
-        # area centered on the actual screen center as we have data to cover.
         # Start by figuring out where the top-left corner of the screen is in
         # canvas coordinates.
         top_left_x = int(self.canvasx(0))
         top_left_y = int(self.canvasy(0))
+        zoom_level = self._pyramid.get_zoom_level()
+
+        for key in self._keys_near_screen(
+                zoom_level, top_left_x, top_left_y, self._tile_size):
+            if key in self._displayed:
+                continue
+            tile = self._tiles.get(key)
+            if tile is None:
+                # This tile is outside the data, so there's nothing to show.
+                # TODO: Should we snap to the nearest edge or something? It
+                # would be nice if we couldn't explore outside the data.
+                continue
+            image, min_x, min_y = tile
+            with self._latency.measure("create PhotoImage"):
+                photo_image = PIL.ImageTk.PhotoImage(image)
+            item = self.create_image(min_x, min_y, anchor=tk.NW,
+                                     image=photo_image)
+            self._displayed[key] = (item, photo_image)
 
-        submatrix, min_x, min_y = self._pyramid.get_submatrix(top_left_x,
-                                                              top_left_y)
-        if len(submatrix) == 0:
-            # We're so far away from the actual data that none of it will fit
-            # on or even near the screen. Rather than attempting and failing to
-            # display this data, just don't show it in the first place.
-            # TODO: Should we snap to the nearest edge or something? It would
-            # be nice if we couldn't explore outside the data.
+        # Keep a wider margin of tiles around than we render, so that dragging
+        # back and forth doesn't keep deleting and recreating the same ones.
+        to_keep = set(self._keys_near_screen(
+            zoom_level, top_left_x, top_left_y, 2 * self._tile_size))
+        for key in list(self._displayed):
+            if key not in to_keep:
+                self._remove_tile(key)
+
+    def _remove_tile(self, key: TileKey) -> None:
+        item, _ = self._displayed.pop(key)
+        self.delete(item)
+
+    def _prefetch(
+        self, mouse_x: int, mouse_y: int, pan: tuple[int, int]
+    ) -> None:
+        """
+        Starts rendering the tiles we expect to display next: the ones we'd see
+        if the map moved by pan, and the ones we'd see after zooming in or out
+        around the mouse.
+        """
+        top_left_x = int(self.canvasx(0))
+        top_left_y = int(self.canvasy(0))
+        zoom_level = self._pyramid.get_zoom_level()
+        predictions: list[TileKey] = []
+        if pan != (0, 0):
+            predictions.extend(self._keys_near_screen(
+                zoom_level, top_left_x + pan[0], top_left_y + pan[1],
+                self._tile_size))
+        for amount in (-1, 1):
+            # This is the same adjustment _zoom makes to keep the pixel under
+            # the mouse in place.
+            location_shift = (2 ** -amount) - 1
+            predictions.extend(self._keys_near_screen(
+                zoom_level + amount,
+                top_left_x + int((top_left_x + mouse_x) * location_shift),
+                top_left_y + int((top_left_y + mouse_y) * location_shift),
+                0))
+        self._tiles.prefetch(predictions)
+
+        if not self._polling_tiles:
+            self._polling_tiles = True
+            self.after(self._PREFETCH_POLL_MS, self._poll_tiles)
+
+    def _poll_tiles(self) -> None:
+        """
+        Picks up tiles rendered in the background. We can't hear from the
+        rendering thread directly (tkinter isn't thread-safe), so we check on
+        it periodically from Tk's event loop until it's done.
+        """
+        if self._tiles.collect():
+            self.after(self._PREFETCH_POLL_MS, self._poll_tiles)
+        else:
+            self._polling_tiles = False
+
+    def add_hues_when_ready(
+        self,
+        hue_levels: multiprocessing.pool.AsyncResult[
+            list[numpy.typing.NDArray[numpy.uint8]]],
+    ) -> None:
+        """
+        The map starts out black and white. Once the hue_levels (computed in
+        another process, and in the form ImagePyramid.build_hue_levels
+        returns) are ready, color it in.
+        """
+        if not hue_levels.ready():
+            self.after(self._HUE_POLL_MS,
+                       partial(self.add_hues_when_ready, hue_levels))
             return
 
-        # Hold on to the image because tkinter doesn't, and we don't want it to
-        # get garbage collected at the end of this function!
-        self._cached_image = self._to_image(submatrix)
-        self._tk_image = self.create_image(min_x, min_y, anchor=tk.NW,
-                                           image=self._cached_image)
+        self._pyramid.set_hue_levels(hue_levels.get())
+        # Everything rendered so far is black and white, so start over.
+        self._tiles.clear()
+        for key in list(self._displayed):
+            self._remove_tile(key)
+        self._update_tiles()
+        self._prefetch(self._sidelength // 2, self._sidelength // 2,
+                       self._last_pan)
 
     def _zoom_mac(self, event: tk.Event) -> None:
         sign = 1 if event.delta > 0 else -1
@@ -114,34 +217,46 @@ class ZoomMap(tk.Canvas):
         if not self._pyramid.zoom(amount):
             return  # We're at an extreme level, and didn't actually zoom.
 
-        # Otherwise, we changed zoom levels, so adjust everything accordingly.
-        # We need to move the map so the pixels that started under the mouse are
-        # still under it afterwards.
-        location_shift = (2 ** -amount) - 1
-        self.xview_scroll(int(self.canvasx(event.x) * location_shift), "units")
-        self.yview_scroll(int(self.canvasy(event.y) * location_shift), "units")
+        with self._latency.measure("zoom", self):
+            # Otherwise, we changed zoom levels, so adjust everything
+            # accordingly. We need to move the map so the pixels that started
+            # under the mouse are still under it afterwards.
+            location_shift = (2 ** -amount) - 1
+            self.xview_scroll(int(self.canvasx(event.x) * location_shift),
+                              "units")
+            self.yview_scroll(int(self.canvasy(event.y) * location_shift),
+                              "units")
 
-        self._set_image()
+            # None of the tiles from the old zoom level are useful any more.
+            for key in list(self._displayed):
+                self._remove_tile(key)
+            self._update_tiles()
+            self._prefetch(event.x, event.y, self._last_pan)
 
     def _on_click(self, event: tk.Event) -> None:
         self._click_coords = [event.x, event.y]
+        self._drag_start = (int(self.canvasx(0)), int(self.canvasy(0)))
 
     def _on_drag(self, event: tk.Event) -> None:
-        dx = self._click_coords[0] - event.x
-        dy = self._click_coords[1] - event.y
-        self.xview_scroll(dx, "units")
-        self.yview_scroll(dy, "units")
-        self._on_click(event)
+        with self._latency.measure("drag", self):
+            dx = self._click_coords[0] - event.x
+            dy = self._click_coords[1] - event.y
+            self.xview_scroll(dx, "units")
+            self.yview_scroll(dy, "units")
+            self._click_coords = [event.x, event.y]
+
+            self._update_tiles()
+            # Get ready for the map to keep moving in the same direction.
+            step = self._tile_size
+            self._prefetch(event.x, event.y,
+                           ((dx > 0) * step - (dx < 0) * step,
+                            (dy > 0) * step - (dy < 0) * step))
 
     def _on_unclick(self, event: tk.Event) -> None:
-        self._set_image()
-
-    @staticmethod
-    def _to_image(
-        matrix: numpy.typing.NDArray[numpy.uint8]
-    ) -> PIL.ImageTk.PhotoImage:
-        image = PIL.Image.fromarray(matrix, mode="HSV")
-        return PIL.ImageTk.PhotoImage(image)
+        with self._latency.measure("drag release", self):
+            self._last_pan = (int(self.canvasx(0)) - self._drag_start[0],
+                              int(self.canvasy(0)) - self._drag_start[1])
+            self._prefetch(event.x, event.y, self._last_pan)
 
     @property
     def zoom_level(self) -> int:  # Used in gui.py